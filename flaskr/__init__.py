@@ -7,26 +7,34 @@ from flask_cors import CORS
 
 from .config import Config
 from .models import db
-from .blueprints.pages import populate_pages
+from .startup import timed_phase, prepare_database, register_commands, log_startup_report
+from .indexes import warm_indexes
+from .compression import init_compression
+from .workspaces import init_workspaces
 
 
 # This creates the Flask app.  This is just an instance of the Flask class for now
 def create_app(test_config=None):
     # We create an app with all configuration files stored relative to the route folder here.
     app = Flask(__name__)
-    CORS(app, resources={r"/page/*": {"origins": "http://localhost:3000"}})
 
-    if test_config is None:
-        app.config.from_object(Config)
-    else:
-        app.config.from_mapping(test_config)
-    db.init_app(app)
-    migrate = Migrate(app, db)
-
-    with app.app_context():
-        db.create_all()
+    with timed_phase(app, 'config'):
+        CORS(app, resources={r"/page/*": {"origins": "http://localhost:3000"}})
         if test_config is None:
-            populate_pages()
+            app.config.from_object(Config)
+        else:
+            app.config.from_mapping(test_config)
+
+    with timed_phase(app, 'extensions'):
+        db.init_app(app)
+        migrate = Migrate(app, db)
+        register_commands(app)
+        init_compression(app)
+        init_workspaces(app)
+
+    # Normally done once with `flask init-db`, see startup.py
+    if app.config.get('INIT_DB_ON_STARTUP'):
+        prepare_database(app, pages=test_config is None)
 
     # Ensure the instance folder exists
     try:
@@ -44,21 +52,30 @@ def create_app(test_config=None):
     # Blueprints:  
     # Views are functions to respond to requests.  
     # Blueprints are groups of related views.
-    from .blueprints import graph, notes, pages, entities, vis
-    # app.register_blueprint(auth.bp)
-    app.register_blueprint(graph.bp)
-    app.register_error_handler(graph.NodeNotFoundError, graph.handle_node_not_found_error)
-    app.register_error_handler(graph.InvalidNodeIDError, graph.handle_invalid_node_id_error)
-    app.register_error_handler(entities.RequestJSONBodyError, entities.handle_bad_json_body_error)
-    app.register_error_handler(entities.RecordAlreadyExists, entities.handle_record_already_exists_error)
+    with timed_phase(app, 'blueprints'):
+        from .blueprints import graph, notes, pages, entities, vis, jobs, events
+        # app.register_blueprint(auth.bp)
+        app.register_blueprint(graph.bp)
+        app.register_error_handler(graph.NodeNotFoundError, graph.handle_node_not_found_error)
+        app.register_error_handler(graph.InvalidNodeIDError, graph.handle_invalid_node_id_error)
+        app.register_error_handler(entities.RequestJSONBodyError, entities.handle_bad_json_body_error)
+        app.register_error_handler(entities.RecordAlreadyExists, entities.handle_record_already_exists_error)
 
-    app.register_blueprint(notes.bp)
-    app.register_blueprint(pages.bp)
-    app.register_blueprint(entities.people_bp)
-    app.register_blueprint(entities.loc_bp)
-    app.register_blueprint(entities.event_bp)
-    app.register_blueprint(entities.tag_bp)
-    app.register_blueprint(vis.bp)
-    app.add_url_rule('/', endpoint='hello')
-    
+        app.register_blueprint(notes.bp)
+        app.register_blueprint(pages.bp)
+        app.register_blueprint(entities.people_bp)
+        app.register_blueprint(entities.loc_bp)
+        app.register_blueprint(entities.event_bp)
+        app.register_blueprint(entities.tag_bp)
+        app.register_blueprint(entities.entities_bp)
+        app.register_blueprint(vis.bp)
+        app.register_blueprint(jobs.bp)
+        app.register_blueprint(events.bp)
+        app.add_url_rule('/', endpoint='hello')
+
+    # Indexes are built on first use unless asked to warm up in the background
+    if app.config.get('WARM_INDEXES') == 'background':
+        warm_indexes(app)
+
+    log_startup_report(app)
     return app
@@ -0,0 +1,208 @@
+"""
+Whole-graph metrics computed with NumPy over the cached graph arrays (see graphdata.py).
+
+    degree       - number of distinct live neighbours
+    pagerank     - PageRank of the undirected graph, damping 0.85
+    betweenness  - Brandes betweenness centrality, estimated from a sample of source nodes
+    component    - connected component label
+    community    - community label from label propagation
+
+Each metric is computed the first time it is asked for and then cached until the graph
+revision moves.  Component and community labels are numbered from 0 in order of decreasing size.
+"""
+import threading
+
+import numpy as np
+from flask import current_app
+
+from .graphdata import graph_arrays, GraphArrays
+from .indexes import LazyIndex
+from .revisions import GRAPH
+
+METRICS = ('degree', 'pagerank', 'betweenness', 'component', 'community')
+
+
+def _neighbours(indptr: np.ndarray, indices: np.ndarray, frontier: np.ndarray):
+    """All (node, neighbour) pairs for the nodes in frontier, without a Python loop"""
+    starts = indptr[frontier]
+    counts = indptr[frontier + 1] - starts
+    total = counts.sum()
+    if total == 0:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    owners = np.repeat(frontier, counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, indices[np.repeat(starts, counts) + offsets]
+
+def _relabel_by_size(labels: np.ndarray) -> np.ndarray:
+    """Renumber labels 0, 1, 2... from the largest group to the smallest"""
+    unique, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    order = np.argsort(-counts, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[inverse]
+
+
+def pagerank(graph: GraphArrays, damping: float = 0.85, tol: float = 1e-8, max_iter: int = 100) -> np.ndarray:
+    n = graph.n_nodes
+    if n == 0:
+        return np.empty(0)
+    src = np.concatenate([graph.src, graph.dst])
+    dst = np.concatenate([graph.dst, graph.src])
+    degree = np.bincount(src, minlength=n).astype(np.float64)
+    dangling = degree == 0
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        share = np.divide(rank, degree, out=np.zeros(n), where=~dangling)
+        spread = np.bincount(dst, weights=share[src], minlength=n)
+        new_rank = (1 - damping) / n + damping * (spread + rank[dangling].sum() / n)
+        if np.abs(new_rank - rank).sum() < tol:
+            return new_rank
+        rank = new_rank
+    return rank
+
+def connected_components(graph: GraphArrays) -> np.ndarray:
+    """Min-label propagation with pointer jumping"""
+    labels = np.arange(graph.n_nodes)
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, graph.src, labels[graph.dst])
+        np.minimum.at(labels, graph.dst, labels[graph.src])
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return _relabel_by_size(labels)
+
+def label_propagation(graph: GraphArrays, max_iter: int = 20, seed: int = 0) -> np.ndarray:
+    """
+    Each node repeatedly takes the label most common among itself and its neighbours (ties go to
+    the smallest label), until nothing changes.  Counting the node's own label stops the labels
+    flip-flopping between the two sides of a bipartite graph.
+    """
+    n = graph.n_nodes
+    if n == 0:
+        return np.empty(0, np.int64)
+    # Random initial labels, so ties don't all drift towards the lowest node ids
+    labels = np.random.default_rng(seed).permutation(n)
+    own = np.arange(n)
+    rows = np.concatenate([graph.src, graph.dst, own])
+    cols = np.concatenate([graph.dst, graph.src, own])
+    for _ in range(max_iter):
+        codes = rows * n + labels[cols]
+        unique, counts = np.unique(codes, return_counts=True)
+        node, label = unique // n, unique % n
+        # Sort by node, then most votes, then smallest label and take the first per node
+        order = np.lexsort((label, -counts, node))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = node[order][1:] != node[order][:-1]
+        new_labels = np.empty(n, np.int64)
+        new_labels[node[order][first]] = label[order][first]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return _relabel_by_size(labels)
+
+def betweenness(graph: GraphArrays, samples: int = 64, seed: int = 0) -> np.ndarray:
+    """
+    Brandes' algorithm from `samples` random sources (or every node, for small graphs), scaled up
+    to estimate the full betweenness.  Each BFS level is processed as one batch of array operations.
+    """
+    n = graph.n_nodes
+    result = np.zeros(n)
+    if n < 3:
+        return result
+    indptr, indices = graph.csr()
+    rng = np.random.default_rng(seed)
+    sources = np.arange(n) if n <= samples else rng.choice(n, samples, replace=False)
+
+    for source in sources:
+        dist = np.full(n, -1, np.int64)
+        sigma = np.zeros(n)
+        dist[source], sigma[source] = 0, 1.0
+        frontier = np.array([source])
+        levels = []  # The (parent, child) shortest path edges between each level and the next
+        depth = 0
+        while len(frontier):
+            parents, children = _neighbours(indptr, indices, frontier)
+            unseen = dist[children] < 0
+            next_frontier = np.unique(children[unseen])
+            dist[next_frontier] = depth + 1
+            on_path = dist[children] == depth + 1
+            parents, children = parents[on_path], children[on_path]
+            np.add.at(sigma, children, sigma[parents])
+            levels.append((parents, children))
+            frontier = next_frontier
+            depth += 1
+
+        delta = np.zeros(n)
+        for parents, children in reversed(levels):
+            np.add.at(delta, parents, sigma[parents] / sigma[children] * (1 + delta[children]))
+        delta[source] = 0
+        result += delta
+
+    # Every path is counted from both ends in an undirected graph
+    return result * (n / len(sources)) / 2
+
+
+class Analytics:
+    """The metrics for one revision of the graph, computed as they are asked for"""
+    def __init__(self, graph: GraphArrays, config):
+        self.graph = graph
+        self.config = config
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _compute(self, metric: str) -> np.ndarray:
+        if metric == 'degree':
+            return self.graph.degree()
+        if metric == 'pagerank':
+            return pagerank(self.graph)
+        if metric == 'betweenness':
+            return betweenness(self.graph, samples=self.config.get('ANALYTICS_BETWEENNESS_SAMPLES', 64))
+        if metric == 'component':
+            return connected_components(self.graph)
+        if metric == 'community':
+            return label_propagation(self.graph)
+        raise KeyError(metric)
+
+    def metric(self, metric: str) -> np.ndarray:
+        if metric not in self._metrics:
+            with self._lock:
+                if metric not in self._metrics:
+                    self._metrics[metric] = self._compute(metric)
+        return self._metrics[metric]
+
+    def rows(self, metrics=METRICS, positions: np.ndarray = None) -> list[dict]:
+        """One dictionary per node, for the given node positions (default all)"""
+        if positions is None:
+            positions = np.arange(self.graph.n_nodes)
+        columns = {m: self.metric(m)[positions].tolist() for m in metrics}
+        node_ids = self.graph.node_ids[positions].tolist()
+        node_types = self.graph.node_types[positions].tolist()
+        return [
+            {'node_id': node_id, 'node_type': node_type, **{m: columns[m][i] for m in metrics}}
+            for i, (node_id, node_type) in enumerate(zip(node_ids, node_types))
+        ]
+
+    def top(self, metric: str, k: int, metrics=METRICS) -> list[dict]:
+        values = self.metric(metric)
+        k = max(0, min(k, len(values)))
+        best = np.argpartition(-values, k - 1)[:k] if k else np.empty(0, np.int64)
+        best = best[np.lexsort((self.graph.node_ids[best], -values[best]))]
+        return self.rows(metrics, best)
+
+    def summary(self) -> dict:
+        return {
+            'nodes': self.graph.n_nodes,
+            'edges': self.graph.n_edges,
+            'components': int(self.metric('component').max() + 1) if self.graph.n_nodes else 0,
+            'communities': int(self.metric('community').max() + 1) if self.graph.n_nodes else 0
+        }
+
+
+class AnalyticsIndex(LazyIndex):
+    name = 'graph_analytics'
+    revision = GRAPH
+
+    def build(self, previous=None):
+        return Analytics(graph_arrays.state(), current_app.config)
+
+graph_analytics = AnalyticsIndex()
@@ -18,17 +18,26 @@ from flask import (
     Blueprint, request
 )
 from werkzeug.exceptions import abort, HTTPException
-from sqlalchemy import inspect
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect, select, func, or_, union
+from sqlalchemy.exc import IntegrityError
 
 from ..models import *
-from .graph import create_node, create_relationship, merge_nodes, soft_delete_node, delete_node
+from .graph import create_node, create_relationship, merge_nodes, soft_delete_nodes, delete_node, get_linked
 from ..utils import get_json_body, get_params
 from ..errors import *
+from ..suggest import tag_suggestions, entity_suggestions, ENTITY_TABLES
+from ..duplicates import entity_duplicates, ENTITY_MODELS
+from ..mentions import get_entity_mentions
+from ..jobs import job, enqueue
+from .jobs import _return_job
 
 people_bp = Blueprint('people', __name__, url_prefix='/people')
 loc_bp = Blueprint('location', __name__, url_prefix='/location')
 event_bp = Blueprint('event', __name__, url_prefix='/event')
 tag_bp = Blueprint('tag', __name__, url_prefix='/tag')
+entities_bp = Blueprint('entities', __name__, url_prefix='/entities')
 
 
 # Helpers
@@ -77,15 +86,18 @@ def _create_event(node_id, name, content, date):
     return event
 
 def _create_tag(node_id, name):
-    existing_tag = Tag.query.filter(Tag.name.ilike(name)).first()
-    if existing_tag is not None:
-        raise RecordAlreadyExists(name)
     tag = Tag(
         id=node_id,
         name=name
     )
     db.session.add(tag)
-    db.session.commit()
+    # Duplicates (ignoring case) are rejected by the unique index on name_key
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        delete_node(Node.query.get(node_id))
+        raise RecordAlreadyExists(name)
     db.session.refresh(tag)
     return tag
 
@@ -112,11 +124,12 @@ def create_entity(model_class, **kwargs):
     new_entity = create_function(node_id=node_id, **kwargs)
     return new_entity
 
-def soft_delete_entity(entity):
-    entity.deleted = 1
+def soft_delete_entity(entity, notes: bool = False):
+    """Soft delete an entity along with its node and relationships, in one transaction"""
+    # Tags share their id with their node
+    node_id = entity.id if isinstance(entity, Tag) else entity.node_id
+    soft_delete_nodes([node_id], notes=notes)
     db.session.commit()
-    soft_delete_node(Node.query.get(entity.node_id))
-    db.session.refresh(entity)
     return entity
 
 def hard_delete_entity(entity):
@@ -205,6 +218,111 @@ def api_create_events():
     event = create_entity('event', **data)
     return _return_entity(event)
 
+BUCKET_FORMATS = {
+    'day': '%Y-%m-%d',
+    'month': '%Y-%m',
+    'year': '%Y'
+}
+
+def _timeline_query(start: datetime = None, end: datetime = None, node_ids: list[int] = None):
+    """Dated, live events between start (inclusive) and end (exclusive)"""
+    query = (
+        select(Event)
+        .join(Node, Node.id == Event.node_id)
+        # Matches the ix_events_timeline partial index
+        .where(Event.date.is_not(None), Event.deleted.is_not(1))
+        .where(Node.deleted.is_not(1), Node.merged.is_(None))
+    )
+    if start is not None:
+        query = query.where(Event.date >= start)
+    if end is not None:
+        query = query.where(Event.date < end)
+    if node_ids:
+        # Events linked to any of the nodes, from either end of the relationship
+        linked = union(
+            select(Relationship.end).where(Relationship.start.in_(node_ids), Relationship.deleted.is_not(1)),
+            select(Relationship.start).where(Relationship.end.in_(node_ids), Relationship.deleted.is_not(1))
+        )
+        query = query.where(Event.node_id.in_(linked))
+    return query
+
+def get_timeline(start: datetime = None, end: datetime = None, node_ids: list[int] = None,
+                 after: tuple[datetime, int] = None, limit: int = 100) -> tuple[list[Event], tuple | None]:
+    """
+    A page of events in date order.
+    Args:
+        start, end: The date range, start inclusive and end exclusive
+        node_ids: Only events linked to one of these nodes
+        after: The (date, id) of the last event of the previous page
+        limit: The page size
+    Returns:
+        The events, and the (date, id) to pass as `after` for the next page (None on the last page)
+    """
+    query = _timeline_query(start, end, node_ids)
+    if after is not None:
+        # Keyset pagination: carry on from the last row seen, however deep into the timeline
+        date, id = after
+        query = query.where(or_(Event.date > date, (Event.date == date) & (Event.id > id)))
+    events = db.session.scalars(query.order_by(Event.date, Event.id).limit(limit + 1)).all()
+    if len(events) > limit:
+        events = events[:limit]
+        return events, (events[-1].date, events[-1].id)
+    return events, None
+
+def get_timeline_buckets(bucket: str, start: datetime = None, end: datetime = None, node_ids: list[int] = None) -> list[dict]:
+    """The number of events in each day, month or year of the range"""
+    events = _timeline_query(start, end, node_ids).subquery()
+    rows = db.session.execute(
+        select(func.strftime(BUCKET_FORMATS[bucket], events.c.date).label('bucket'), func.count())
+        .group_by('bucket').order_by('bucket')
+    ).all()
+    return [{'bucket': b, 'count': n} for b, n in rows]
+
+def _parse_date(value: str, end: bool = False) -> datetime | None:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, f"Invalid date '{value}', expected YYYY-MM-DD")
+    # A bare date as the end of the range includes the whole of that day
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def _encode_cursor(after: tuple) -> str | None:
+    return f"{after[0].isoformat()}~{after[1]}" if after is not None else None
+
+def _decode_cursor(cursor: str) -> tuple | None:
+    if not cursor:
+        return None
+    try:
+        date, id = cursor.rsplit('~', 1)
+        return datetime.fromisoformat(date), int(id)
+    except ValueError:
+        abort(400, "Invalid cursor")
+
+# The chronology: events in date order a page at a time, e.g. ?from=1930-01-01&to=1930-12-31&bucket=month
+# Pass node=<id> (repeatable) for just the events linked to those nodes
+@event_bp.route('/timeline', methods=["GET"])
+def api_get_timeline():
+    args = request.args
+    start, end = _parse_date(args.get('from')), _parse_date(args.get('to'), end=True)
+    node_ids = args.getlist('node', type=int)
+    bucket = args.get('bucket')
+    if bucket is not None and bucket not in BUCKET_FORMATS:
+        abort(400, f"bucket must be one of {list(BUCKET_FORMATS)}")
+    limit = min(max(args.get('limit', 100, type=int), 1), 1000)
+
+    events, after = get_timeline(start, end, node_ids, _decode_cursor(args.get('cursor')), limit)
+    response = {
+        'events': [_return_entity(e) for e in events],
+        'next': _encode_cursor(after)
+    }
+    if bucket is not None:
+        response['buckets'] = get_timeline_buckets(bucket, start, end, node_ids)
+    return response
+
 ######################
 # TAGS
 ######################
@@ -230,6 +348,60 @@ def api_create_tags():
     tag = create_entity('tag', **data)
     return _return_entity(tag)
 
+# Autocomplete for the tagging UI, served from memory
+@tag_bp.route('/suggest', methods=["GET"])
+def api_suggest_tags():
+    prefix = request.args.get('prefix', '')
+    limit = request.args.get('limit', 10, type=int)
+    return tag_suggestions.suggest(prefix, limit)
+
+######################
+# ALL ENTITIES
+######################
+
+# Name lookup across people, locations, events and tags, served from memory
+@entities_bp.route('/suggest', methods=["GET"])
+def api_suggest_entities():
+    query = request.args.get('q', '')
+    types = get_params('types')
+    # Allow types=person,location as well as types=person&types=location
+    types = {t for param in types for t in param.split(',') if t}
+    unknown = types - set(ENTITY_TABLES.values())
+    if unknown:
+        abort(400, f"Unknown entity types {sorted(unknown)}")
+    limit = request.args.get('limit', 10, type=int)
+    return entity_suggestions.suggest(query, types or None, limit)
+
+# Every place the entity is named in the book
+@entities_bp.route('/<int:node_id>/mentions', methods=["GET"])
+def api_get_entity_mentions(node_id):
+    db.get_or_404(Node, node_id)
+    return [
+        {'page': page.page_number, 'start': mention.start, 'end': mention.end, 'text': page.content[mention.start:mention.end]}
+        for mention, page in get_entity_mentions(node_id)
+    ]
+
+@job('find_duplicates')
+def find_duplicates_job(ctx, entity_type: str, threshold: float) -> list[dict]:
+    return entity_duplicates.candidates(entity_type, threshold)
+
+# Candidate clusters of entities which look like the same thing, for review before merging.
+# Cached until the next entity write, so repeated calls are cheap
+@entities_bp.route('/duplicates', methods=["GET"])
+def api_find_duplicates():
+    entity_type = request.args.get('type', '')
+    if entity_type not in ENTITY_MODELS:
+        abort(400, f"type must be one of {sorted(ENTITY_MODELS)}")
+    threshold = request.args.get('threshold', 0.5, type=float)
+    if not 0 < threshold <= 1:
+        abort(400, "threshold must be between 0 and 1")
+    limit = request.args.get('limit', 50, type=int)
+
+    if request.args.get('async'):
+        duplicates_job = enqueue('find_duplicates', entity_type=entity_type, threshold=threshold)
+        return _return_job(duplicates_job), 202
+    return entity_duplicates.candidates(entity_type, threshold)[:limit]
+
 ######################
 # QUERY ENTITIES
 ######################
@@ -263,11 +435,8 @@ def get_linked_nodes(entity) -> list:
     Returns:
         A list of linked nodes
     """
-    # rels = Relationship.query.filter(Relationship.start == entity.node_id).all()
-    rels = db.session.query(Relationship).filter(Relationship.start == entity.node_id).all()
-    linked_node_ids = [r.end for r in rels]
-    nodes = [Node.query.get_or_404(id) for id in linked_node_ids]
-    return nodes
+    node_id = entity.id if isinstance(entity, Tag) else entity.node_id
+    return [node for _, node, _ in get_linked([node_id])[node_id]]
 
 # Call this function to get the linked e.g. tags from an entity
 def get_linked_entities(entity, expected_type: str):
@@ -279,20 +448,12 @@ def get_linked_entities(entity, expected_type: str):
     Returns:
         A list of linked entities of the specified type
     """
-    all_nodes = get_linked_nodes(entity)
-    nodes = [n for n in all_nodes if n.node_type == expected_type]
-    if not nodes:
+    node_id = entity.id if isinstance(entity, Tag) else entity.node_id
+    linked = get_linked([node_id], node_type=expected_type)[node_id]
+    entities = [e for _, _, e in linked if e is not None]
+    if not entities:
         return None
-    
-    ids = [node.id for node in nodes]
-    RETRIEVE_MAP= {
-        'person': get_people_from_nodes,
-        'location': get_locations_from_nodes,
-        'event': get_events_from_nodes,
-        'tag': get_tags_from_nodes
-    }
-    get_fn = RETRIEVE_MAP[expected_type]
-    return get_fn(ids)
+    return entities
 
 # Merge into a new entity
 def merge_into_new(entities: list, entity_type: str, **kwargs):
@@ -0,0 +1,143 @@
+"""
+A server-sent events stream of changes to nodes, relationships, entities and notes, so the
+frontend can update when something changes in another tab instead of polling.
+
+    GET /events?page=3&node=12&node=15
+
+Each message is a compact description of one committed change:
+
+    id: 42
+    event: change
+    data: {"table": "notes", "action": "created", "id": 7, "nodes": [31], "page": 3}
+
+With no filters every change is sent.  With `page` and/or `node` filters, a change is sent if it
+is on one of the pages or touches one of the nodes.  Reconnecting clients send Last-Event-ID
+and carry on from there; if too much was missed they get a `resync` event and should refetch.
+Changes committed by another server process aren't described one by one: streams are sent a
+`resync` event for them within EVENTS_POLL_SECONDS (see broadcast.py).
+"""
+import json
+import time
+
+from flask import (
+    Blueprint, Response, current_app, request
+)
+from werkzeug.exceptions import abort
+
+from ..models import db
+from ..broadcast import get_broker, RESYNC
+from ..changes import on_change
+from ..revisions import current, GRAPH, NOTES
+from ..workspaces import current_workspace, use_workspace
+
+bp = Blueprint('events', __name__, url_prefix='/events')
+
+# Between them these move on every change which is streamed
+WATCHED_REVISIONS = (GRAPH, NOTES)
+
+
+def _message(change) -> dict:
+    message = {
+        'table': change.table,
+        'action': change.action,
+        'id': change.id,
+        'nodes': change.node_ids
+    }
+    if change.page_number is not None:
+        message['page'] = change.page_number
+    return message
+
+@on_change
+def publish_changes(changes, revisions):
+    broker = get_broker()
+    workspace = current_workspace()
+    broker.note_revisions(workspace, revisions)
+    for change in changes:
+        message = _message(change)
+        if workspace is not None:
+            message['workspace'] = workspace
+        broker.publish(message)
+
+
+def _matches(message: dict, pages: set, nodes: set, workspace: str = None) -> bool:
+    # Streams only see changes made in their own workspace
+    if message.get('workspace') != workspace:
+        return False
+    if not pages and not nodes:
+        return True
+    if message.get('page') in pages:
+        return True
+    return not nodes.isdisjoint(message['nodes'])
+
+def _format(seq: int, event: str, data: dict) -> str:
+    return f"id: {seq}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+def stream_changes(broker, last_seq: int, pages: set, nodes: set, keepalive: float, retry_ms: int = 3000,
+                   workspace: str = None, poll=None, poll_interval: float = 2):
+    """
+    Yield SSE frames for every matching change after last_seq, forever.  `poll`, if given,
+    reads the watched revision counters, to notice changes made by other processes.
+    """
+    yield f"retry: {retry_ms}\n\n"
+    seq = last_seq
+    last_sent = time.monotonic()
+    timeout = min(keepalive, poll_interval) if poll is not None else keepalive
+    while True:
+        if poll is not None:
+            broker.poll(workspace, poll, poll_interval)
+        missed, events = broker.wait(seq, timeout=timeout)
+        if missed:
+            yield _format(broker.seq, 'resync', {})
+        if not events:
+            if time.monotonic() - last_sent >= keepalive:
+                # A comment line keeps proxies from closing an idle connection
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            continue
+        for event_seq, message in events:
+            seq = event_seq
+            if message.get('action') == RESYNC:
+                if message.get('workspace') == workspace:
+                    last_sent = time.monotonic()
+                    yield _format(event_seq, 'resync', {})
+            elif _matches(message, pages, nodes, workspace):
+                last_sent = time.monotonic()
+                yield _format(event_seq, 'change', message)
+
+def _revision_reader(app, workspace: str | None):
+    # The stream outlives the request, so each read needs its own app context and session
+    def read() -> dict[str, int]:
+        with app.app_context():
+            use_workspace(workspace)
+            try:
+                return current(*WATCHED_REVISIONS)
+            finally:
+                db.session.remove()
+    return read
+
+
+@bp.route('', methods=["GET"])
+def api_stream_events():
+    try:
+        pages = {int(p) for p in request.args.getlist('page')}
+        nodes = {int(n) for n in request.args.getlist('node')}
+        last_id = request.headers.get('Last-Event-ID', request.args.get('since'))
+        broker = get_broker()
+        last_seq = int(last_id) if last_id is not None else broker.seq
+    except ValueError:
+        abort(400, "page, node and Last-Event-ID must be integers")
+
+    # The generator outlives the request context, so read the config now
+    config = current_app.config
+    keepalive = config.get('EVENTS_KEEPALIVE', 15)
+    retry_ms = config.get('EVENTS_RETRY_MS', 3000)
+    workspace = current_workspace()
+    generator = stream_changes(
+        broker, last_seq, pages, nodes, keepalive, retry_ms, workspace,
+        poll=_revision_reader(current_app._get_current_object(), workspace),
+        poll_interval=config.get('EVENTS_POLL_SECONDS', 2)
+    )
+    return Response(generator, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
@@ -28,11 +28,21 @@ import functools
 import time
 
 from flask import (
-    Blueprint, request
+    Blueprint, request, current_app
 )
 from werkzeug.exceptions import abort, HTTPException
+from sqlalchemy import select, update, or_, null
 
 from ..models import *
+from ..changes import record_rows, DELETED
+from ..reltypes import type_usage
+from ..compression import snapshot
+from ..revisions import GRAPH
+from ..jobs import job, enqueue
+from .jobs import _return_job
+from ..analytics import graph_analytics, METRICS
+from ..lookups import node_dict, entity_dict, lookup_stats
+from ..patterns import parse_pattern, run_pattern, explain, InvalidPattern, QueryTimeout
 
 bp = Blueprint('graph', __name__, url_prefix='/graph')
 
@@ -59,9 +69,27 @@ def _return_relationship(rel: Relationship) -> dict:
         'deleted' : rel.deleted
     }
 
-def _relationship_partner(rel: Relationship) -> Relationship:
-    """Return the reverse relationship of a given relationship"""
-    return Relationship.query.filter_by(start=rel.end, end=rel.start).first()
+def _return_linked(rel: Relationship, node: Node, entity) -> dict:
+    """Return a dictionary of a neighbour, the relationship to it and its entity (if it has one)"""
+    return {
+        'relationship': _return_relationship(rel),
+        'node': _return_node(node),
+        'entity': {c.key: getattr(entity, c.key) for c in entity.__table__.columns} if entity is not None else None
+    }
+
+def _get_relationship(id) -> Relationship | ReverseRelationship | None:
+    """
+    Get a relationship by id.  A negative id is the reverse direction of that relationship.
+    An id which isn't a number finds nothing, so callers report it as not found.
+    """
+    try:
+        id = int(id)
+    except (TypeError, ValueError):
+        return None
+    rel = db.session.get(Relationship, abs(id))
+    if rel is not None and id < 0:
+        return rel.reverse
+    return rel
 
 #### ERROR HANDLING ####
 
@@ -98,11 +126,14 @@ def handle_invalid_node_id_error(e):
 def get_nodes(ids):
     response = []
     for id in ids:
-        node = Node.query.get(id)
+        try:
+            node = node_dict(int(id))
+        except ValueError:
+            raise InvalidNodeIDError()
         if node is None:
             raise NodeNotFoundError()
             # abort(404, f"Node id {id} doesn't exist.")
-        response.append(_return_node(node))
+        response.append(node)
     return response
 
 @bp.route('/node', methods=["GET"])
@@ -119,7 +150,7 @@ def api_get_nodes():
 def get_relationships(ids):
     response = []
     for id in ids:
-        rel = Relationship.query.get(id)
+        rel = _get_relationship(id)
         if rel is None:
             abort(404, f"Relationship id {id} doesn't exist.")
         response.append(_return_relationship(rel))
@@ -132,9 +163,206 @@ def api_get_relationships():
     if ids is None:
         abort(400, f"An ID must be provided")
     return get_relationships(ids)
+
+# Every kind of relationship with how many relationships use it
+@bp.route('/relationship/types', methods=["GET"])
+def api_get_relationship_types():
+    include_deleted = request.args.get('include_deleted', '').lower() in ('1', 'true', 'yes')
+    return type_usage(include_deleted)
+
+# The entity table behind each node type
+ENTITY_MODELS = {
+    'person': Person,
+    'location': Location,
+    'event': Event,
+    'tag': Tag
+}
+
+def _entity_node_id(model):
+    # Tags share their id with their node
+    return model.id if model is Tag else model.node_id
+
+def get_linked(source_ids, node_type: str = None, rel: str = None, include_deleted: bool = False) -> dict:
+    """
+    Get the neighbours of many nodes at once, with the relationship to each and its entity row.
+    Each entity type is one query joining relationships, nodes and the entity table, with every
+    filter applied in SQL.
+    Args:
+        source_ids: The nodes to start from
+        node_type (str): Only neighbours of this type (e.g. "person")
+        rel (str): Only relationships with this label (e.g. "visited")
+        include_deleted (bool): Include deleted relationships, nodes and entities
+    Returns:
+        {source id: [(relationship, node, entity or None), ...]} in relationship order.  Each
+        relationship is presented in the direction leading away from its source.
+    """
+    source_ids = list(source_ids)
+    sources = set(source_ids)
+    # Each link is one row, so a source can be at either end of it
+    neighbour = or_(
+        Relationship.start.in_(source_ids) & (Node.id == Relationship.end),
+        Relationship.end.in_(source_ids) & (Node.id == Relationship.start)
+    )
+    criteria = []
+    if rel is not None:
+        # Resolved through the index on relationship_types, then the one on relationships.type_id
+        criteria.append(Relationship.type_id.in_(select(RelationshipType.id).where(RelationshipType.rel == rel)))
+    if not include_deleted:
+        criteria += [Relationship.deleted.is_not(1), Node.deleted.is_not(1)]
+
+    if node_type is None:
+        # Every entity type, then anything else (e.g. notes) without an entity table
+        types = list(ENTITY_MODELS) + [None]
+    else:
+        types = [node_type]
+
+    linked = {id: [] for id in source_ids}
+    for t in types:
+        model = ENTITY_MODELS.get(t)
+        query = select(Relationship, Node).join(Node, neighbour).where(*criteria)
+        if model is not None:
+            # Outer join, so a node whose entity row is missing is still returned
+            query = query.add_columns(model).outerjoin(model, _entity_node_id(model) == Node.id)
+            if not include_deleted:
+                query = query.where(model.deleted.is_not(1))
+        else:
+            query = query.add_columns(null())
+        if t is not None:
+            query = query.where(Node.node_type == t)
+        else:
+            query = query.where(Node.node_type.not_in(list(ENTITY_MODELS)))
+        for relationship, node, entity in db.session.execute(query):
+            if node.id == relationship.end and relationship.start in sources:
+                linked[relationship.start].append((relationship, node, entity))
+            if node.id == relationship.start and relationship.end in sources:
+                linked[relationship.end].append((relationship.reverse, node, entity))
+
+    for neighbours in linked.values():
+        neighbours.sort(key=lambda row: abs(row[0].id))
+    return linked
+
+def _linked_args() -> dict:
+    args = request.args
+    return {
+        'node_type': args.get('type'),
+        'rel': args.get('rel'),
+        'include_deleted': args.get('include_deleted', '').lower() in ('1', 'true', 'yes')
+    }
+
+@bp.route('/node/<int:id>/linked', methods=["GET"])
+def api_get_linked(id):
+    if db.session.get(Node, id) is None:
+        abort(404, f"Could not find node with id {id}")
+    linked = get_linked([id], **_linked_args())
+    return [_return_linked(*row) for row in linked[id]]
+
+# Resolve the neighbours of many nodes in one call e.g. ?id=1&id=2&type=person
+@bp.route('/node/linked', methods=["GET"])
+def api_get_linked_many():
+    ids = request.args.getlist('id', type=int)
+    if not ids:
+        abort(400, "An ID must be provided")
+    linked = get_linked(ids, **_linked_args())
+    return {str(id): [_return_linked(*row) for row in rows] for id, rows in linked.items()}
     
 
 
+# Hit and miss counts of the node, entity and page lookup cache, see lookups.py
+@bp.route('/cache', methods=["GET"])
+def api_lookup_stats():
+    return lookup_stats()
+
+# Centrality, components and communities for every live node
+@bp.route('/analytics', methods=["GET"])
+@snapshot(GRAPH)
+def api_get_analytics():
+    """
+    Query parameters:
+        metric: the metrics to return (repeatable), default all of them
+        top: return only the top k nodes by `sort`
+        sort: the metric to rank by for `top`, default pagerank
+        id: only return these node ids (repeatable)
+    """
+    args = request.args
+    metrics = args.getlist('metric') or list(METRICS)
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        abort(400, f"Unknown metrics {unknown}.  Choose from {list(METRICS)}")
+
+    analytics = graph_analytics.state()
+    response = {'summary': analytics.summary()}
+    top = args.get('top', type=int)
+    ids = args.getlist('id', type=int)
+    if top is not None:
+        if top < 1:
+            abort(400, "top must be at least 1")
+        sort = args.get('sort', 'pagerank')
+        if sort not in METRICS:
+            abort(400, f"Can not sort by {sort}")
+        response['nodes'] = analytics.top(sort, top, metrics)
+    elif ids:
+        positions = analytics.graph.index_of(ids)
+        if (positions < 0).any():
+            raise NodeNotFoundError(f"No live nodes with ids {[i for i, p in zip(ids, positions) if p < 0]}")
+        response['nodes'] = analytics.rows(metrics, positions)
+    else:
+        response['nodes'] = analytics.rows(metrics)
+    return response
+
+
+def _return_match(match: dict) -> dict:
+    """Return a dictionary of each variable in a pattern match"""
+    response = {}
+    for var, value in match.items():
+        if isinstance(value, tuple):
+            node, entity = value
+            response[var] = {
+                'node': _return_node(node),
+                # Untyped nodes didn't join an entity table, so come from the lookup cache
+                'entity': Serialiser.to_dict(type(entity), entity) if entity is not None else entity_dict(node.id)
+            }
+        else:
+            response[var] = _return_relationship(value)
+    return response
+
+# Match a pattern of nodes and links in one query, see patterns.py
+# e.g. {"pattern": "(p:person)-[visited]->(l:location)", "limit": 50}
+@bp.route('/query', methods=["POST"])
+def api_graph_query():
+    data = request.get_json(silent=True) or {}
+    config = current_app.config
+    cap = config.get('GRAPH_QUERY_MAX_ROWS', 1000)
+    try:
+        limit = int(data.get('limit', cap))
+    except (TypeError, ValueError):
+        abort(400, "limit must be a whole number")
+    if limit < 1:
+        abort(400, "limit must be at least 1")
+    include_deleted = data.get('include_deleted', False)
+    if not isinstance(include_deleted, bool):
+        abort(400, "include_deleted must be true or false")
+
+    try:
+        pattern = parse_pattern(data.get('pattern'))
+        matches, truncated = run_pattern(
+            pattern, min(limit, cap), include_deleted, timeout=config.get('GRAPH_QUERY_TIMEOUT', 5)
+        )
+    except InvalidPattern as e:
+        abort(400, str(e))
+    except QueryTimeout as e:
+        abort(400, f"{e}.  Narrow the pattern, e.g. with a node id, or lower the limit")
+
+    response = {
+        'columns': pattern.variables,
+        'matches': [_return_match(match) for match in matches],
+        'limit': min(limit, cap),
+        'truncated': truncated
+    }
+    if data.get('explain'):
+        response['plan'] = explain(pattern, include_deleted)
+    return response
+
+
 #######################
 #  CREATE
 #######################
@@ -192,7 +420,11 @@ def _create_relationship(start, end, rel, ler) -> tuple[str, Relationship]:
     if not end_node:
         abort(400, f"There doesn't exist a end node with id {end}")
 
-    existing_rels = Relationship.query.filter_by(start=start, end=end).all()
+    # A link is one row whichever way round it was created
+    existing_rels = Relationship.query.filter(
+        or_((Relationship.start == start) & (Relationship.end == end),
+            (Relationship.start == end) & (Relationship.end == start))
+    ).all()
 
     if len(existing_rels) > 0:
         abort(400, f"There already exists a relationship between nodes {start} and {end}")
@@ -209,20 +441,15 @@ def _create_relationship(start, end, rel, ler) -> tuple[str, Relationship]:
     created_id = new_rel.id
     return str(created_id), new_rel
 
-def create_relationship(start: int, end: int, rel: str, ler: str) -> tuple[Relationship, Relationship]:
+def create_relationship(start: int, end: int, rel: str, ler: str) -> tuple[Relationship, ReverseRelationship]:
     """
-    Create a new relationship between two nodes
+    Create a new relationship between two nodes.  One row is stored for the link.
     
     Returns:
-        tuple - The forward and reverse relationships created
+        tuple - The forward relationship created, and its reverse direction
     """
     id1, first_rel = _create_relationship(start, end, rel, ler)
-    id2, second_rel = _create_relationship(end, start, rel, ler)
-    # return {
-    #     id1: _return_relationship(first_rel),
-    #     id2: _return_relationship(second_rel)
-    # }
-    return (first_rel, second_rel)
+    return (first_rel, first_rel.reverse)
 
 # Create 2 new relationships via ENDPOINT (1 for forward relationship, 1 for backwards)
 @bp.route('/relationship/create', methods=["POST"])
@@ -247,14 +474,58 @@ def api_create_relationship():
 #######################
 
 # TODO:  Update relationship text
+def _soft_delete_where(model, *criteria) -> list[dict]:
+    """One set-based UPDATE.  Returns the rows it deleted."""
+    stmt = (
+        update(model).where(*criteria, model.deleted.is_not(1))
+        .values(deleted=1).returning(*model.__table__.columns)
+    )
+    return [dict(row._mapping) for row in db.session.execute(stmt)]
+
+def _attached_notes(node_ids) -> list[int]:
+    """The live note nodes linked to any of the nodes by a live relationship, in one query"""
+    return list(db.session.scalars(
+        select(Node.id).distinct()
+        .join(Relationship, or_(Relationship.start == Node.id, Relationship.end == Node.id))
+        .where(
+            Node.node_type == 'note', Node.deleted.is_not(1), Relationship.deleted.is_not(1),
+            or_(Relationship.start.in_(node_ids), Relationship.end.in_(node_ids))
+        )
+    ))
+
+def soft_delete_nodes(node_ids: list[int], notes: bool = False) -> dict:
+    """
+    Soft delete nodes together with their entity rows and every relationship they start or end,
+    and optionally the notes attached to them.  A note is attached through a relationship
+    between its own node and the deleted node, and a deleted note node always takes its note
+    with it.  This is a fixed handful of statements however many nodes or relationships are
+    involved.  The caller commits.
+    Returns:
+        The number of rows deleted in each table
+    """
+    node_ids = set(node_ids)
+    if notes:
+        node_ids.update(_attached_notes(node_ids))
+    node_ids = list(node_ids)
+    deleted = {
+        'nodes': _soft_delete_where(Node, Node.id.in_(node_ids)),
+        'relationships': _soft_delete_where(
+            Relationship, or_(Relationship.start.in_(node_ids), Relationship.end.in_(node_ids))
+        ),
+        # Tags share their id with their node
+        'tags': _soft_delete_where(Tag, Tag.id.in_(node_ids)),
+    }
+    for model in (Person, Location, Event, Note):
+        deleted[model.__tablename__] = _soft_delete_where(model, model.node_id.in_(node_ids))
+    # The UPDATEs bypass the unit of work, so tell the change feed what they did
+    record_rows(db.session, DELETED, deleted)
+    return {table: len(rows) for table, rows in deleted.items()}
+
 # "Soft" delete node by updating value of deleted field
-def soft_delete_node(node: Node) -> Node:
-    """Soft delete a node by setting its deleted field to 1"""
-    node.deleted = 1
-    # TODO: Soft delete all relationships associated with this node
-    # relationships = Relationship.query.filter((Relationship.start == node.id) | (Relationship.end == node.id)).all()
+def soft_delete_node(node: Node, notes: bool = False) -> Node:
+    """Soft delete a node, its entity and its relationships by setting their deleted fields to 1"""
+    soft_delete_nodes([node.id], notes=notes)
     db.session.commit()
-    db.session.refresh(node)
     return node
 
 @bp.route('/node/delete', methods=["PUT"])
@@ -266,17 +537,37 @@ def api_soft_delete_node():
     node = Node.query.get(id)
     if node is None:
         abort(404, f"Could not find node with id {id}")
-    soft_delete_node(node)
+    notes = args.get('notes', 'false').lower()
+    if notes not in ('true', 'false'):
+        abort(400, "notes must be true or false")
+    soft_delete_node(node, notes=notes == 'true')
     return _return_node(node)
 
+# Delete many nodes at once, e.g. {"ids": [1, 2, 3], "notes": true}
+@bp.route('/node/delete', methods=["POST"])
+def api_soft_delete_nodes():
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    # bool is an int too, but true isn't a node id
+    valid = isinstance(ids, list) and all(isinstance(id, int) and not isinstance(id, bool) for id in ids)
+    if not ids or not valid:
+        abort(400, "A list of ids must be provided")
+    notes = data.get('notes', False)
+    if not isinstance(notes, bool):
+        abort(400, "notes must be true or false")
+    ids = set(ids)
+    found = set(db.session.scalars(select(Node.id).where(Node.id.in_(ids))))
+    if found != ids:
+        abort(404, f"Could not find nodes with ids {sorted(ids - found)}")
+    counts = soft_delete_nodes(ids, notes=notes)
+    db.session.commit()
+    return counts
+
 # "Soft" delete relationship by updating value of deleted field
-def soft_delete_rel(rel: Relationship) -> Relationship:
+def soft_delete_rel(rel: Relationship | ReverseRelationship) -> Relationship | ReverseRelationship:
+    # Both directions are the same row
     rel.deleted = 1
-    reverse_rel = _relationship_partner(rel)
-    if reverse_rel is not None:
-        reverse_rel.deleted = 1
     db.session.commit()
-    db.session.refresh(rel)
     return rel
 
 @bp.route('/relationship/delete', methods=["PUT"])
@@ -285,12 +576,10 @@ def api_soft_delete_rel():
     id = args.get('id')
     if id is None:
         abort(400, "An ID must be provided")
-    rel = Relationship.query.get(id)
+    rel = _get_relationship(id)
     if rel is None:
         abort(404, f"Could not find relationship with id {id}")
-    reverse_rel = _relationship_partner(rel)
-    if reverse_rel is None:
-        abort(404, "Could not find the partner relationship")
+    reverse_rel = rel.reverse
     
     soft_delete_rel(rel)
     # Return the relationship and its reverse relationship
@@ -312,6 +601,34 @@ def merge_nodes(merged_node: Node, nodes: list[Node]) -> Node:
     db.session.commit()
     return merged_node
 
+@job('merge_nodes')
+def merge_nodes_job(ctx, node_ids: list[int], node_type: str) -> list[dict]:
+    """
+    Background version of the merge endpoint.  The new node's id is checkpointed and nodes which
+    are already merged into it are skipped, so a resumed job carries on where it left off.  Fails,
+    before merging anything, if a node was hard deleted after the job was queued.
+    """
+    nodes = [db.session.get(Node, node_id) for node_id in node_ids]
+    missing = [node_id for node_id, node in zip(node_ids, nodes) if node is None]
+    if missing:
+        raise NodeNotFoundError(
+            f"Could not find nodes {missing} to merge, they were deleted after the merge was queued"
+        )
+
+    merged_id = ctx.checkpoint.get('merged_id')
+    if merged_id is None:
+        merged_id = int(create_node(node_type))
+        ctx.report(0.0, {'merged_id': merged_id})
+    merged_node = db.session.get(Node, merged_id)
+    if merged_node is None:
+        raise NodeNotFoundError(f"The node {merged_id} being merged into has been deleted")
+
+    for i, node in enumerate(nodes):
+        if node.merged != merged_id:
+            merge_nodes(merged_node, [node])
+        ctx.report((i + 1) / len(nodes))
+    return [_return_node(n) for n in [merged_node] + nodes]
+
 @bp.route('/node/merge',  methods=["PUT", "POST"])
 def merge():
     data = request.get_json()
@@ -324,6 +641,11 @@ def merge():
     distinct_node_types = list(set(node_types))
     if len(distinct_node_types) != 1:
         abort(400, "Cannot merge nodes of different types")
+
+    # Large merges can be run in the background.  Poll /jobs/<id> for the result
+    if data.get('async'):
+        merge_job = enqueue('merge_nodes', node_ids=[n.id for n in nodes_to_merge], node_type=distinct_node_types[0])
+        return _return_job(merge_job), 202
     
     new_node = Node(node_type=distinct_node_types[0])
     db.session.add(new_node)
@@ -360,12 +682,12 @@ def delete_relationship():
     id = args.get('id')
     if id is None:
         abort(400, "ID of the resource should be provided")
-    rel_to_delete = Relationship.query.get_or_404(id, description=f"There does not exist a node with id {id}")
-    start, end = rel_to_delete.start, rel_to_delete.end
-    reverse_rel_to_delete = Relationship.query.filter_by(start=end, end=start).first()
-    reverse_rel_id = reverse_rel_to_delete.id
+    rel_to_delete = _get_relationship(id)
+    if rel_to_delete is None:
+        abort(404, f"There does not exist a relationship with id {id}")
+    reverse_rel_id = rel_to_delete.reverse.id
 
-    db.session.delete(rel_to_delete)
-    db.session.delete(reverse_rel_to_delete)
+    # Both directions are the same row
+    db.session.delete(db.session.get(Relationship, abs(int(id))))
     db.session.commit()
     return f"Deleted relationships {id} and {reverse_rel_id}"
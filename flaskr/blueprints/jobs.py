@@ -0,0 +1,47 @@
+"""
+Endpoints to check on background jobs started by other endpoints, e.g. an async node merge.
+See jobs.py for how jobs are run.
+"""
+import json
+
+from flask import (
+    Blueprint, current_app, request
+)
+from werkzeug.exceptions import abort
+
+from ..models import *
+from ..jobs import get_runner, is_stale
+
+bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+def _return_job(job: Job) -> dict:
+    """Return a dictionary of the job object"""
+    return {
+        'id': job.id,
+        'name': job.name,
+        'status': job.status,
+        'progress': job.progress,
+        'created': job.created,
+        'updated': job.updated,
+        'result': json.loads(job.result) if job.result is not None else None,
+        'error': job.error
+    }
+
+@bp.route('/<int:id>', methods=["GET"])
+def api_get_job(id):
+    job = db.session.get(Job, id)
+    if job is None:
+        abort(404, f"Could not find job with id {id}")
+    # Whoever was running this job has gone away, so pick it back up from its checkpoint
+    if is_stale(job) and not current_app.config.get('JOBS_EAGER'):
+        get_runner().submit(job.id)
+    return _return_job(job)
+
+@bp.route('/', methods=["GET"])
+def api_get_jobs():
+    status = request.args.get('status')
+    query = Job.query
+    if status is not None:
+        query = query.filter(Job.status == status)
+    jobs = query.order_by(Job.id.desc()).limit(100).all()
+    return [_return_job(job) for job in jobs]
@@ -11,6 +11,8 @@ from werkzeug.exceptions import abort
 from ..models import *
 from .graph import create_node, create_relationship
 from ..utils import get_params
+from ..etags import conditional
+from ..revisions import page_notes_revision
 
 bp = Blueprint('notes', __name__, url_prefix='/note')
 
@@ -23,7 +25,8 @@ def _return_note(note):
         'content': note.content,
         'deleted': note.deleted,
         'text_start': note.text_start,
-        'text_end': note.text_end
+        'text_end': note.text_end,
+        'detached': note.detached
     }
 
 #####################
@@ -101,6 +104,7 @@ def get_page_notes(page) -> list[Note]:
     return notes
 
 @bp.route('/on-page', methods=["GET"])
+@conditional(lambda: [page_notes_revision(p) for p in get_params('id')])
 def api_get_page_notes():
     page_numbers = get_params('id')
     notes = []
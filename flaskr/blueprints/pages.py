@@ -1,11 +1,23 @@
 import os
 from pathlib import Path
 
-from flask import Blueprint, request
+import numpy as np
+from flask import Blueprint, request, make_response, current_app
 from flaskr import db
-from ..models import Page
+from ..models import Page, Note
+from ..mentions import index_all_mentions, index_page_mentions, get_page_mentions
+from ..concordance import index_all_tokens, index_page_tokens, concordance
+from ..revisions import current, page_revision, page_notes_revision, PAGES
+from ..changes import bump_revisions
+from ..etags import conditional, revision_etag, if_match
+from ..textedits import InvalidEdit, parse_edits, apply_edits, diff_edits, rebase_spans
+from .notes import _return_note, get_page_notes
+from ..workspaces import current_workspace, use_workspace, get_workspaces
+from ..lookups import page_dict
 
 bp = Blueprint('page', __name__, url_prefix='/page')
+MAX_BATCH_PAGES = 50
+MAX_PREFETCH = 5
 root_dir = Path(__file__).parent.parent.parent
 
 def populate_pages():
@@ -22,6 +34,11 @@ def populate_pages():
                     db.session.add(page)
                 else:
                     page.content = content  # Update content if it already exists
+    db.session.flush()
+    index_all_tokens()
+    index_all_mentions()
+    pages = db.session.execute(db.select(Page.page_number)).scalars()
+    bump_revisions(db.session, {PAGES} | {page_revision(page_number) for page_number in pages})
     db.session.commit()
 
 
@@ -30,22 +47,158 @@ def get_page(page_number: int) -> Page:
     return page
 
 @bp.route('/', methods=["GET"])
+@conditional(lambda: [page_revision(request.args.get('page'))])
 def api_get_page():
-    page_number = request.args.get('page')
-    if not page_number:
+    page_number = request.args.get('page', type=int)
+    if page_number is None:
         return "Page not found", 404
-    page = get_page(page_number)
+    page = page_dict(page_number)
     if not page:
         return "Page not found", 404
-    return page.content
+    return page['content']
 
 
-def edit_page_content(page, new_content):
+def get_pages_with_notes(page_numbers) -> list[tuple[Page, list[Note]]]:
+    """Several pages with all of their notes, from a single query, in page order"""
+    rows = db.session.execute(
+        db.select(Page, Note)
+        .outerjoin(Note, Note.page_number == Page.page_number)
+        .where(Page.page_number.in_(page_numbers))
+        .order_by(Page.page_number, Note.id)
+    ).all()
+    pages = {}
+    for page, note in rows:
+        notes = pages.setdefault(page, [])
+        if note is not None:
+            notes.append(note)
+    return list(pages.items())
+
+def _parse_page_numbers(values) -> list[int] | None:
+    """Page numbers from `page` arguments, each a number or an inclusive range such as 3-7"""
+    numbers = set()
+    for value in values:
+        first, _, last = value.partition('-')
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            return None
+        if last - first >= MAX_BATCH_PAGES:
+            return None
+        numbers.update(range(first, last + 1))
+    return sorted(numbers)
+
+def _with_neighbours(page_numbers, prefetch: int) -> list[int]:
+    numbers = set(page_numbers)
+    for number in page_numbers:
+        numbers.update(range(max(number - prefetch, 1), number + prefetch + 1))
+    return sorted(numbers)
+
+def _batch_args():
+    requested = _parse_page_numbers(request.args.getlist('page'))
+    prefetch = min(max(request.args.get('prefetch', 0, type=int), 0), MAX_PREFETCH)
+    if requested is None:
+        return None, []
+    return requested, _with_neighbours(requested, prefetch)
+
+def _batch_revisions():
+    _, page_numbers = _batch_args()
+    if len(page_numbers) > MAX_BATCH_PAGES:
+        return []
+    return [
+        name for number in page_numbers
+        for name in (page_revision(number), page_notes_revision(number))
+    ]
+
+# Several pages and their notes at once, e.g. /page/batch?page=4&prefetch=1 or ?page=1-5.
+# Pages only included because of `prefetch` are marked as prefetched, so the reader can cache them
+@bp.route('/batch', methods=["GET"])
+@conditional(_batch_revisions)
+def api_get_page_batch():
+    requested, page_numbers = _batch_args()
+    if not requested:
+        return "Must provide page numbers, e.g. page=1&page=3-5", 400
+    if len(page_numbers) > MAX_BATCH_PAGES:
+        return f"At most {MAX_BATCH_PAGES} pages can be fetched at once", 400
+    return {
+        'pages': [
+            {
+                'page_number': page.page_number,
+                'content': page.content,
+                'prefetched': page.page_number not in requested,
+                'notes': [_return_note(note) for note in notes]
+            }
+            for page, notes in get_pages_with_notes(page_numbers)
+        ]
+    }
+
+
+def _rebase_notes(page, edits) -> list[Note]:
+    """Move the highlights of every note on the page onto the edited text.  Returns the notes left detached."""
+    notes = Note.query.filter(
+        Note.page_number == page.page_number, Note.text_start.is_not(None), Note.text_end.is_not(None)
+    ).all()
+    if not notes or not edits:
+        return []
+    spans = np.array([(note.text_start, note.text_end) for note in notes])
+    rebased, detached = rebase_spans(spans, edits)
+    for note, (start, end), lost in zip(notes, rebased.tolist(), detached.tolist()):
+        note.text_start, note.text_end = start, end
+        if lost:
+            note.detached = 1
+    return [note for note, lost in zip(notes, detached) if lost]
+
+def _replace_content(page, new_content, edits) -> list[Note]:
+    detached = _rebase_notes(page, edits)
     page.content = new_content
+    # Offsets into the old text are meaningless now, so index the page again
+    index_page_tokens(page)
+    index_page_mentions(page)
+    bump_revisions(db.session, {PAGES, page_revision(page.page_number), page_notes_revision(page.page_number)})
+    return detached
+
+def _rebase_workspaces(page_number: int, edits):
+    """
+    Pages are shared, but each workspace keeps its own notes and mentions with offsets into them.
+    Once the edited page is committed, rebase and re-index them in every workspace, each in its
+    own transaction.
+    """
+    if not edits:
+        return
+    app = current_app._get_current_object()
+    for name in get_workspaces(app).names():
+        # A context of its own, so the session works in the workspace and not the main database
+        with app.app_context():
+            use_workspace(name)
+            try:
+                page = get_page(page_number)
+                _rebase_notes(page, edits)
+                index_page_mentions(page)
+                bump_revisions(db.session, {page_notes_revision(page_number)})
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                current_app.logger.exception(f"Could not rebase page {page_number} in workspace {name}")
+            finally:
+                db.session.remove()
+
+def edit_page_content(page, new_content):
+    """Replace a page's text.  Notes are rebased onto it by diffing the old text against the new."""
+    edits = diff_edits(page.content, new_content)
+    _replace_content(page, new_content, edits)
     db.session.commit()
+    _rebase_workspaces(page.page_number, edits)
     db.session.refresh(page)
     return page
 
+def patch_page_content(page, edits) -> tuple[Page, list[Note]]:
+    """Make character-range edits (see textedits.py) to a page in one transaction"""
+    detached = _replace_content(page, apply_edits(page.content, edits), edits)
+    db.session.commit()
+    _rebase_workspaces(page.page_number, edits)
+    db.session.refresh(page)
+    return page, detached
+
 @bp.route('/update', methods=["PUT"])
 def api_edit_page_content():
     page_number = request.args.get('page')
@@ -55,6 +208,9 @@ def api_edit_page_content():
     if not page:
         return "Page not found", 404
 
+    if current_workspace() is not None:
+        return "Pages are shared by every workspace and can't be edited from one", 403
+
     data = request.get_json()
     new_content = data.get('content')
     if new_content is None:
@@ -63,6 +219,50 @@ def api_edit_page_content():
     return page.content
 
 
+# Edit part of a page, e.g. an OCR correction, with {"edits": [{"start", "end", "text"}, ...]}.
+# Every edit's offsets are into the page as it was before the patch.  Send the page's ETag in
+# If-Match to be sure the offsets are still good
+@bp.route('/patch', methods=["PATCH"])
+def api_patch_page_content():
+    page_number = request.args.get('page')
+    if not page_number:
+        return "Page not found", 404
+    page = get_page(page_number)
+    if not page:
+        return "Page not found", 404
+    if current_workspace() is not None:
+        return "Pages are shared by every workspace and can't be edited from one", 403
+    if not if_match([page_revision(page.page_number)]):
+        return "The page has changed since it was read", 412
+
+    data = request.get_json()
+    try:
+        edits = parse_edits(data.get('edits'), len(page.content))
+    except InvalidEdit as e:
+        return str(e), 400
+    page, detached = patch_page_content(page, edits)
+
+    response = make_response({
+        'content': page.content,
+        'notes': [_return_note(note) for note in get_page_notes(page)],
+        'detached': [note.id for note in detached]
+    })
+    response.set_etag(revision_etag(current(page_revision(page.page_number))))
+    return response
+
+
+# The people, locations and events named on a page, with where they are in the text
+@bp.route('/<int:page_number>/mentions', methods=["GET"])
+def api_get_page_mentions(page_number):
+    page = get_page(page_number)
+    if not page:
+        return "Page not found", 404
+    return [
+        {'node_id': mention.node_id, 'node_type': node_type, 'name': name, 'start': mention.start, 'end': mention.end}
+        for mention, node_type, name in get_page_mentions(page)
+    ]
+
+
 # Search accross all pages
 def search_pages(search_term):
     pages = Page.query.filter(Page.content.ilike(f"%{search_term}%")).all()
@@ -79,4 +279,16 @@ def api_search_pages():
         results = set(search_pages(term))
         pages.update(results)
     
-    return [n.page_number for n in list(pages)]
\ No newline at end of file
+    return [n.page_number for n in list(pages)]
+
+# Every occurrence of a word or phrase in context.  start/end can be used as a note's text_start/text_end
+@bp.route('/concordance', methods=["GET"])
+def api_concordance():
+    term = request.args.get('term', '')
+    if not term.strip():
+        return []
+    window = min(max(request.args.get('window', 40, type=int), 0), 500)
+    limit = request.args.get('limit', 500, type=int)
+    if limit < 1:
+        return "limit must be at least 1", 400
+    return concordance(term, window, min(limit, current_app.config.get('CONCORDANCE_MAX_ROWS', 2000)))
\ No newline at end of file
@@ -1,35 +1,94 @@
 from flask import (
-    Blueprint, request
+    Blueprint, request, current_app
 )
 from werkzeug.exceptions import abort, HTTPException
 
 from ..models import *
-from .entities import get_entity_from_node
+from ..lookups import entity_dict
+from ..layout import graph_layout
+from ..compression import snapshot
+from ..etags import conditional
+from ..revisions import GRAPH
+from ..clusters import graph_clusters, LEVELS
 
 bp = Blueprint('vis', __name__, url_prefix='/vis')
 
+def _return_vis_node(node: Node, entity: dict, position) -> dict:
+    x, y = position if position is not None else (None, None)
+    return {
+        'node_id': node.id,
+        'created': node.created,
+        'node_type': node.node_type,
+        'entity': entity,
+        'x': x,
+        'y': y
+    }
+
 def return_graph() -> dict:
-    """Return the graph as a dictionary"""
+    """Return the graph as a dictionary.  Each node carries its precomputed x, y position."""
     nodes = Node.query.filter(Node.deleted != True, Node.merged == None).all()
-    node_entities = [
-        get_entity_from_node(node.id) 
-        for node in nodes
-    ]
+    positions = graph_layout.state().as_dict()
+    node_entities = [entity_dict(node.id) for node in nodes]
     relationships = Relationship.query.filter(Relationship.deleted != True).all()
     return {
         'nodes': [
-            {
-                'node_id': node.id,
-                'created': node.created,
-                'node_type': node.node_type,
-                'entity': Serialiser.to_dict(entity.__class__, entity)
-            }
+            _return_vis_node(node, entity, positions.get(node.id))
             for node, entity in zip(nodes, node_entities)
         ],
         'relationships': Serialiser.to_dict_list(Relationship, relationships)
     }
 
 @bp.route('/graph', methods=['GET'])
+@conditional(GRAPH)
+@snapshot(GRAPH)
 def graph():
-    """Return the graph as a JSON object"""
-    return return_graph(), 200
\ No newline at end of file
+    """
+    Return the graph as a JSON object.
+    Query parameters:
+        lod: "type" or "community" for one node per cluster of nodes instead, see clusters.py
+    """
+    lod = request.args.get('lod')
+    if lod is None or lod == 'full':
+        return return_graph(), 200
+    if lod not in LEVELS:
+        abort(400, f"Unknown level of detail {lod}.  Choose from full, {', '.join(LEVELS)}")
+    return graph_clusters.state().view(lod).as_graph(), 200
+
+def expand_cluster(cluster_id: str, limit: int) -> dict | None:
+    """
+    The members of a cluster, most linked first, with the relationships between them and the
+    number of links from each to every other cluster.  None if there is no such cluster.
+    """
+    found = graph_clusters.state().find(cluster_id)
+    if found is None:
+        return None
+    view, i = found
+    positions = view.member_positions(i)[:limit]
+    ids = view.graph.node_ids[positions].tolist()
+    nodes = {node.id: node for node in Node.query.filter(Node.id.in_(ids))}
+    layout = graph_layout.state()
+    relationships = Relationship.query.filter(
+        Relationship.deleted != True, Relationship.start.in_(ids), Relationship.end.in_(ids)
+    ).all()
+    return {
+        'cluster': view.cluster(i),
+        'nodes': [
+            _return_vis_node(nodes[id], entity_dict(id), layout.position(id))
+            for id in ids if id in nodes
+        ],
+        'relationships': Serialiser.to_dict_list(Relationship, relationships),
+        'links': view.outside_links(i, positions),
+        'truncated': len(positions) < int(view.sizes[i])
+    }
+
+@bp.route('/cluster/<cluster_id>', methods=['GET'])
+@conditional(GRAPH)
+@snapshot(GRAPH)
+def cluster(cluster_id):
+    """Expand one cluster of /vis/graph?lod=..., e.g. /vis/cluster/community:3?limit=500"""
+    cap = current_app.config.get('VIS_CLUSTER_MAX_NODES', 2000)
+    limit = request.args.get('limit', cap, type=int)
+    expanded = expand_cluster(cluster_id, max(min(limit, cap), 1))
+    if expanded is None:
+        abort(404, f"There is no cluster {cluster_id}")
+    return expanded, 200
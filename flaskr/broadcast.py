@@ -0,0 +1,112 @@
+"""
+Fan out of change messages to any number of listening /events streams.
+
+Messages go into a single ring buffer with an increasing sequence number.  Publishing is one
+append and one notify, whatever the number of subscribers, and there are no per-client queues:
+each stream just remembers the last sequence number it sent and reads on from there, applying
+its own filter.  A stream which falls further behind than the buffer is told to resync.
+
+Streams block in `wait`, which uses a threading.Condition.  /events is served by its own gevent
+process (gunicorn.events.conf.py), so that wait is a greenlet rather than an OS thread and
+hundreds of open connections cost very little, while the rest of the API keeps thread workers.
+
+Messages only carry the changes made by this process.  Changes committed by another worker
+(or another process, e.g. the CLI) are noticed by polling the revision counters (see
+revisions.py): at most once per interval, whatever the number of streams, `poll` reads them and,
+if they have moved further than this process's own commits account for, publishes a `resync`
+message telling every stream in that workspace to refetch.
+"""
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+# The action of a message telling streams that changes were made elsewhere
+RESYNC = 'resync'
+
+
+class EventBroker:
+    def __init__(self, maxlen: int = 1000):
+        self._events = deque(maxlen=maxlen)
+        self._seq = 0
+        self._cond = threading.Condition()
+        # workspace -> {counter: value} as far as this process knows, and when to next poll them
+        self._seen = {}
+        self._next_poll = {}
+
+    @property
+    def seq(self) -> int:
+        """The sequence number of the most recent message"""
+        return self._seq
+
+    def publish(self, message: dict) -> int:
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, message))
+            self._cond.notify_all()
+            return self._seq
+
+    def since(self, seq: int) -> tuple[bool, list[tuple[int, dict]]]:
+        """
+        Return every message after `seq`, and whether any messages after `seq` have already
+        dropped out of the buffer (in which case the caller has missed something).
+        """
+        with self._cond:
+            if not self._events or seq >= self._seq:
+                return False, []
+            oldest = self._events[0][0]
+            missed = seq < oldest - 1
+            # Sequence numbers are contiguous, so we can index straight into the buffer
+            start = max(seq + 1 - oldest, 0)
+            return missed, [self._events[i] for i in range(start, len(self._events))]
+
+    def wait(self, seq: int, timeout: float) -> tuple[bool, list[tuple[int, dict]]]:
+        """Block until there are messages after `seq`, or the timeout passes."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > seq, timeout=timeout)
+        return self.since(seq)
+
+    def note_revisions(self, workspace: str | None, revisions: dict):
+        """Record the counters a commit made by this process moved, as {name: (before, after)}"""
+        with self._cond:
+            seen = self._seen.get(workspace)
+            if seen is None:
+                return
+            for name, (before, after) in revisions.items():
+                # Unless someone else got in first, in which case the next poll will notice
+                if seen.get(name) == before:
+                    seen[name] = after
+
+    def poll(self, workspace: str | None, read, interval: float) -> bool:
+        """
+        Read the counters with `read()`, unless a stream polled them less than `interval`
+        seconds ago, and publish a resync message if another process has moved them.
+        Returns whether it published one.
+        """
+        now = time.monotonic()
+        with self._cond:
+            if now < self._next_poll.get(workspace, 0):
+                return False
+            self._next_poll[workspace] = now + interval
+        values = read()
+        with self._cond:
+            seen = self._seen.get(workspace)
+            self._seen[workspace] = dict(values)
+            if seen is None or seen == values:
+                return False
+            message = {'action': RESYNC, 'nodes': []}
+            if workspace is not None:
+                message['workspace'] = workspace
+            self.publish(message)
+            return True
+
+
+def get_broker(app=None) -> EventBroker:
+    app = app or current_app._get_current_object()
+    broker = app.extensions.get('event_broker')
+    if broker is None:
+        broker = app.extensions.setdefault(
+            'event_broker', EventBroker(app.config.get('EVENTS_BUFFER_SIZE', 1000))
+        )
+    return broker
@@ -0,0 +1,162 @@
+"""
+A feed of committed changes to the graph and notes, captured from SQLAlchemy session events.
+
+Every flush records which watched rows were created, updated, deleted or merged.  Once the
+transaction commits the changes are handed to every registered listener, e.g. the /events stream.
+Changes from a transaction that is rolled back are discarded, so listeners only ever see data
+which is really in the database.
+
+The same changes drive the revision counters in revisions.py.  Set-based UPDATEs (Query.update)
+bypass the unit of work, so code using them must describe what it did with `record`.
+"""
+from dataclasses import dataclass, field
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from flask_sqlalchemy.session import Session
+
+from .revisions import revision_names, bump
+
+# Tables whose changes are published.  Everything else (pages, jobs, users) is ignored.
+WATCHED_TABLES = ('nodes', 'relationships', 'notes', 'people', 'locations', 'events', 'tags')
+
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+MERGED = 'merged'
+
+_PENDING = 'pending_changes'
+_REVISIONS = 'pending_revisions'
+_listeners = []
+
+
+@dataclass
+class Change:
+    """
+    A single committed change.
+
+    Attributes:
+        table (str): The table of the changed row.
+        action (str): One of created, updated, deleted or merged.
+        id (int): The primary key of the changed row.
+        row (dict): The column values after the change (before it, for a hard delete).
+    """
+    table: str
+    action: str
+    id: int
+    row: dict = field(default_factory=dict)
+
+    @property
+    def node_ids(self) -> list[int]:
+        """The graph nodes this change touches"""
+        if self.table == 'nodes':
+            return [self.id]
+        if self.table == 'relationships':
+            return [n for n in (self.row.get('start'), self.row.get('end')) if n is not None]
+        if self.table == 'tags':
+            # Tags share their id with their node
+            return [self.id]
+        node_id = self.row.get('node_id')
+        return [node_id] if node_id is not None else []
+
+    @property
+    def page_number(self) -> int | None:
+        return self.row.get('page_number')
+
+
+def on_change(fn):
+    """
+    Register fn(changes, revisions) to be called after every commit with changes.  `revisions`
+    maps each counter the transaction moved to its (before, after) values.
+    """
+    _listeners.append(fn)
+    return fn
+
+def record(session, table: str, action: str, ids, row: dict = None):
+    """Describe a change made without the ORM, e.g. by a set-based UPDATE."""
+    changes = [Change(table, action, id, dict(row or {})) for id in ids]
+    _add_pending(session, changes)
+
+def record_rows(session, action: str, rows_by_table: dict[str, list[dict]]):
+    """
+    As record, with each row's own values, e.g. the rows returned by UPDATE ... RETURNING.
+    Several tables can be recorded at once so their revision counters move in one statement.
+    """
+    changes = [
+        Change(table, action, row['id'], dict(row))
+        for table, rows in rows_by_table.items() for row in rows
+    ]
+    if changes:
+        _add_pending(session, changes)
+
+def bump_revisions(session, names):
+    """
+    Move counters for a change which isn't in the feed, e.g. to a page.  Listeners are still
+    told which counters moved once the transaction commits.
+    """
+    bumped = bump(session.connection(), names)
+    revisions = session.info.setdefault(_REVISIONS, {})
+    for name, value in bumped.items():
+        before = revisions[name][0] if name in revisions else value - 1
+        revisions[name] = (before, value)
+
+def _revisions_for(changes) -> set[str]:
+    names = set()
+    for change in changes:
+        names |= revision_names(change)
+    return names
+
+
+def _add_pending(session, changes):
+    session.info.setdefault(_PENDING, []).extend(changes)
+    bump_revisions(session, _revisions_for(changes))
+
+def _row(obj) -> dict:
+    mapper = inspect(obj).mapper
+    return {attr.key: getattr(obj, attr.key) for attr in mapper.column_attrs}
+
+def _classify_update(obj) -> str | None:
+    state = inspect(obj)
+    changed = {attr.key for attr in state.attrs if attr.history.has_changes()}
+    if not changed:
+        return None
+    if 'deleted' in changed and getattr(obj, 'deleted'):
+        return DELETED
+    if 'merged' in changed and getattr(obj, 'merged', None) is not None:
+        return MERGED
+    return UPDATED
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    pending = []
+    for obj in session.new:
+        if obj.__table__.name in WATCHED_TABLES:
+            pending.append(Change(obj.__table__.name, CREATED, obj.id, _row(obj)))
+    for obj in session.dirty:
+        if obj.__table__.name in WATCHED_TABLES:
+            action = _classify_update(obj)
+            if action is not None:
+                pending.append(Change(obj.__table__.name, action, obj.id, _row(obj)))
+    for obj in session.deleted:
+        if obj.__table__.name in WATCHED_TABLES:
+            pending.append(Change(obj.__table__.name, DELETED, obj.id, _row(obj)))
+    if pending:
+        _add_pending(session, pending)
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_changes(session):
+    changes = session.info.pop(_PENDING, None) or []
+    revisions = session.info.pop(_REVISIONS, {})
+    if not changes and not revisions:
+        return
+    for fn in _listeners:
+        try:
+            fn(changes, revisions)
+        except Exception:
+            current_app.logger.exception(f"Change listener {fn.__name__} failed")
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    session.info.pop(_PENDING, None)
+    session.info.pop(_REVISIONS, None)
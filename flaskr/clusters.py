@@ -0,0 +1,212 @@
+"""
+Level-of-detail views of the graph, for when there are too many nodes to draw one by one.
+
+Each live node is put into a cluster, and the graph is sent as one super-node per cluster, with
+the number of links between each pair of clusters as the weight of the edge joining them:
+
+    type       - one cluster per node type
+    community  - one cluster per community found by label propagation (see analytics.py).  Only
+                 the largest VIS_MAX_CLUSTERS - 1 communities get a cluster of their own, the
+                 rest (often many single unlinked nodes) share the last one
+
+A super-node sits at the centre of its members in the full layout (see layout.py), so expanding
+a cluster puts its members around where it was drawn.  Cluster ids name their level, e.g.
+"type:person", "community:3" and "community:other".
+
+The assignments and the aggregated graph of each level are computed the first time they are
+asked for and cached until the graph revision moves, like the metrics in analytics.py.
+"""
+import threading
+
+import numpy as np
+from flask import current_app
+
+from .analytics import graph_analytics, Analytics
+from .layout import graph_layout
+from .indexes import LazyIndex
+from .revisions import GRAPH
+from .lookups import entity_dict
+
+LEVELS = ('type', 'community')
+OTHER = 'other'
+
+
+class ClusterView:
+    """
+    One level of detail.
+
+    Attributes:
+        lod (str): The level, one of LEVELS.
+        ids (list[str]): The id of each cluster.
+        assignment (ndarray): The cluster of each node, by position in the graph arrays.
+        members (ndarray): Node positions ordered by cluster, then most linked first.
+        starts (ndarray): The members of cluster i are members[starts[i]:starts[i+1]].
+    """
+    def __init__(self, lod: str, ids: list[str], assignment: np.ndarray, analytics: Analytics, positions: np.ndarray):
+        graph = analytics.graph
+        self.lod = lod
+        self.ids = ids
+        self.assignment = assignment
+        self.index = {cluster_id: i for i, cluster_id in enumerate(ids)}
+        k = len(ids)
+
+        degree = analytics.metric('degree')
+        self.members = np.lexsort((graph.node_ids, -degree, assignment))
+        self.sizes = np.bincount(assignment, minlength=k)
+        self.starts = np.concatenate(([0], np.cumsum(self.sizes)))
+
+        a, b = assignment[graph.src], assignment[graph.dst]
+        self.internal_edges = np.bincount(a[a == b], minlength=k)
+        across = a != b
+        lo, hi = np.minimum(a[across], b[across]), np.maximum(a[across], b[across])
+        pairs, self.weights = np.unique(lo * k + hi, return_counts=True)
+        self.edges = np.stack((pairs // k, pairs % k), axis=1) if k else np.empty((0, 2), np.int64)
+
+        types, codes = np.unique(graph.node_types.astype(str), return_inverse=True)
+        counts = np.bincount(assignment * len(types) + codes, minlength=k * len(types)).reshape(k, len(types))
+        self.type_counts = [
+            {str(types[j]): int(counts[i, j]) for j in np.flatnonzero(counts[i])} for i in range(k)
+        ]
+
+        # Centres of the members which have a position
+        placed = ~np.isnan(positions[:, 0])
+        placed_count = np.bincount(assignment[placed], minlength=k)
+        with np.errstate(invalid='ignore'):
+            self.centres = np.stack([
+                np.bincount(assignment[placed], weights=positions[placed, axis], minlength=k) / placed_count
+                for axis in (0, 1)
+            ], axis=1)
+        self.graph = graph
+        self._as_graph = None
+
+    def member_positions(self, i: int) -> np.ndarray:
+        return self.members[self.starts[i]:self.starts[i + 1]]
+
+    def label(self, i: int) -> str:
+        """The node type, or for a community the name of its most linked member"""
+        if self.lod == 'type' or self.ids[i].endswith(f':{OTHER}'):
+            return self.ids[i].split(':', 1)[1]
+        first = self.member_positions(i)[0]
+        node_id = int(self.graph.node_ids[first])
+        entity = entity_dict(node_id)
+        if entity is not None and entity.get('name'):
+            return entity['name']
+        return f"{self.graph.node_types[first]} {node_id}"
+
+    def cluster(self, i: int) -> dict:
+        x, y = self.centres[i]
+        placed = not np.isnan(x)
+        return {
+            'node_id': self.ids[i],
+            'node_type': 'cluster',
+            'entity': {'name': self.label(i)},
+            'size': int(self.sizes[i]),
+            'node_types': self.type_counts[i],
+            'internal_edges': int(self.internal_edges[i]),
+            'x': round(float(x), 3) if placed else None,
+            'y': round(float(y), 3) if placed else None
+        }
+
+    def as_graph(self) -> dict:
+        """The aggregated graph, in the shape of /vis/graph.  Built once, as nothing in it can change."""
+        if self._as_graph is None:
+            self._as_graph = self._build_graph()
+        return self._as_graph
+
+    def _build_graph(self) -> dict:
+        return {
+            'lod': self.lod,
+            'nodes': [self.cluster(i) for i in range(len(self.ids))],
+            'relationships': [
+                {'start': self.ids[a], 'end': self.ids[b], 'weight': int(w)}
+                for (a, b), w in zip(self.edges.tolist(), self.weights.tolist())
+            ],
+            'summary': {'nodes': self.graph.n_nodes, 'edges': self.graph.n_edges, 'clusters': len(self.ids)}
+        }
+
+    def outside_links(self, i: int, positions: np.ndarray) -> list[dict]:
+        """For the given members of cluster i, the number of links from each to every other cluster"""
+        graph = self.graph
+        a, b = self.assignment[graph.src], self.assignment[graph.dst]
+        # Each edge from a member, as (member, the node at its other end)
+        chosen = np.zeros(graph.n_nodes, dtype=bool)
+        chosen[positions] = True
+        from_src = chosen[graph.src] & (b != i)
+        from_dst = chosen[graph.dst] & (a != i)
+        members = np.concatenate((graph.src[from_src], graph.dst[from_dst]))
+        others = np.concatenate((b[from_src], a[from_dst]))
+        k = len(self.ids)
+        keys, weights = np.unique(members * k + others, return_counts=True)
+        return [
+            {'node_id': int(graph.node_ids[key // k]), 'cluster': self.ids[key % k], 'weight': int(w)}
+            for key, w in zip(keys.tolist(), weights.tolist())
+        ]
+
+
+def _by_type(analytics: Analytics) -> tuple[list[str], np.ndarray]:
+    types, assignment = np.unique(analytics.graph.node_types.astype(str), return_inverse=True)
+    return [f'type:{t}' for t in types], assignment.astype(np.int64)
+
+def _by_community(analytics: Analytics, max_clusters: int) -> tuple[list[str], np.ndarray]:
+    # Labels are numbered from 0 in order of decreasing size, so the largest keep their own
+    labels = analytics.metric('community').astype(np.int64)
+    count = int(labels.max()) + 1 if len(labels) else 0
+    if count <= max_clusters:
+        return [f'community:{c}' for c in range(count)], labels
+    kept = max(max_clusters - 1, 0)
+    assignment = np.minimum(labels, kept)
+    return [f'community:{c}' for c in range(kept)] + [f'community:{OTHER}'], assignment
+
+
+class Clustering:
+    """The level-of-detail views of one revision of the graph, computed as they are asked for"""
+    def __init__(self, analytics: Analytics, layout, config):
+        self.analytics = analytics
+        self.layout = layout
+        self.config = config
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def positions(self) -> np.ndarray:
+        """The layout position of every node in the graph, NaN for any the layout hasn't placed"""
+        graph = self.analytics.graph
+        positions = np.full((graph.n_nodes, 2), np.nan)
+        # The layout may have been built from a different revision of the graph
+        found = self.layout.graph.index_of(graph.node_ids)
+        positions[found >= 0] = self.layout.positions[found[found >= 0]]
+        return positions
+
+    def _compute(self, lod: str) -> ClusterView:
+        if lod == 'type':
+            ids, assignment = _by_type(self.analytics)
+        elif lod == 'community':
+            ids, assignment = _by_community(self.analytics, self.config.get('VIS_MAX_CLUSTERS', 200))
+        else:
+            raise KeyError(lod)
+        return ClusterView(lod, ids, assignment, self.analytics, self.positions())
+
+    def view(self, lod: str) -> ClusterView:
+        if lod not in self._views:
+            with self._lock:
+                if lod not in self._views:
+                    self._views[lod] = self._compute(lod)
+        return self._views[lod]
+
+    def find(self, cluster_id: str) -> tuple[ClusterView, int] | None:
+        """The view a cluster id belongs to and its index there, or None if there is no such cluster"""
+        lod = cluster_id.split(':', 1)[0]
+        if lod not in LEVELS:
+            return None
+        view = self.view(lod)
+        i = view.index.get(cluster_id)
+        return (view, i) if i is not None else None
+
+
+class ClusteringIndex(LazyIndex):
+    name = 'graph_clusters'
+    revision = GRAPH
+
+    def build(self, previous=None):
+        return Clustering(graph_analytics.state(), graph_layout.state(), current_app.config)
+
+graph_clusters = ClusteringIndex()
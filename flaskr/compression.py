@@ -0,0 +1,198 @@
+"""
+Compression of response bodies, negotiated with the client's Accept-Encoding header.
+
+gzip is always available.  brotli and zstd are used when the `brotli` / `zstandard` packages are
+installed (pip install flaskr[compression]) and the client accepts them.  Bodies smaller than
+COMPRESS_MIN_SIZE aren't worth compressing and streamed responses (e.g. /events) are left alone.
+
+Some responses are snapshots: they are the same for everyone until the next write, e.g. the
+whole graph for /vis/graph.  A view marked with `@snapshot(<revision>)` has its compressed body
+cached against that revision counter (see revisions.py), so it is compressed once per write
+rather than once per request.
+"""
+import functools
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request
+
+from .revisions import current_revision
+from .indexes import LazyIndex
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'image/svg+xml')
+# Kept in the WSGI environ rather than `g`, which lives as long as the app context
+_SNAPSHOT = 'flaskr.snapshot_key'
+
+
+def _gzip(body: bytes, level: int) -> bytes:
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+def _brotli(body: bytes, level: int) -> bytes:
+    # Brotli's quality runs 0-11, so the usual levels mean much the same as gzip's
+    return brotli.compress(body, quality=min(level, 11))
+
+def _zstd(body: bytes, level: int) -> bytes:
+    return zstandard.ZstdCompressor(level=level).compress(body)
+
+def available_encodings() -> dict:
+    """The encodings this process can produce, best first"""
+    encodings = {}
+    if brotli is not None:
+        encodings['br'] = _brotli
+    if zstandard is not None:
+        encodings['zstd'] = _zstd
+    encodings['gzip'] = _gzip
+    return encodings
+
+
+def parse_accept_encoding(header: str) -> dict[str, float]:
+    accepted = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+def choose_encoding(header: str) -> str | None:
+    """The best encoding the client accepts, preferring ours on a tie, or None for identity"""
+    accepted = parse_accept_encoding(header or '')
+    best, best_q = None, 0.0
+    for name in available_encodings():
+        q = accepted.get(name, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class CompressedCache:
+    """A small LRU of compressed snapshot bodies, keyed on (key, revision, encoding)"""
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body: bytes):
+        with self._lock:
+            self.entries[key] = body
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+class SnapshotBodies(LazyIndex):
+    """The compressed snapshot cache for each app.  Entries name their own revision."""
+    name = 'compressed_snapshots'
+
+    def build(self, previous=None):
+        return CompressedCache(current_app.config.get('COMPRESS_CACHE_SIZE', 32))
+
+snapshot_bodies = SnapshotBodies()
+
+
+def snapshot(revision: str):
+    """
+    Mark a view whose response only changes when the named revision counter moves, so its
+    compressed body can be cached.  The counter is read before the view runs: a write landing
+    in between can only make the cached body newer than its key, never older.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            request.environ.setdefault(_SNAPSHOT, (request.full_path, revision, current_revision(revision)))
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _compressible(response) -> bool:
+    if response.direct_passthrough or response.is_streamed:
+        return False
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if 'Content-Encoding' in response.headers:
+        return False
+    mimetype = response.mimetype or ''
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+def compress_response(response):
+    config = current_app.config
+    if not config.get('COMPRESS_ENABLED', True):
+        return response
+    if response.status_code == 304:
+        # Not Modified carries the headers the full response would have had, so the ETag of
+        # the encoding the client holds rather than the bare revision tag
+        response.vary.add('Accept-Encoding')
+        tag, weak = response.get_etag()
+        if tag is not None:
+            for sent in request.if_none_match.as_set(include_weak=True):
+                base, _, encoding = sent.rpartition('-')
+                if base == tag and encoding in available_encodings():
+                    response.set_etag(sent, weak)
+                    break
+        return response
+    if not _compressible(response):
+        return response
+    # The body depends on Accept-Encoding whether or not this request is compressed
+    response.vary.add('Accept-Encoding')
+
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < config.get('COMPRESS_MIN_SIZE', 500):
+        return response
+
+    compress = available_encodings()[encoding]
+    level = config.get('COMPRESS_LEVEL', 6)
+    key = request.environ.get(_SNAPSHOT)
+    if key is not None and response.status_code == 200:
+        cache = snapshot_bodies.state()
+        key = key + (encoding,)
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = compress(body, level)
+            cache.put(key, compressed)
+    else:
+        compressed = compress(body, level)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    tag, weak = response.get_etag()
+    if tag is not None:
+        # Each encoding is its own representation, so needs its own strong ETag
+        response.set_etag(f'{tag}-{encoding}', weak)
+    return response
+
+
+def init_compression(app):
+    app.after_request(compress_response)
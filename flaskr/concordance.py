@@ -0,0 +1,82 @@
+"""
+A positional index of every word in the book, for keyword-in-context (concordance) lookups.
+
+Each word of each page is stored in `page_tokens` with its position on the page and its
+character offsets, so finding every occurrence of a word or phrase is an index lookup rather
+than a scan of the page text.  The offsets are offsets into Page.content, so they can be used
+as a note's text_start/text_end directly.
+
+The index is rebuilt when the pages are loaded and a page's tokens are replaced when it is
+edited (see pages.populate_pages and pages.edit_page_content).
+"""
+import re
+
+from sqlalchemy import select, delete, insert, func, case
+from sqlalchemy.orm import aliased
+
+from .models import db, Page, PageToken
+from .mentions import fold
+
+WORD = re.compile(r"\w+(?:'\w+)*")
+
+
+def tokenise(text: str) -> list[tuple[str, int, int]]:
+    """(token, start, end) for every word in text"""
+    return [(fold(match.group()), match.start(), match.end()) for match in WORD.finditer(text)]
+
+def _rows(page_id: int, content: str) -> list[dict]:
+    return [
+        {'token': token, 'page_id': page_id, 'position': position, 'start': start, 'end': end}
+        for position, (token, start, end) in enumerate(tokenise(content))
+    ]
+
+def index_all_tokens() -> int:
+    """Rebuild the whole index.  Returns the number of tokens."""
+    db.session.execute(delete(PageToken))
+    rows = []
+    for page_id, content in db.session.execute(select(Page.id, Page.content)):
+        rows.extend(_rows(page_id, content))
+    if rows:
+        db.session.execute(insert(PageToken), rows)
+    return len(rows)
+
+def index_page_tokens(page: Page):
+    """Replace one page's tokens.  Runs in the caller's transaction."""
+    db.session.execute(delete(PageToken).where(PageToken.page_id == page.id))
+    rows = _rows(page.id, page.content)
+    if rows:
+        db.session.execute(insert(PageToken), rows)
+
+
+def concordance(term: str, window: int = 40, limit: int = 500) -> list[dict]:
+    """
+    Every occurrence of a word or phrase, with `window` characters of context either side.
+
+    A phrase matches consecutive words, whatever punctuation or spacing separates them.
+    Returns:
+        [{page, start, end, left, match, right}], in page order
+    """
+    tokens = [token for token, _, _ in tokenise(term)]
+    if not tokens:
+        return []
+
+    # One alias per word of the phrase, each the next position on the same page as the first
+    words = [aliased(PageToken) for _ in tokens]
+    first, last = words[0], words[-1]
+    query = select(Page.page_number, first.start, last.end).join(Page, Page.id == first.page_id)
+    conditions = [first.token == tokens[0]]
+    for i, (word, token) in enumerate(zip(words[1:], tokens[1:]), start=1):
+        query = query.join(word, (word.page_id == first.page_id) & (word.position == first.position + i))
+        conditions.append(word.token == token)
+
+    left_start = case((first.start > window, first.start - window), else_=0)
+    query = query.add_columns(
+        func.substr(Page.content, left_start + 1, first.start - left_start),
+        func.substr(Page.content, first.start + 1, last.end - first.start),
+        func.substr(Page.content, last.end + 1, window),
+    ).where(*conditions).order_by(Page.page_number, first.start).limit(limit)
+
+    return [
+        {'page': page, 'start': start, 'end': end, 'left': left, 'match': match, 'right': right}
+        for page, start, end, left, match, right in db.session.execute(query)
+    ]
@@ -5,3 +5,57 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 class Config:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'cainsjawbone.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Schema creation and page ingestion run through `flask init-db` rather than on every boot
+    INIT_DB_ON_STARTUP = False
+    # 'lazy' builds in-process indexes on first use, 'background' warms them on a thread at boot
+    WARM_INDEXES = 'lazy'
+    # Background jobs run on an in-process thread pool, see jobs.py
+    JOBS_EAGER = False
+    JOBS_MAX_WORKERS = 2
+    # Seconds without a progress report before a running job is assumed to be abandoned
+    JOBS_STALE_AFTER = 60
+    # Server-sent events, see blueprints/events.py
+    EVENTS_BUFFER_SIZE = 1000
+    EVENTS_KEEPALIVE = 15
+    EVENTS_RETRY_MS = 3000
+    # How often the revision counters are checked for changes made by other processes
+    EVENTS_POLL_SECONDS = 2
+    # Server-side graph layout, see layout.py
+    LAYOUT_ITERATIONS = 50
+    LAYOUT_WARM_ITERATIONS = 15
+    LAYOUT_SAMPLE = 256
+    LAYOUT_SEED = 0
+    # Number of BFS sources used to estimate betweenness, see analytics.py
+    ANALYTICS_BETWEENNESS_SAMPLES = 64
+    # /vis/graph?lod=community draws at most VIS_MAX_CLUSTERS clusters, and /vis/cluster/<id>
+    # returns at most VIS_CLUSTER_MAX_NODES of a cluster's nodes, see clusters.py
+    VIS_MAX_CLUSTERS = 200
+    VIS_CLUSTER_MAX_NODES = 2000
+
+    # Responses smaller than this (bytes) aren't compressed.  Compressed bodies of up to
+    # COMPRESS_CACHE_SIZE snapshot responses are kept, see compression.py
+    COMPRESS_ENABLED = True
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_LEVEL = 6
+    COMPRESS_CACHE_SIZE = 32
+
+    # A database per user or team, chosen with the X-Workspace header, see workspaces.py.
+    # Engines idle for WORKSPACE_IDLE_SECONDS are closed, as are any beyond WORKSPACE_MAX_OPEN
+    WORKSPACES_ENABLED = False
+    WORKSPACE_DIR = os.path.join(basedir, 'workspaces')
+    WORKSPACE_IDLE_SECONDS = 300
+    WORKSPACE_MAX_OPEN = 64
+
+    # Serialised nodes, entities and pages kept in process, see lookups.py.  0 turns it off
+    LOOKUP_CACHE_SIZE = 4096
+
+    # /graph/query returns at most GRAPH_QUERY_MAX_ROWS matches and gives up on a query after
+    # GRAPH_QUERY_TIMEOUT seconds, see patterns.py
+    GRAPH_QUERY_MAX_ROWS = 1000
+    GRAPH_QUERY_TIMEOUT = 5
+
+    # /page/concordance returns at most CONCORDANCE_MAX_ROWS occurrences
+    CONCORDANCE_MAX_ROWS = 2000
+
+    # Duplicate detection ignores name trigrams and content words shared by more entities than this
+    DUPLICATES_MAX_BLOCK = 200
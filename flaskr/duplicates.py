@@ -0,0 +1,191 @@
+"""
+Finding likely duplicate entities (the same person under two names, say) to merge.
+
+Comparing every pair of names doesn't scale, so entities are first blocked on the trigrams of
+their names: only entities sharing at least one trigram are ever compared.  Trigrams shared by
+very many names (" th", "son") say little and would make huge blocks, so they are left out.
+Each candidate pair is then scored, in one vectorised pass, from the overlap of name trigrams
+and of content words, and the pairs above a threshold are joined up into clusters.
+
+Results are cached per entity type until the next write to an entity table.
+"""
+import re
+import threading
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+
+from .models import db, Node, Person, Location, Event
+from .indexes import LazyIndex
+from .revisions import ENTITIES, GRAPH
+
+ENTITY_MODELS = {
+    'person': Person,
+    'location': Location,
+    'event': Event
+}
+
+NAME_WEIGHT = 0.8
+CONTENT_WEIGHT = 0.2
+
+
+def name_trigrams(name: str) -> set[str]:
+    key = f"  {' '.join(name.casefold().split())} "
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+def content_words(content: str) -> set[str]:
+    return {w for w in re.split(r"[^\w']+", (content or "").casefold()) if len(w) > 2}
+
+
+def _encode(feature_sets: list[set]) -> tuple[np.ndarray, np.ndarray]:
+    """Flatten a list of feature sets into parallel (owner, feature id) arrays"""
+    vocabulary = {}
+    owners, features = [], []
+    for owner, feature_set in enumerate(feature_sets):
+        for feature in feature_set:
+            owners.append(owner)
+            features.append(vocabulary.setdefault(feature, len(vocabulary)))
+    return np.array(owners, dtype=np.int64), np.array(features, dtype=np.int64)
+
+def shared_features(owners: np.ndarray, features: np.ndarray, n: int, max_block: int):
+    """
+    Count the features shared by every pair of owners that have any in common, ignoring features
+    owned by more than max_block owners.
+
+    Returns:
+        codes: i * n + j for each pair with i < j, sorted
+        shared: number of features the pair has in common
+        sizes: number of (non-ignored) features each owner has
+    """
+    block_sizes = np.bincount(features) if len(features) else np.empty(0, np.int64)
+    keep = block_sizes[features] <= max_block if len(features) else np.empty(0, bool)
+    owners, features = owners[keep], features[keep]
+    sizes = np.bincount(owners, minlength=n)
+
+    order = np.lexsort((owners, features))
+    owners, features = owners[order], features[order]
+    boundaries = np.flatnonzero(np.diff(features)) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(features)]])
+
+    pair_codes = []
+    for size in np.unique(ends - starts):
+        if size < 2:
+            continue
+        # Every block of this size at once: an (n_blocks, size) matrix of owners
+        block_starts = starts[(ends - starts) == size]
+        members = owners[block_starts[:, None] + np.arange(size)]
+        i, j = np.triu_indices(size, k=1)
+        pair_codes.append((members[:, i] * n + members[:, j]).ravel())
+    if not pair_codes:
+        return np.empty(0, np.int64), np.empty(0, np.int64), sizes
+    codes, shared = np.unique(np.concatenate(pair_codes), return_counts=True)
+    return codes, shared, sizes
+
+def _jaccard(codes, shared, sizes, n):
+    a, b = codes // n, codes % n
+    return shared / np.maximum(sizes[a] + sizes[b] - shared, 1)
+
+def _clusters(a: np.ndarray, b: np.ndarray, n: int) -> np.ndarray:
+    """Connected component label of every owner, over the given pairs"""
+    labels = np.arange(n)
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, a, labels[b])
+        np.minimum.at(labels, b, labels[a])
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def find_duplicates(entities: list[tuple], threshold: float = 0.5, max_block: int = 200) -> list[dict]:
+    """
+    Args:
+        entities: (node_id, entity_id, name, content) tuples
+        threshold: the lowest score, from 0 to 1, for a pair to count as a candidate
+        max_block: trigrams/words shared by more entities than this are not used
+    Returns:
+        Candidate clusters, best first, each with its members and scored pairs
+    """
+    n = len(entities)
+    if n < 2:
+        return []
+    codes, shared, sizes = shared_features(*_encode([name_trigrams(e[2]) for e in entities]), n, max_block)
+    score = NAME_WEIGHT * _jaccard(codes, shared, sizes, n)
+
+    # Content only adds to pairs which are already candidates on their names
+    content_codes, content_shared, content_sizes = shared_features(
+        *_encode([content_words(e[3]) for e in entities]), n, max_block
+    )
+    if len(content_codes) and len(codes):
+        content_score = _jaccard(content_codes, content_shared, content_sizes, n)
+        positions = np.minimum(np.searchsorted(content_codes, codes), len(content_codes) - 1)
+        found = content_codes[positions] == codes
+        score = score + CONTENT_WEIGHT * np.where(found, content_score[positions], 0.0)
+
+    keep = score >= threshold
+    codes, score = codes[keep], score[keep]
+    a, b = codes // n, codes % n
+    labels = _clusters(a, b, n)
+
+    clusters = {}
+    for i, j, s in zip(a.tolist(), b.tolist(), score.tolist()):
+        cluster = clusters.setdefault(int(labels[i]), {'members': set(), 'pairs': []})
+        cluster['members'].update((i, j))
+        cluster['pairs'].append((s, i, j))
+
+    def member(i):
+        node_id, entity_id, name, _ = entities[i]
+        return {'node_id': node_id, 'id': entity_id, 'name': name}
+
+    results = []
+    for cluster in clusters.values():
+        pairs = sorted(cluster['pairs'], reverse=True)
+        results.append({
+            'score': round(pairs[0][0], 4),
+            'members': [member(i) for i in sorted(cluster['members'], key=lambda i: entities[i][0])],
+            'pairs': [
+                {'a': entities[i][0], 'b': entities[j][0], 'score': round(s, 4)}
+                for s, i, j in pairs
+            ]
+        })
+    results.sort(key=lambda c: (-c['score'], c['members'][0]['node_id']))
+    return results
+
+
+def load_entities(entity_type: str) -> list[tuple]:
+    """(node_id, entity_id, name, content) for the live entities of one type"""
+    model = ENTITY_MODELS[entity_type]
+    rows = db.session.execute(
+        select(model.node_id, model.id, model.name, model.content)
+        .join(Node, Node.id == model.node_id)
+        .where(model.deleted != 1, Node.deleted != 1, Node.merged.is_(None))
+        .order_by(model.node_id)
+    ).all()
+    return [tuple(row) for row in rows]
+
+
+class DuplicatesIndex(LazyIndex):
+    """
+    Cached duplicate clusters, per (entity type, threshold).  Merging or deleting a node only
+    touches the nodes table, so the graph counter is watched as well as the entities one.
+    """
+    name = 'entity_duplicates'
+    revision = (GRAPH, ENTITIES)
+
+    def build(self, previous=None):
+        return {'lock': threading.Lock(), 'results': {}}
+
+    def candidates(self, entity_type: str, threshold: float) -> list[dict]:
+        state = self.state()
+        key = (entity_type, threshold)
+        with state['lock']:
+            if key not in state['results']:
+                state['results'][key] = find_duplicates(
+                    load_entities(entity_type), threshold,
+                    current_app.config.get('DUPLICATES_MAX_BLOCK', 200)
+                )
+            return state['results'][key]
+
+entity_duplicates = DuplicatesIndex()
@@ -0,0 +1,74 @@
+"""
+Conditional GETs for responses which only change when a revision counter moves.
+
+A view marked with `@conditional(...)` gets a strong ETag built from the current values of its
+revision counters (see revisions.py).  A request whose If-None-Match still matches is answered
+with 304 Not Modified straight away, so the view and its queries never run: the only cost is
+reading the counters.
+
+When a response is compressed its ETag gains the encoding as a suffix, e.g. "...-gzip", since
+each encoding is a different representation (see compression.py).  Either form matches here.
+"""
+import functools
+import hashlib
+
+from flask import request, make_response
+
+from .revisions import current
+from .compression import available_encodings
+from .workspaces import current_workspace
+
+
+def revision_etag(values: dict[str, int]) -> str:
+    # Every workspace has its own counters, so the same values mean different data in each
+    text = f'{current_workspace()}:' + ','.join(f'{name}={value}' for name, value in sorted(values.items()))
+    return hashlib.sha1(text.encode()).hexdigest()[:20]
+
+def _strip_encoding(tag: str) -> str:
+    base, _, encoding = tag.rpartition('-')
+    return base if base and encoding in available_encodings() else tag
+
+def _not_modified(tag: str) -> bool:
+    if_none_match = request.if_none_match
+    if if_none_match.star_tag:
+        return True
+    return any(_strip_encoding(sent) == tag for sent in if_none_match.as_set(include_weak=True))
+
+def if_match(names) -> bool:
+    """
+    Whether a write's If-Match, if it sent one, still matches the counters.  A client which read
+    the data before the latest change gets False, so it doesn't apply a change to a stale copy.
+    """
+    sent = request.if_match
+    if not sent or sent.star_tag:
+        return True
+    tag = revision_etag(current(*names))
+    return any(_strip_encoding(s) == tag for s in sent.as_set())
+
+def conditional(revisions):
+    """
+    Mark a view whose response only changes when the given revision counters move.
+
+    Args:
+        revisions: A counter name, or a function taking the view's arguments and returning
+            the names of the counters, e.g. one per requested page.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            names = revisions(*args, **kwargs) if callable(revisions) else [revisions]
+            tag = revision_etag(current(*names))
+            if _not_modified(tag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(tag)
+            # Caches may keep the response but must check it is still current before using it
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,95 @@
+"""
+The live graph as NumPy arrays, for layout and analytics.
+
+Nodes are every node which is neither deleted nor merged away, sorted by id.  Edges are the live
+relationships between them, stored once per linked pair (any duplicate links between the same
+two nodes collapse to a single undirected edge) as indices into the node array.
+The arrays are cached against the graph revision, so they are only reloaded after a write.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+from sqlalchemy import select
+
+from .models import db, Node, Relationship
+from .indexes import LazyIndex
+from .revisions import GRAPH
+
+
+@dataclass
+class GraphArrays:
+    """
+    Attributes:
+        node_ids (ndarray): Sorted ids of the live nodes.
+        node_types (ndarray): The node_type of each node.
+        src (ndarray): Index of the first node of each undirected edge.
+        dst (ndarray): Index of the second node of each undirected edge (src < dst).
+    """
+    node_ids: np.ndarray
+    node_types: np.ndarray
+    src: np.ndarray
+    dst: np.ndarray
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.src)
+
+    def index_of(self, ids) -> np.ndarray:
+        """Positions of the given node ids in node_ids, or -1 for ids that aren't live nodes"""
+        return _index_of(self.node_ids, ids)
+
+    def degree(self) -> np.ndarray:
+        return (np.bincount(self.src, minlength=self.n_nodes)
+                + np.bincount(self.dst, minlength=self.n_nodes))
+
+    def csr(self) -> tuple[np.ndarray, np.ndarray]:
+        """Symmetric adjacency in CSR form: the neighbours of i are indices[indptr[i]:indptr[i+1]]"""
+        rows = np.concatenate([self.src, self.dst])
+        cols = np.concatenate([self.dst, self.src])
+        order = np.argsort(rows, kind='stable')
+        indptr = np.zeros(self.n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=self.n_nodes), out=indptr[1:])
+        return indptr, cols[order]
+
+
+def _index_of(sorted_ids: np.ndarray, ids) -> np.ndarray:
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(sorted_ids) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[positions] == ids, positions, -1)
+
+def load_graph_arrays() -> GraphArrays:
+    nodes = db.session.execute(
+        select(Node.id, Node.node_type)
+        .where(Node.deleted != 1, Node.merged.is_(None))
+        .order_by(Node.id)
+    ).all()
+    node_ids = np.fromiter((n.id for n in nodes), dtype=np.int64, count=len(nodes))
+    node_types = np.array([n.node_type for n in nodes], dtype=object)
+
+    rels = db.session.execute(
+        select(Relationship.start, Relationship.end).where(Relationship.deleted != 1)
+    ).all()
+    ends = np.array(rels, dtype=np.int64).reshape(-1, 2)
+    a, b = _index_of(node_ids, ends[:, 0]), _index_of(node_ids, ends[:, 1])
+    live = (a >= 0) & (b >= 0) & (a != b)
+    lo, hi = np.minimum(a[live], b[live]), np.maximum(a[live], b[live])
+    # One edge per unordered pair
+    n = max(len(node_ids), 1)
+    pairs = np.unique(lo * n + hi)
+    return GraphArrays(node_ids, node_types, pairs // n, pairs % n)
+
+
+class GraphArraysIndex(LazyIndex):
+    name = 'graph_arrays'
+    revision = GRAPH
+
+    def build(self, previous=None):
+        return load_graph_arrays()
+
+graph_arrays = GraphArraysIndex()
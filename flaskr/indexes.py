@@ -0,0 +1,129 @@
+"""
+In-process indexes and caches built from the database, e.g. autocomplete lists or graph arrays.
+
+None of these are built when the app starts.  Each index is built the first time a request needs
+it, or ahead of time by `warm_indexes` on a background thread, so worker boot stays cheap.
+Every app, and every workspace within it, gets its own copy of an index, and any index can be thrown away with `reset` and will
+simply be rebuilt on its next use.  An index which names a `revision` counter (see revisions.py)
+is also rebuilt whenever that counter has moved since it was built, unless it implements `apply`
+to bring itself up to date with the changes committed in this process (see changes.py).  An
+index can name a tuple of counters instead, and is then rebuilt when any of them moves.
+"""
+import threading
+
+from flask import current_app
+
+from .revisions import current, current_revision
+from .changes import on_change
+from .workspaces import current_workspace
+
+
+class LazyIndex:
+    """
+    Base class for a lazily built in-process index.  Subclasses implement `build`, which runs
+    inside an app context and returns the index's state, and use `state()` to read it.
+    `build` is given the previous state, if there was one, so it can update rather than start
+    from scratch.
+    """
+    name = None
+    revision = None
+    # Optionally apply(state, changes) -> state, to update the index in place after a commit.
+    # Returning None throws the state away, to be rebuilt on next use.
+    apply = None
+    _registry: list["LazyIndex"] = []
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.RLock()
+        LazyIndex._registry.append(self)
+
+    def build(self, previous=None):
+        raise NotImplementedError
+
+    def _key(self):
+        return id(current_app._get_current_object()), current_workspace()
+
+    def _revision(self):
+        if not self.revision:
+            return None
+        if isinstance(self.revision, tuple):
+            values = current(*self.revision)
+            return tuple(values[name] for name in self.revision)
+        return current_revision(self.revision)
+
+    def _is_current(self, entry, revision) -> bool:
+        return entry is not None and entry[0] == revision
+
+    def state(self):
+        """Return the index state for the current app, building it on first use or when stale."""
+        key = self._key()
+        # Read the revision before building, so a concurrent write can only make us rebuild again
+        revision = self._revision()
+        entry = self._states.get(key)
+        if not self._is_current(entry, revision):
+            with self._lock:
+                entry = self._states.get(key)
+                if not self._is_current(entry, revision):
+                    previous = entry[1] if entry is not None else None
+                    entry = (revision, self.build(previous))
+                    self._states[key] = entry
+        return entry[1]
+
+    def reset(self):
+        """Throw away the index in every app.  It will be rebuilt when next used."""
+        with self._lock:
+            self._states.clear()
+
+    def __repr__(self) -> str:
+        return f"<LazyIndex {self.name}>"
+
+
+@on_change
+def _apply_changes(changes, revisions):
+    """
+    Update indexes in place after a local commit.  Only an index which was current just before
+    the transaction is updated; anything else is left to rebuild on its next use.
+    """
+    for index in LazyIndex._registry:
+        # Only indexes on a single counter can be brought up to date in place
+        if index.apply is None or not isinstance(index.revision, str) or index.revision not in revisions:
+            continue
+        before, after = revisions[index.revision]
+        key = index._key()
+        with index._lock:
+            entry = index._states.get(key)
+            if entry is None or entry[0] != before:
+                continue
+            try:
+                state = index.apply(entry[1], changes)
+            except Exception:
+                current_app.logger.exception(f"Failed to update index {index.name}, it will be rebuilt")
+                state = None
+            if state is None:
+                del index._states[key]
+            else:
+                index._states[key] = (after, state)
+
+def registered_indexes() -> list[LazyIndex]:
+    return list(LazyIndex._registry)
+
+def reset_indexes():
+    for index in LazyIndex._registry:
+        index.reset()
+
+def warm_indexes(app, background=True):
+    """Build every registered index for the app, on a daemon thread unless told otherwise."""
+    def warm():
+        with app.app_context():
+            for index in LazyIndex._registry:
+                try:
+                    index.state()
+                except Exception:
+                    app.logger.exception(f"Failed to warm index {index.name}")
+
+    if not background:
+        warm()
+        return None
+    thread = threading.Thread(target=warm, name="warm-indexes", daemon=True)
+    thread.start()
+    return thread
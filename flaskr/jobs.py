@@ -0,0 +1,166 @@
+"""
+A small in-process runner for work which is too slow to do inside a request, e.g. merging a large
+cluster of nodes.  No broker is needed: jobs are rows in the `jobs` table and run on a thread
+pool owned by the app.
+
+    @job('merge_nodes')
+    def merge_nodes_job(ctx, node_ids):
+        ...
+        ctx.report(0.5, checkpoint={'done': [...]})
+        return result
+
+    job = enqueue('merge_nodes', node_ids=[1, 2])   # returns straight away
+    GET /jobs/<job.id>                              # progress, result or error
+
+A job reports progress through its JobContext, which also acts as a heartbeat.  Anything passed
+as `checkpoint` is saved with the job, so if the process dies the job can be picked up again
+(by the next runner to start, or when its status is polled) and carry on from where it stopped.
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from .models import db, Job
+from .workspaces import current_workspace, use_workspace
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_job_functions = {}
+_runner_lock = threading.Lock()
+
+
+def job(name: str):
+    """Register a function as a job.  It is called as fn(ctx, **params)."""
+    def decorator(fn):
+        _job_functions[name] = fn
+        return fn
+    return decorator
+
+
+class JobContext:
+    """Handed to a running job so it can report progress and save a checkpoint."""
+    def __init__(self, job: Job):
+        self.job_id = job.id
+        self.checkpoint = json.loads(job.checkpoint) if job.checkpoint else {}
+
+    def report(self, progress: float, checkpoint: dict = None):
+        job = db.session.get(Job, self.job_id)
+        job.progress = min(max(progress, 0.0), 1.0)
+        job.updated = datetime.now()
+        if checkpoint is not None:
+            self.checkpoint = checkpoint
+            job.checkpoint = json.dumps(checkpoint, default=str)
+        db.session.commit()
+
+
+class JobRunner:
+    """A thread pool which runs jobs inside an app context."""
+    def __init__(self, app):
+        self.app = app
+        self.executor = ThreadPoolExecutor(
+            max_workers=app.config.get('JOBS_MAX_WORKERS', 2),
+            thread_name_prefix='job'
+        )
+
+    def submit(self, job_id: int, workspace: str = None):
+        return self.executor.submit(self._run, job_id, workspace)
+
+    def _run(self, job_id: int, workspace: str = None):
+        with self.app.app_context():
+            # The job is a row in its workspace's database
+            use_workspace(workspace)
+            run_job(job_id)
+
+
+def get_runner(app=None) -> JobRunner:
+    """Return the app's runner, starting it (and resuming unfinished jobs) on first use."""
+    app = app or current_app._get_current_object()
+    runner = app.extensions.get('job_runner')
+    if runner is None:
+        with _runner_lock:
+            runner = app.extensions.get('job_runner')
+            if runner is None:
+                runner = JobRunner(app)
+                app.extensions['job_runner'] = runner
+                resume_jobs(runner)
+    return runner
+
+
+def _stale_before() -> datetime:
+    return datetime.now() - timedelta(seconds=current_app.config.get('JOBS_STALE_AFTER', 60))
+
+def is_stale(job: Job) -> bool:
+    """A running job which hasn't reported for a while was most likely left by a dead worker."""
+    return job.status == RUNNING and job.updated < _stale_before()
+
+def _claim(job_id: int) -> Job | None:
+    """Atomically mark a job as running, so two runners never pick up the same job."""
+    claimable = (Job.status == QUEUED) | ((Job.status == RUNNING) & (Job.updated < _stale_before()))
+    claimed = Job.query.filter(Job.id == job_id, claimable).update(
+        {'status': RUNNING, 'updated': datetime.now()}, synchronize_session=False
+    )
+    db.session.commit()
+    if not claimed:
+        return None
+    return db.session.get(Job, job_id)
+
+
+def run_job(job_id: int) -> Job | None:
+    """Run a job in the current app context and record its result or error."""
+    job = _claim(job_id)
+    if job is None:
+        return None
+    fn = _job_functions.get(job.name)
+    try:
+        if fn is None:
+            raise LookupError(f"No job registered with the name '{job.name}'")
+        result = fn(JobContext(job), **json.loads(job.params))
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(f"Job {job_id} ({job.name}) failed")
+        job = db.session.get(Job, job_id)
+        job.status = FAILED
+        job.error = getattr(e, 'description', None) or f"{type(e).__name__}: {e}"
+    else:
+        job = db.session.get(Job, job_id)
+        job.status = DONE
+        job.progress = 1.0
+        job.result = json.dumps(result, default=str)
+    db.session.commit()
+    return job
+
+
+def enqueue(name: str, **params) -> Job:
+    """Persist a new job and hand it to the runner.  Returns without waiting for it."""
+    if name not in _job_functions:
+        raise LookupError(f"No job registered with the name '{name}'")
+    job = Job(name=name, status=QUEUED, params=json.dumps(params, default=str))
+    db.session.add(job)
+    db.session.commit()
+    db.session.refresh(job)
+
+    if current_app.config.get('JOBS_EAGER'):
+        # Run inline, e.g. in tests
+        run_job(job.id)
+        db.session.refresh(job)
+    else:
+        get_runner().submit(job.id, current_workspace())
+    return job
+
+
+def resume_jobs(runner: JobRunner) -> list[int]:
+    """Resubmit every job which is still queued, or was running in a worker that has died."""
+    with runner.app.app_context():
+        unfinished = Job.query.filter(
+            (Job.status == QUEUED) | ((Job.status == RUNNING) & (Job.updated < _stale_before()))
+        ).with_entities(Job.id).all()
+    job_ids = [job_id for (job_id,) in unfinished]
+    for job_id in job_ids:
+        runner.submit(job_id)
+    return job_ids
@@ -0,0 +1,139 @@
+"""
+Server-side force-directed layout of the live graph, so the frontend can draw positions straight
+away instead of running its own simulation.
+
+The layout is a vectorised Fruchterman-Reingold: springs along edges, repulsion between nodes and
+a weak pull to the centre to keep separate components on screen.  Repulsion is exact for small
+graphs and estimated from a random sample of nodes for large ones, so each iteration is
+O(nodes * sample + edges).
+
+Positions are cached against the graph revision.  After a change the previous positions are
+reused, new nodes start next to their neighbours, and only a few cool iterations are run, so
+the picture moves as little as possible.
+"""
+import numpy as np
+from flask import current_app
+
+from .graphdata import graph_arrays, GraphArrays
+from .indexes import LazyIndex
+from .revisions import GRAPH
+
+# Nodes handled per block when computing repulsion, to bound memory
+_BLOCK = 1024
+
+
+def _repulsion(pos: np.ndarray, k2: float, sample: int, rng) -> np.ndarray:
+    n = len(pos)
+    if n <= sample:
+        others, scale = pos, 1.0
+    else:
+        others, scale = pos[rng.choice(n, sample, replace=False)], n / sample
+    ox, oy = others[:, 0], others[:, 1]
+    disp = np.empty_like(pos)
+    for start in range(0, n, _BLOCK):
+        dx = pos[start:start + _BLOCK, 0, None] - ox
+        dy = pos[start:start + _BLOCK, 1, None] - oy
+        force = k2 / (dx * dx + dy * dy + 1e-9)
+        disp[start:start + _BLOCK, 0] = (dx * force).sum(axis=1)
+        disp[start:start + _BLOCK, 1] = (dy * force).sum(axis=1)
+    return disp * scale
+
+def force_layout(n: int, src: np.ndarray, dst: np.ndarray, pos: np.ndarray = None,
+                 iterations: int = 50, temperature: float = None, sample: int = 256,
+                 gravity: float = 0.05, seed: int = 0) -> np.ndarray:
+    """
+    Lay out n nodes joined by the undirected edges (src[i], dst[i]).
+
+    Args:
+        pos: starting positions, shape (n, 2).  Random if not given.
+        iterations: number of steps to run.
+        temperature: the largest distance a node may move in the first step.  Defaults to a
+            tenth of the layout's width, and cools linearly to zero.
+    Returns:
+        ndarray of shape (n, 2)
+    """
+    rng = np.random.default_rng(seed)
+    width = np.sqrt(max(n, 1))
+    if pos is None:
+        pos = rng.uniform(-width / 2, width / 2, size=(n, 2))
+    pos = np.array(pos, dtype=np.float64)
+    if n < 2:
+        return pos
+    if temperature is None:
+        temperature = width / 10
+
+    k = 1.0  # The ideal edge length
+    for step in range(iterations):
+        disp = _repulsion(pos, k * k, sample, rng)
+        delta = pos[src] - pos[dst]
+        dist = np.sqrt(np.einsum('ij,ij->i', delta, delta)) + 1e-9
+        pull = delta * (dist / k)[:, None]
+        np.subtract.at(disp, src, pull)
+        np.add.at(disp, dst, pull)
+        disp -= gravity * pos
+
+        length = np.sqrt(np.einsum('ij,ij->i', disp, disp)) + 1e-9
+        limit = temperature * (1 - step / iterations)
+        pos += disp * (np.minimum(length, limit) / length)[:, None]
+    return pos
+
+def _warm_start(graph: GraphArrays, previous: "Layout", rng) -> tuple[np.ndarray, int]:
+    """Positions carried over from the previous layout, with new nodes placed by their neighbours."""
+    pos = np.full((graph.n_nodes, 2), np.nan)
+    old = previous.graph.index_of(graph.node_ids)
+    known = old >= 0
+    pos[known] = previous.positions[old[known]]
+
+    # New nodes go to the centre of their placed neighbours, or near the middle if they have none
+    placed = known.astype(np.float64)
+    total = np.zeros((graph.n_nodes, 2))
+    count = np.zeros(graph.n_nodes)
+    for a, b in ((graph.src, graph.dst), (graph.dst, graph.src)):
+        np.add.at(total, a, np.nan_to_num(pos[b]) * placed[b, None])
+        np.add.at(count, a, placed[b])
+    new = ~known
+    has_neighbours = new & (count > 0)
+    pos[has_neighbours] = total[has_neighbours] / count[has_neighbours, None]
+    centre = pos[known].mean(axis=0) if known.any() else np.zeros(2)
+    pos[new & ~has_neighbours] = centre
+    pos[new] += rng.normal(scale=0.5, size=(new.sum(), 2))
+    return pos, int(new.sum())
+
+
+class Layout:
+    def __init__(self, graph: GraphArrays, positions: np.ndarray):
+        self.graph = graph
+        self.positions = positions
+
+    def position(self, node_id: int) -> tuple[float, float] | None:
+        i = self.graph.index_of([node_id])[0]
+        if i < 0:
+            return None
+        x, y = self.positions[i]
+        return round(float(x), 3), round(float(y), 3)
+
+    def as_dict(self) -> dict[int, tuple[float, float]]:
+        rounded = np.round(self.positions, 3).tolist()
+        return {int(node_id): tuple(xy) for node_id, xy in zip(self.graph.node_ids, rounded)}
+
+
+class LayoutIndex(LazyIndex):
+    name = 'graph_layout'
+    revision = GRAPH
+
+    def build(self, previous=None):
+        config = current_app.config
+        graph = graph_arrays.state()
+        rng = np.random.default_rng(config.get('LAYOUT_SEED', 0))
+        options = dict(sample=config.get('LAYOUT_SAMPLE', 256), seed=config.get('LAYOUT_SEED', 0))
+        if previous is None or previous.graph.n_nodes == 0:
+            positions = force_layout(graph.n_nodes, graph.src, graph.dst,
+                                     iterations=config.get('LAYOUT_ITERATIONS', 50), **options)
+        else:
+            start, _ = _warm_start(graph, previous, rng)
+            positions = force_layout(graph.n_nodes, graph.src, graph.dst, pos=start,
+                                     iterations=config.get('LAYOUT_WARM_ITERATIONS', 15),
+                                     temperature=1.0, **options)
+        return Layout(graph, positions)
+
+graph_layout = LayoutIndex()
@@ -0,0 +1,226 @@
+"""
+A bounded in-process cache of serialised nodes, entities and pages, for the lookups which are
+repeated on every request, e.g. the entity of every node in /vis/graph.
+
+Entries are keyed by kind and id: ('node', node id), ('entity', node id) and ('page', page number).
+They are dropped exactly when the rows behind them change:
+
+    - each flush notes the cached rows it touched, as do the changes recorded for set-based
+      updates (see changes.py).  Until the transaction ends those keys skip the cache in that
+      session, so it reads its own writes and never caches data which could be rolled back
+    - after_commit drops the keys from the cache, after_rollback just forgets them
+
+Commits made by another process can't be seen that way, so the cache also remembers the values
+of the graph and pages revision counters it agrees with.  Each request reads them once, and a
+counter which has moved without this process committing the change clears the cache.
+
+A value read from the database while a commit invalidated the cache is returned but not kept:
+every invalidation moves a generation number, which is checked before storing.
+"""
+import threading
+from collections import OrderedDict
+from itertools import chain
+
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event, select
+from flask_sqlalchemy.session import Session
+
+from .models import db, Node, Page, Person, Location, Event, Tag, Serialiser
+from .indexes import LazyIndex
+from .revisions import current, GRAPH, PAGES
+from .changes import _PENDING, _REVISIONS
+
+ENTITY_MODELS = {'person': Person, 'location': Location, 'event': Event, 'tag': Tag}
+ENTITY_TABLES = {'people', 'locations', 'events', 'tags'}
+# The counters covering everything which can be cached
+STAMPED = (GRAPH, PAGES)
+
+_TOUCHED = 'lookup_keys'
+_VALIDATED = 'flaskr.lookup_cache'
+
+
+class LookupCache:
+    """An LRU of serialised rows with hit, miss and eviction counts"""
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.stamp = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation: int):
+        """Keep a value read at `generation`, unless something has been invalidated since"""
+        with self._lock:
+            if generation != self.generation or self.size <= 0:
+                return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys, revisions: dict = None):
+        """Drop keys changed by a local commit and catch up with the counters it moved"""
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                if self.entries.pop(key, None) is not None:
+                    self.invalidations += 1
+            for name in STAMPED:
+                if self.stamp is None or name not in (revisions or {}):
+                    continue
+                before, after = revisions[name]
+                if self.stamp[name] == before:
+                    self.stamp[name] = after
+                else:
+                    # Someone else committed as well, so we can't tell what is stale
+                    self.stamp = None
+
+    def validate(self, values: dict[str, int]):
+        """Clear everything if the counters have moved since the cache last agreed with them"""
+        with self._lock:
+            if self.stamp != values:
+                self.generation += 1
+                self.entries.clear()
+                self.stamp = dict(values)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'capacity': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+class LookupCacheIndex(LazyIndex):
+    name = 'lookup_cache'
+
+    def build(self, previous=None):
+        return LookupCache(current_app.config.get('LOOKUP_CACHE_SIZE', 4096))
+
+lookup_cache = LookupCacheIndex()
+
+
+def _keys_for(obj) -> list[tuple]:
+    if isinstance(obj, Node):
+        return [('node', obj.id)]
+    if isinstance(obj, Tag):
+        # Tags share their id with their node
+        return [('entity', obj.id)]
+    if isinstance(obj, (Person, Location, Event)):
+        return [('entity', obj.node_id)]
+    if isinstance(obj, Page):
+        return [('page', obj.page_number)]
+    return []
+
+def _change_keys(change) -> list[tuple]:
+    if change.table == 'nodes':
+        return [('node', change.id)]
+    if change.table in ENTITY_TABLES:
+        return [('entity', node_id) for node_id in change.node_ids]
+    return []
+
+def _touched(session) -> set:
+    """The keys this session has changed but not yet committed"""
+    keys = set(session.info.get(_TOUCHED, ()))
+    for change in session.info.get(_PENDING, ()):
+        keys.update(_change_keys(change))
+    return keys
+
+
+@event.listens_for(Session, "after_flush")
+def _note_touched(session, flush_context):
+    keys = session.info.setdefault(_TOUCHED, set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        keys.update(_keys_for(obj))
+
+# Inserted ahead of changes.py's listener, which takes the pending changes away
+@event.listens_for(Session, "after_commit", insert=True)
+def _invalidate_committed(session):
+    keys = _touched(session)
+    session.info.pop(_TOUCHED, None)
+    revisions = session.info.get(_REVISIONS, {})
+    if (keys or revisions) and has_app_context():
+        lookup_cache.state().invalidate(keys, revisions)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_touched(session):
+    session.info.pop(_TOUCHED, None)
+
+
+def _cache() -> LookupCache:
+    cache = lookup_cache.state()
+    # Once per request, or on every lookup outside one (jobs, the CLI)
+    if has_request_context() and request.environ.get(_VALIDATED) is cache:
+        return cache
+    cache.validate(current(*STAMPED))
+    if has_request_context():
+        request.environ[_VALIDATED] = cache
+    return cache
+
+def _lookup(key, load):
+    session = db.session()
+    # Changes not yet flushed count as this session's own writes too
+    if session.autoflush:
+        session.flush()
+    if key in _touched(session):
+        return load()
+    cache = _cache()
+    value = cache.get(key)
+    if value is None:
+        generation = cache.generation
+        value = load()
+        if value is not None:
+            cache.put(key, value, generation)
+    return dict(value) if value is not None else None
+
+
+def _load_node(node_id: int) -> dict | None:
+    node = db.session.get(Node, node_id)
+    return Serialiser.to_dict(Node, node) if node is not None else None
+
+def _load_entity(node_id: int) -> dict | None:
+    node = db.session.get(Node, node_id)
+    model = ENTITY_MODELS.get(node.node_type.lower()) if node is not None else None
+    if model is None:
+        return None
+    entity = db.session.execute(select(model).where(model.node_id == node_id)).scalars().first()
+    return Serialiser.to_dict(model, entity) if entity is not None else None
+
+def _load_page(page_number: int) -> dict | None:
+    page = db.session.execute(select(Page).where(Page.page_number == page_number)).scalars().first()
+    return Serialiser.to_dict(Page, page) if page is not None else None
+
+def node_dict(node_id: int) -> dict | None:
+    """A node's columns, or None if there is no such node"""
+    return _lookup(('node', node_id), lambda: _load_node(node_id))
+
+def entity_dict(node_id: int) -> dict | None:
+    """The columns of a node's person, location, event or tag, or None if it has none"""
+    return _lookup(('entity', node_id), lambda: _load_entity(node_id))
+
+def page_dict(page_number: int) -> dict | None:
+    return _lookup(('page', page_number), lambda: _load_page(page_number))
+
+def lookup_stats() -> dict:
+    return lookup_cache.state().stats()
@@ -0,0 +1,197 @@
+"""
+Where each person, location and event is named in the book.
+
+Every live entity name is compiled into one Aho-Corasick automaton, so all the pages can be
+scanned for every name in a single pass instead of one search per name.  Matches are case
+insensitive and must start and end on a word boundary.  The mentions are stored in the
+`mentions` table and kept up to date as things change:
+
+    - editing a page re-scans just that page, with every name (see pages.edit_page_content)
+    - creating or renaming an entity re-scans every page, for just that name (on flush)
+
+Mentions of deleted or merged entities are left in place and filtered out when read.
+"""
+from collections import deque
+
+from sqlalchemy import select, delete, insert, event, inspect
+from flask_sqlalchemy.session import Session
+
+from .models import db, Mention, Page, Node, Person, Location, Event
+from .indexes import LazyIndex
+from .revisions import ENTITIES
+
+ENTITY_MODELS = (Person, Location, Event)
+
+
+def fold(text: str) -> str:
+    """Lower case text without changing its length, so offsets into it are offsets into text"""
+    return ''.join(c if len(lower := c.lower()) != 1 else lower for c in text)
+
+def normalise_name(name: str) -> str:
+    return fold(' '.join((name or '').split()))
+
+def _on_boundary(text: str, start: int, end: int) -> bool:
+    return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+
+class Automaton:
+    """
+    An Aho-Corasick automaton over a set of patterns, each owned by one or more node ids.
+    """
+    def __init__(self, patterns: dict[str, set[int]]):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        self.patterns = []
+        for pattern, owners in patterns.items():
+            if len(pattern) < 2:
+                continue
+            state = 0
+            for c in pattern:
+                if c not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[state][c] = len(self.goto) - 1
+                state = self.goto[state][c]
+            self.out[state].append(len(self.patterns))
+            self.patterns.append((len(pattern), sorted(owners)))
+
+        # Breadth first, so a state's failure link is always resolved before its children's.
+        # States one character deep fail back to the root.
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and c not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(c, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def scan(self, text: str) -> list[tuple[int, int, int]]:
+        """Every (node_id, start, end) match in text"""
+        folded = fold(text)
+        goto, fail, out, patterns = self.goto, self.fail, self.out, self.patterns
+        matches = []
+        state = 0
+        for i, c in enumerate(folded):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for pattern in out[state]:
+                length, owners = patterns[pattern]
+                start, end = i + 1 - length, i + 1
+                if _on_boundary(folded, start, end):
+                    matches.extend((owner, start, end) for owner in owners)
+        return matches
+
+
+def find_name(name: str, text: str) -> list[tuple[int, int]]:
+    """Every (start, end) match of a single name in text"""
+    pattern, folded = normalise_name(name), fold(text)
+    if len(pattern) < 2:
+        return []
+    matches = []
+    start = folded.find(pattern)
+    while start != -1:
+        if _on_boundary(folded, start, start + len(pattern)):
+            matches.append((start, start + len(pattern)))
+        start = folded.find(pattern, start + 1)
+    return matches
+
+
+def _live_names(session) -> dict[str, set[int]]:
+    patterns = {}
+    for model in ENTITY_MODELS:
+        rows = session.execute(
+            select(model.node_id, model.name)
+            .join(Node, Node.id == model.node_id)
+            .where(model.deleted != 1, Node.deleted != 1, Node.merged.is_(None))
+        ).all()
+        for node_id, name in rows:
+            patterns.setdefault(normalise_name(name), set()).add(node_id)
+    return patterns
+
+class MentionAutomaton(LazyIndex):
+    """The automaton of every live entity name, rebuilt after any entity write"""
+    name = 'mention_automaton'
+    revision = ENTITIES
+
+    def build(self, previous=None):
+        return Automaton(_live_names(db.session))
+
+mention_automaton = MentionAutomaton()
+
+
+def _rows(page_id: int, matches) -> list[dict]:
+    return [{'node_id': node_id, 'page_id': page_id, 'start': start, 'end': end} for node_id, start, end in matches]
+
+def index_all_mentions() -> int:
+    """Rebuild every mention in one pass over the pages.  Returns the number of mentions found."""
+    automaton = mention_automaton.state()
+    db.session.execute(delete(Mention))
+    rows = []
+    for page_id, content in db.session.execute(select(Page.id, Page.content)):
+        rows.extend(_rows(page_id, automaton.scan(content)))
+    if rows:
+        db.session.execute(insert(Mention), rows)
+    return len(rows)
+
+def index_page_mentions(page: Page):
+    """Re-scan a page for every name.  Runs in the caller's transaction."""
+    db.session.execute(delete(Mention).where(Mention.page_id == page.id))
+    rows = _rows(page.id, mention_automaton.state().scan(page.content))
+    if rows:
+        db.session.execute(insert(Mention), rows)
+
+def index_entity_mentions(connection, node_id: int, name: str):
+    """Re-scan every page for one entity's name"""
+    connection.execute(delete(Mention).where(Mention.node_id == node_id))
+    rows = []
+    for page_id, content in connection.execute(select(Page.id, Page.content)):
+        rows.extend(_rows(page_id, ((node_id, start, end) for start, end in find_name(name, content))))
+    if rows:
+        connection.execute(insert(Mention), rows)
+
+
+@event.listens_for(Session, "after_flush")
+def _index_named_entities(session, flush_context):
+    """Entities which were created or renamed in this flush are re-scanned in the same transaction"""
+    renamed = [
+        obj for obj in list(session.new) + list(session.dirty)
+        if isinstance(obj, ENTITY_MODELS) and obj.node_id is not None
+        and (obj in session.new or inspect(obj).attrs.name.history.has_changes())
+    ]
+    if not renamed:
+        return
+    connection = session.connection()
+    for entity in renamed:
+        index_entity_mentions(connection, entity.node_id, entity.name)
+
+
+def get_entity_mentions(node_id: int) -> list[tuple[Mention, Page]]:
+    return db.session.execute(
+        select(Mention, Page).join(Page, Page.id == Mention.page_id)
+        .where(Mention.node_id == node_id)
+        .order_by(Page.page_number, Mention.start)
+    ).all()
+
+def get_page_mentions(page: Page) -> list[tuple[Mention, str, str]]:
+    """The live mentions on a page with each entity's node type and name"""
+    mentions = []
+    for model in ENTITY_MODELS:
+        mentions.extend(db.session.execute(
+            select(Mention, Node.node_type, model.name)
+            .join(Node, Node.id == Mention.node_id)
+            .join(model, model.node_id == Mention.node_id)
+            .where(
+                Mention.page_id == page.id,
+                model.deleted != 1, Node.deleted != 1, Node.merged.is_(None)
+            )
+        ).all())
+    return sorted(mentions, key=lambda m: (m[0].start, m[0].end, m[0].node_id))
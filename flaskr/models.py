@@ -3,8 +3,13 @@ from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import json
 
+from sqlalchemy import select
+from sqlalchemy.ext.hybrid import hybrid_property
 
-db = SQLAlchemy()
+from .routing import RoutingSession
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Page(db.Model):
     """
@@ -23,6 +28,32 @@ class Page(db.Model):
     def __repr__(self) -> str:
         return f"<Page {self.id}>"
 
+class PageToken(db.Model):
+    """
+    Represents one word of a page's text, for the positional index in concordance.py.
+
+    Attributes:
+        id (int): The primary key of the token.
+        token (str): The normalised (lower case) word.
+        page_id (int): The page the word is on.
+        position (int): The word's position on the page, counting from 0.
+        start (int): The offset of the first character of the word.
+        end (int): The offset just after the last character of the word.
+    """
+    __tablename__ = 'page_tokens'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    token = db.Column(db.String, nullable=False, index=True)
+    page_id = db.Column(db.Integer, db.ForeignKey('pages.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    start = db.Column(db.Integer, nullable=False)
+    end = db.Column(db.Integer, nullable=False)
+
+    # Phrases are matched by looking up the next position on the same page
+    __table_args__ = (db.Index('ix_page_tokens_page_id_position', 'page_id', 'position'),)
+
+    def __repr__(self) -> str:
+        return f"<PageToken {self.token} on {self.page_id}>"
+
 class User(db.Model):
     """
     Represents a user in the application.
@@ -49,12 +80,23 @@ class Tag(db.Model):
         created (datetime): The creation date of the tag.
         deleted (int): Indicates if the tag is deleted (0 or 1).
         name (str): The name of the tag.
+        name_key (str): The normalised (trimmed, case folded) name.  Unique, so the database rejects duplicate tags.
     """
     __tablename__ = 'tags'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     created = db.Column(db.DateTime, default=datetime.now, nullable=False)
     deleted = db.Column(db.Integer, default=0)
     name = db.Column(db.String, nullable=False)
+    name_key = db.Column(db.String, nullable=False, unique=True, index=True)
+
+    @staticmethod
+    def normalise(name: str) -> str:
+        return name.strip().casefold()
+
+    @db.validates('name')
+    def _set_name_key(self, key, name):
+        self.name_key = Tag.normalise(name)
+        return name
 
     def __repr__(self) -> str:
         return f"<Tag {self.name}>"
@@ -80,34 +122,137 @@ class Node(db.Model):
     def __repr__(self) -> str:
         return f"<Node {self.id}>"
 
+class RelationshipType(db.Model):
+    """
+    Represents a kind of relationship, e.g. "visited" / "was visited by".  Each pair is stored once
+    and shared by every relationship of that kind (see reltypes.py).
+
+    Attributes:
+        id (int): The primary key of the relationship type.
+        rel (str): The type of the relationship.
+        ler (str): The reverse type of the relationship.
+    """
+    __tablename__ = 'relationship_types'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    rel = db.Column(db.String, nullable=False)
+    ler = db.Column(db.String, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('rel', 'ler', name='uq_relationship_types_rel_ler'),)
+
+    def __repr__(self) -> str:
+        return f"<RelationshipType {self.rel}/{self.ler}>"
+
 class Relationship(db.Model):
     """
-    Represents a relationship between two nodes in the application.
+    Represents a relationship between two nodes in the application.  Each link is stored as one
+    row; `reverse` presents the other direction (see ReverseRelationship).
 
     Attributes:
         id (int): The primary key of the relationship.
         created (datetime): The creation date of the relationship.
         start (int): The starting node ID of the relationship.
         end (int): The ending node ID of the relationship.
-        rel (str): The type of the relationship.
-        ler (str): The reverse type of the relationship.
+        type_id (int): The relationship type, which holds the rel and ler text.
+        rel (str): The type of the relationship.  Read from, and written to, the relationship type.
+        ler (str): The reverse type of the relationship.  As rel.
         deleted (int): Indicates if the relationship is deleted (0 or 1).
     """
     __tablename__ = 'relationships'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     created = db.Column(db.DateTime, default=datetime.now, nullable=False)
-    start = db.Column(db.Integer, db.ForeignKey('nodes.id'), nullable=False)
-    end = db.Column(db.Integer, db.ForeignKey('nodes.id'), nullable=False)
-    rel = db.Column(db.String, nullable=False)
-    ler = db.Column(db.String, nullable=False)
+    start = db.Column(db.Integer, db.ForeignKey('nodes.id'), nullable=False, index=True)
+    end = db.Column(db.Integer, db.ForeignKey('nodes.id'), nullable=False, index=True)
+    type_id = db.Column(db.Integer, db.ForeignKey('relationship_types.id'), nullable=False, index=True)
     deleted = db.Column(db.Integer, default=0)
 
     start_node = db.relationship('Node', foreign_keys=[start])
     end_node = db.relationship('Node', foreign_keys=[end])
+    type = db.relationship('RelationshipType', lazy='joined')
+
+    # Not columns, but serialised along with them
+    serialised_properties = ('rel', 'ler')
+
+    def _set_type(self, rel: str, ler: str):
+        # Wait until both halves of a new relationship's pair are known
+        if rel is None or ler is None:
+            return
+        from .reltypes import relationship_types
+        self.type = relationship_types.resolve(rel, ler)
+
+    @hybrid_property
+    def rel(self) -> str:
+        return self.type.rel if self.type is not None else getattr(self, '_rel', None)
+
+    @rel.inplace.setter
+    def _rel_setter(self, value: str):
+        self._rel = value
+        self._set_type(value, self.type.ler if self.type is not None else getattr(self, '_ler', None))
+
+    @rel.inplace.expression
+    @classmethod
+    def _rel_expression(cls):
+        return select(RelationshipType.rel).where(RelationshipType.id == cls.type_id).scalar_subquery()
+
+    @hybrid_property
+    def ler(self) -> str:
+        return self.type.ler if self.type is not None else getattr(self, '_ler', None)
+
+    @ler.inplace.setter
+    def _ler_setter(self, value: str):
+        self._ler = value
+        self._set_type(self.type.rel if self.type is not None else getattr(self, '_rel', None), value)
+
+    @ler.inplace.expression
+    @classmethod
+    def _ler_expression(cls):
+        return select(RelationshipType.ler).where(RelationshipType.id == cls.type_id).scalar_subquery()
+
+    @property
+    def reverse(self) -> "ReverseRelationship":
+        return ReverseRelationship(self)
 
     def __repr__(self) -> str:
         return f"<Relationship {self.id}>"
 
+class ReverseRelationship:
+    """
+    The end -> start direction of a relationship.  Links used to be stored as two mirrored rows,
+    and this stands in for the second one wherever code or endpoints still expect it.  It has
+    the same rel and ler as the stored row (as the mirrored row did), and the negated id.
+    Changes to `deleted` are made on the stored row.
+    """
+    def __init__(self, relationship: Relationship):
+        self.relationship = relationship
+
+    @property
+    def id(self) -> int:
+        return -self.relationship.id
+
+    @property
+    def start(self) -> int:
+        return self.relationship.end
+
+    @property
+    def end(self) -> int:
+        return self.relationship.start
+
+    @property
+    def reverse(self) -> Relationship:
+        return self.relationship
+
+    def __getattr__(self, name):
+        # created, type_id, rel, ler, deleted...
+        return getattr(self.relationship, name)
+
+    def __setattr__(self, name, value):
+        if name == 'relationship':
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.relationship, name, value)
+
+    def __repr__(self) -> str:
+        return f"<ReverseRelationship {self.id}>"
+
 class Note(db.Model):
     """
     Represents a note in the application.
@@ -123,6 +268,7 @@ class Note(db.Model):
         node_id (int): The node ID the note is associated with.
         text_start (int): The start index for text highlighting.
         text_end (int): The end index for text highlighting.
+        detached (int): Set to 1 when an edit replaced all of the highlighted text (see textedits.py).
     """
     __tablename__ = 'notes'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -137,6 +283,7 @@ class Note(db.Model):
     # Indexes for text highlighting
     text_start = db.Column(db.Integer, nullable=True)
     text_end = db.Column(db.Integer, nullable=True)
+    detached = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     page = db.relationship('Page')
     node = db.relationship('Node', foreign_keys=[node_id])
@@ -144,6 +291,27 @@ class Note(db.Model):
     def __repr__(self) -> str:
         return f"<Note {self.id}>"
 
+class Mention(db.Model):
+    """
+    Represents an entity's name appearing in the text of a page.  Maintained by mentions.py.
+
+    Attributes:
+        id (int): The primary key of the mention.
+        node_id (int): The node of the person, location or event mentioned.
+        page_id (int): The page the mention is on.
+        start (int): The offset of the first character of the mention.
+        end (int): The offset just after the last character of the mention.
+    """
+    __tablename__ = 'mentions'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    node_id = db.Column(db.Integer, db.ForeignKey('nodes.id'), nullable=False, index=True)
+    page_id = db.Column(db.Integer, db.ForeignKey('pages.id'), nullable=False, index=True)
+    start = db.Column(db.Integer, nullable=False)
+    end = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<Mention {self.node_id} on {self.page_id}>"
+
 class Person(db.Model):
     """
     Represents a person in the application.
@@ -225,11 +393,69 @@ class Event(db.Model):
     node_id = db.Column(db.Integer, db.ForeignKey('nodes.id'), nullable=True)
 
     node = db.relationship('Node', foreign_keys=[node_id])
+
+    # The timeline walks dated, live events in (date, id) order.  The WHERE clause must match
+    # the one in entities.get_timeline for SQLite to use this partial index.
+    __table_args__ = (
+        db.Index(
+            'ix_events_timeline', 'date', 'id',
+            sqlite_where=db.text('date IS NOT NULL AND deleted IS NOT 1')
+        ),
+    )
     
     def __repr__(self) -> str:
         return f"<Event {self.id}>"
     
 
+class Job(db.Model):
+    """
+    Represents a background job in the application.
+
+    Attributes:
+        id (int): The primary key of the job.
+        created (datetime): The creation date of the job.
+        updated (datetime): When the job last reported progress, used to spot jobs left behind by a dead worker.
+        name (str): The registered name of the job function.
+        status (str): One of queued, running, done or failed.
+        progress (float): The fraction of the job completed, from 0 to 1.
+        params (str): The JSON encoded keyword arguments for the job.
+        checkpoint (str): JSON encoded state saved by the job so it can resume after a restart.
+        result (str): The JSON encoded result of the job.
+        error (str): The error message if the job failed.
+    """
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    created = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    updated = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
+    name = db.Column(db.String, nullable=False)
+    status = db.Column(db.String, nullable=False, default='queued', index=True)
+    progress = db.Column(db.Float, nullable=False, default=0)
+    params = db.Column(db.Text, nullable=False, default='{}')
+    checkpoint = db.Column(db.Text, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+
+    def __repr__(self) -> str:
+        return f"<Job {self.id} {self.name}>"
+
+
+class Revision(db.Model):
+    """
+    A named counter which is incremented, in the same transaction, whenever the data it covers
+    changes.  Caches key themselves on these so every process agrees on when they are stale.
+
+    Attributes:
+        name (str): The primary key of the revision, e.g. "graph".
+        value (int): The number of committed changes so far.
+    """
+    __tablename__ = 'revisions'
+    name = db.Column(db.String, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"<Revision {self.name}={self.value}>"
+
+
 class Serialiser:
     """
     A class to serialise database models to dictionaries.
@@ -237,7 +463,9 @@ class Serialiser:
     @staticmethod
     def to_dict(model, object) -> dict:
         """Convert the model instance to a dictionary."""
-        return {column.name: getattr(object, column.name) for column in model.__table__.columns}
+        data = {column.name: getattr(object, column.name) for column in model.__table__.columns}
+        data.update({name: getattr(object, name) for name in getattr(model, 'serialised_properties', ())})
+        return data
 
     @staticmethod
     def to_json(model, object) -> str:
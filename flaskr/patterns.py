@@ -0,0 +1,420 @@
+"""
+Graph pattern queries: a path of nodes and links, written much like Cypher, answered by one SQL
+statement rather than a walk over /graph/node/linked.
+
+    (p:person)-[visited]->(l:location)-[]->(e:event {id: 5})
+
+A node is `(variable:type {property: value, ...})`, every part optional.  `id` matches the node
+id, other properties match columns of the type's table, e.g. `(p:person {name: "Henry"})`.
+Values are numbers, "strings", true, false or null.  Naming a variable twice means the same node.
+
+A link is `-[label]->`, `<-[label]-` or `-[label]-`, optionally named as `[r:label]`, and `-->`,
+`<--` and `--` are links with any label.  Each stored relationship reads as its rel from start
+to end and as its ler from end to start, so `(p)-[visited]->(l)` also matches a link stored from
+l to p with ler "visited".  Labels which aren't plain words are quoted: `["sister of"]`.  A link
+without a label matches whichever way round it is stored.  Several paths can be given, separated
+by commas, as long as each shares a variable with those before it.
+
+Every node, link and entity in a match is live (not deleted, nor merged away) unless the query
+includes deleted rows.  Labels are resolved to relationship type ids first, so each link is
+found through the indexes on relationships.start, end or type_id, and the query stops reading
+as soon as it has one row more than the limit.  A statement which runs for longer than the
+timeout is interrupted.
+"""
+import re
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from sqlalchemy import and_, false, or_, select, DateTime
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import aliased
+
+from .models import db, Node, Relationship, Person, Location, Event, Tag, Note
+from .reltypes import relationship_types
+
+# The table behind each node type, and its column holding the node id
+ENTITY_MODELS = {'person': Person, 'location': Location, 'event': Event, 'tag': Tag, 'note': Note}
+MAX_EDGES = 8
+
+
+class InvalidPattern(ValueError):
+    pass
+
+class QueryTimeout(RuntimeError):
+    pass
+
+
+@dataclass
+class NodePattern:
+    var: str | None
+    type: str | None = None
+    props: dict = field(default_factory=dict)
+
+@dataclass
+class EdgePattern:
+    var: str | None
+    label: str | None
+    left: int
+    right: int
+    # 'out' is left to right, 'in' right to left, 'both' either
+    direction: str = 'out'
+
+@dataclass
+class Pattern:
+    nodes: list[NodePattern]
+    edges: list[EdgePattern]
+
+    @property
+    def variables(self) -> list[str]:
+        """The named nodes and links, in the order they are first written"""
+        return [item.var for item in self._in_order() if item.var is not None]
+
+    def _in_order(self):
+        seen = set()
+        for edge in self.edges:
+            for item in (self.nodes[edge.left], edge, self.nodes[edge.right]):
+                if id(item) not in seen:
+                    seen.add(id(item))
+                    yield item
+        if not self.edges:
+            yield from self.nodes
+
+
+_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<number>-?\d+(?:\.\d+)?)
+      | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<punct><-|->|[-()\[\]{}:,])
+    )''', re.VERBOSE)
+
+def _tokenise(text: str) -> list[tuple[str, object]]:
+    tokens, position = [], 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise InvalidPattern(f"Unexpected {text[position:].strip()[:10]!r} at character {position}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'number':
+            value = float(value) if '.' in value else int(value)
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.tokens = _tokenise(text)
+        self.position = 0
+        self.nodes = []
+        self.edges = []
+        self.variables = {}
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, *values):
+        kind, value = self.peek()
+        if values and (kind != 'punct' or value not in values):
+            found = repr(value) if kind is not None else "the end of the pattern"
+            raise InvalidPattern(f"Expected {' or '.join(values)} but found {found}")
+        self.position += 1
+        return kind, value
+
+    def accept(self, value) -> bool:
+        if self.peek() == ('punct', value):
+            self.position += 1
+            return True
+        return False
+
+    def name(self, what: str) -> str:
+        kind, value = self.peek()
+        if kind not in ('word', 'string'):
+            raise InvalidPattern(f"Expected {what} but found {value!r}")
+        self.position += 1
+        return value
+
+    def parse(self) -> Pattern:
+        if not self.tokens:
+            raise InvalidPattern("The pattern is empty")
+        components = []
+        while True:
+            components.append(self.path())
+            if not self.accept(','):
+                break
+        if self.peek()[0] is not None:
+            raise InvalidPattern(f"Unexpected {self.peek()[1]!r} after the pattern")
+        # Paths must share a node, or the result would be every combination of their matches
+        joined = set(components[0])
+        for path in components[1:]:
+            if not joined & path:
+                raise InvalidPattern("Each path must share a variable with the paths before it")
+            joined |= path
+        if len(self.edges) > MAX_EDGES:
+            raise InvalidPattern(f"Patterns may have at most {MAX_EDGES} links")
+        return Pattern(self.nodes, self.edges)
+
+    def path(self) -> set[int]:
+        left = self.node()
+        path = {left}
+        while self.peek() in (('punct', '-'), ('punct', '<-')):
+            edge = self.edge(left)
+            edge.right = self.node()
+            self.edges.append(edge)
+            left = edge.right
+            path.add(left)
+        return path
+
+    def _declare(self, var: str, kind: str):
+        if self.variables.setdefault(var, kind) != kind:
+            raise InvalidPattern(f"{var} names both a node and a link")
+
+    def node(self) -> int:
+        self.take('(')
+        var = node_type = None
+        if self.peek()[0] == 'word':
+            var = self.name("a variable")
+        if self.accept(':'):
+            node_type = self.name("a node type").lower()
+            if node_type not in ENTITY_MODELS:
+                raise InvalidPattern(f"Unknown node type {node_type}")
+        props = self.props() if self.peek() == ('punct', '{') else {}
+        self.take(')')
+        if 'id' in props and not isinstance(props['id'], int):
+            raise InvalidPattern("A node id must be a whole number")
+
+        if var is None:
+            self.nodes.append(NodePattern(None, node_type, props))
+            return len(self.nodes) - 1
+        self._declare(var, 'node')
+        for i, existing in enumerate(self.nodes):
+            if existing.var == var:
+                if node_type and existing.type and node_type != existing.type:
+                    raise InvalidPattern(f"{var} can't be both a {existing.type} and a {node_type}")
+                existing.type = existing.type or node_type
+                for key, value in props.items():
+                    if existing.props.setdefault(key, value) != value:
+                        raise InvalidPattern(f"{var} can't have two values for {key}")
+                return i
+        self.nodes.append(NodePattern(var, node_type, props))
+        return len(self.nodes) - 1
+
+    def props(self) -> dict:
+        self.take('{')
+        props = {}
+        while not self.accept('}'):
+            key = self.name("a property name")
+            self.take(':')
+            kind, value = self.take()
+            if kind == 'word':
+                if value not in ('true', 'false', 'null'):
+                    raise InvalidPattern(f"{value} isn't a value, quote strings e.g. \"{value}\"")
+                value = {'true': True, 'false': False, 'null': None}[value]
+            elif kind == 'punct':
+                raise InvalidPattern(f"Expected a value for {key}")
+            props[key] = value
+            if not self.accept(','):
+                self.take('}')
+                break
+        return props
+
+    def edge(self, left: int) -> EdgePattern:
+        incoming = self.take('-', '<-')[1] == '<-'
+        var = label = None
+        if self.accept('['):
+            if not self.accept(']'):
+                first = self.name("a link label")
+                if self.accept(':'):
+                    var = first
+                    if self.peek() != ('punct', ']'):
+                        label = self.name("a link label")
+                else:
+                    label = first
+                self.take(']')
+        outgoing = self.take('-', '->')[1] == '->'
+        if incoming and outgoing:
+            raise InvalidPattern("A link can't point both ways")
+        if var is not None:
+            self._declare(var, 'link')
+            if any(edge.var == var for edge in self.edges):
+                raise InvalidPattern(f"The link {var} is named twice")
+        direction = 'in' if incoming else 'out' if outgoing else 'both'
+        return EdgePattern(var, label, left, None, direction)
+
+def parse_pattern(text: str) -> Pattern:
+    """
+    Raises:
+        InvalidPattern: if the pattern can't be parsed, or asks for something we can't match
+    """
+    if not isinstance(text, str):
+        raise InvalidPattern("The pattern must be a string")
+    return _Parser(text).parse()
+
+
+#######################
+#  SQL
+#######################
+
+def _type_ids(label: str) -> tuple[list[int], list[int]]:
+    """The types read as `label` from start to end, and those read as it from end to start"""
+    types = relationship_types.state()
+    return (
+        [type_id for (rel, ler), type_id in types.items() if rel == label],
+        [type_id for (rel, ler), type_id in types.items() if ler == label]
+    )
+
+def _property(model, entity, key: str, value):
+    """The condition for a property other than id, on the entity table of a typed node"""
+    if model is None:
+        raise InvalidPattern(f"Can't match on {key} without a node type, e.g. (p:person {{{key}: ...}})")
+    if key not in model.__table__.columns or key in ('node_id', 'deleted'):
+        raise InvalidPattern(f"Can't match on {key} of a {model.__tablename__} row")
+    column = getattr(entity, key)
+    if value is None:
+        return column.is_(None)
+    if isinstance(model.__table__.columns[key].type, DateTime):
+        try:
+            value = datetime.fromisoformat(str(value))
+        except ValueError:
+            raise InvalidPattern(f"{key} must be a date, e.g. 1920-05-01")
+    return column == value
+
+def compile_pattern(pattern: Pattern, include_deleted: bool = False):
+    """
+    One SELECT over an alias of nodes (and the entity table, for typed nodes) per node and an
+    alias of relationships per link.  Returns the statement and the columns it selects, as
+    (variable, kind, position) for the named nodes, entities and links.  Each link is followed
+    by the id of the node on its left, which tells which way round it was matched.
+    """
+    nodes, entities, columns, criteria = [], [], [], []
+    for i, node in enumerate(pattern.nodes):
+        alias = aliased(Node, name=f'n{i}')
+        model = ENTITY_MODELS.get(node.type)
+        entity = aliased(model, name=f'e{i}') if model is not None else None
+        nodes.append(alias)
+        entities.append(entity)
+        if node.type is not None:
+            criteria.append(alias.node_type == node.type)
+        if 'id' in node.props:
+            criteria.append(alias.id == node.props['id'])
+        if entity is not None:
+            criteria.append((entity.id if model is Tag else entity.node_id) == alias.id)
+        criteria += [_property(model, entity, key, value) for key, value in node.props.items() if key != 'id']
+        if not include_deleted:
+            criteria += [alias.deleted.is_not(1), alias.merged.is_(None)]
+            if entity is not None:
+                criteria.append(entity.deleted.is_not(1))
+
+    # From a node given by id, walking the start and end indexes reads only its own links, where
+    # the type_id index would read every link with the label.  Without statistics SQLite can't
+    # tell them apart, so `type_id + 0` keeps the label out of the choice of index
+    pinned = any('id' in node.props for node in pattern.nodes)
+    links = []
+    for i, edge in enumerate(pattern.edges):
+        link = aliased(Relationship, name=f'r{i}')
+        links.append(link)
+        left, right = nodes[edge.left].id, nodes[edge.right].id
+        forward = and_(link.start == left, link.end == right)
+        backward = and_(link.start == right, link.end == left)
+        if edge.label is not None:
+            reads_as, reads_back_as = _type_ids(edge.label)
+            if edge.direction == 'in':
+                reads_as, reads_back_as = reads_back_as, reads_as
+            elif edge.direction == 'both':
+                reads_as = reads_back_as = reads_as + reads_back_as
+            # A label no type has can't match, and an empty IN () would be scanned for nothing
+            type_id = link.type_id + 0 if pinned else link.type_id
+            forward = and_(forward, type_id.in_(reads_as)) if reads_as else false()
+            backward = and_(backward, type_id.in_(reads_back_as)) if reads_back_as else false()
+        criteria.append(or_(forward, backward))
+        if not include_deleted:
+            criteria.append(link.deleted.is_not(1))
+        # As in a path, no relationship is followed twice
+        criteria += [link.id != other.id for other in links[:-1]]
+
+    selected = []
+    for item in pattern._in_order():
+        if item.var is None:
+            continue
+        if isinstance(item, NodePattern):
+            i = pattern.nodes.index(item)
+            columns.append((item.var, 'node', len(selected)))
+            selected.append(nodes[i])
+            if entities[i] is not None:
+                columns.append((item.var, 'entity', len(selected)))
+                selected.append(entities[i])
+        else:
+            i = pattern.edges.index(item)
+            columns.append((item.var, 'link', len(selected)))
+            selected += [links[i], nodes[item.left].id]
+    if not selected:
+        # Nothing is named, so the match itself is the answer: return its first node
+        selected.append(nodes[0])
+        columns.append((None, 'node', 0))
+
+    # Every alias is named in the WHERE clause, so SQLite is free to choose the join order
+    froms = nodes + [entity for entity in entities if entity is not None] + links
+    return select(*selected).select_from(*froms).where(*criteria), columns
+
+
+@contextmanager
+def time_limit(seconds: float | None):
+    """
+    Interrupt SQLite statements run by the session which take longer than `seconds`.
+    Raises:
+        QueryTimeout: if a statement was interrupted
+    """
+    if not seconds:
+        yield
+        return
+    connection = db.session.connection().connection.driver_connection
+    deadline = time.monotonic() + seconds
+    # Called every 10000 virtual machine instructions.  Anything truthy aborts the statement
+    connection.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+    try:
+        yield
+    except OperationalError as e:
+        if 'interrupted' in str(e):
+            raise QueryTimeout(f"The query took longer than {seconds}s") from e
+        raise
+    finally:
+        connection.set_progress_handler(None, 0)
+
+
+def run_pattern(pattern: Pattern, limit: int, include_deleted: bool = False, timeout: float = None):
+    """
+    The first `limit` matches of a pattern, each {variable: value} with a (node, entity or None)
+    pair for each named node and a Relationship or ReverseRelationship, read in the direction it
+    is written, for each named link.  Also returns whether there were more matches.
+    """
+    query, columns = compile_pattern(pattern, include_deleted)
+    with time_limit(timeout):
+        rows = db.session.execute(query.limit(limit + 1)).all()
+    truncated = len(rows) > limit
+
+    matches = []
+    for row in rows[:limit]:
+        match = {}
+        for var, kind, position in columns:
+            if kind == 'node':
+                match[var] = (row[position], None)
+            elif kind == 'entity':
+                match[var] = (match[var][0], row[position])
+            else:
+                link, left = row[position], row[position + 1]
+                match[var] = link if link.start == left else link.reverse
+        matches.append(match)
+    return matches, truncated
+
+
+def explain(pattern: Pattern, include_deleted: bool = False) -> list[str]:
+    """SQLite's plan for a pattern's query, e.g. to check which indexes it uses"""
+    query, _ = compile_pattern(pattern, include_deleted)
+    compiled = query.compile(db.session.get_bind(), compile_kwargs={'literal_binds': True})
+    return [row[-1] for row in db.session.execute(db.text(f'EXPLAIN QUERY PLAN {compiled}'))]
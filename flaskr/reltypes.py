@@ -0,0 +1,73 @@
+"""
+The dictionary of relationship types.  Each (rel, ler) pair, e.g. ("visited", "was visited by"),
+is stored once in `relationship_types` and relationships refer to it by id.
+
+Types are never changed or removed once created, so the (rel, ler) -> id dictionary is cached
+in process.  A type created by a transaction only joins the cache once that transaction has
+committed, since a rolled back id can be handed out again to a different pair.
+"""
+from sqlalchemy import select, func, event
+from sqlalchemy.dialects.sqlite import insert
+from flask_sqlalchemy.session import Session
+
+from .models import db, RelationshipType, Relationship
+from .indexes import LazyIndex
+
+_PENDING = 'pending_relationship_types'
+
+
+class RelationshipTypes(LazyIndex):
+    name = 'relationship_types'
+
+    def build(self, previous=None):
+        rows = db.session.execute(select(RelationshipType.rel, RelationshipType.ler, RelationshipType.id)).all()
+        return {(rel, ler): id for rel, ler, id in rows}
+
+    def resolve(self, rel: str, ler: str) -> RelationshipType:
+        """The type for a (rel, ler) pair, created in the current transaction if it is new"""
+        key = (rel, ler)
+        session = db.session
+        pending = session.info.setdefault(_PENDING, {})
+        type_id = self.state().get(key) or pending.get(key)
+        if type_id is None:
+            with session.no_autoflush:
+                session.execute(insert(RelationshipType).values(rel=rel, ler=ler).on_conflict_do_nothing())
+                type_id = session.scalar(
+                    select(RelationshipType.id).where(RelationshipType.rel == rel, RelationshipType.ler == ler)
+                )
+            pending[key] = type_id
+        return session.get(RelationshipType, type_id)
+
+    def _commit(self, pending: dict):
+        with self._lock:
+            entry = self._states.get(self._key())
+            if entry is not None:
+                entry[1].update(pending)
+
+relationship_types = RelationshipTypes()
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_new_types(session):
+    pending = session.info.pop(_PENDING, None)
+    if pending:
+        relationship_types._commit(pending)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_new_types(session):
+    session.info.pop(_PENDING, None)
+
+
+def type_usage(include_deleted: bool = False) -> list[dict]:
+    """Every relationship type with the number of relationships using it"""
+    count = func.count(Relationship.id)
+    join = Relationship.type_id == RelationshipType.id
+    if not include_deleted:
+        join &= Relationship.deleted.is_not(1)
+    rows = db.session.execute(
+        select(RelationshipType, count)
+        .outerjoin(Relationship, join)
+        .group_by(RelationshipType.id)
+        .order_by(count.desc(), RelationshipType.rel)
+    ).all()
+    return [{'id': t.id, 'rel': t.rel, 'ler': t.ler, 'count': n} for t, n in rows]
@@ -0,0 +1,90 @@
+"""
+Revision counters for cached views of the database.
+
+Whenever a flush changes a row, the counters covering that row are incremented inside the same
+transaction, so a counter only moves when the change is committed and every process sees the
+same value.  A cache built at revision N is valid for as long as the counter still reads N.
+
+    graph   - any node, relationship or entity (person, location, event, tag)
+    entities - people, locations, events and tags
+    tags    - the tags table
+    notes   - the notes table
+    pages   - the text of any page
+    page:<n>  - the text of page n
+    (the page counters are bumped by pages.py, as pages aren't watched by changes.py)
+    notes:<n> - the notes on page n
+"""
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+
+from .models import db, Revision
+from .workspaces import current_workspace
+
+GRAPH = 'graph'
+GRAPH_TABLES = ('nodes', 'relationships', 'people', 'locations', 'events', 'tags')
+ENTITIES = 'entities'
+ENTITY_TABLES = ('people', 'locations', 'events', 'tags')
+TAGS = 'tags'
+NOTES = 'notes'
+PAGES = 'pages'
+
+
+# Pages are shared by every workspace (see workspaces.py), so their counters are kept in the main database
+SHARED_PREFIX = 'page:'
+
+def page_revision(page_number) -> str:
+    return f'{SHARED_PREFIX}{page_number}'
+
+def page_notes_revision(page_number) -> str:
+    return f'notes:{page_number}'
+
+
+def revision_names(change) -> set[str]:
+    """The counters which a change (see changes.py) invalidates"""
+    names = set()
+    if change.table in GRAPH_TABLES:
+        names.add(GRAPH)
+    if change.table in ENTITY_TABLES:
+        names.add(ENTITIES)
+    if change.table == 'tags':
+        names.add(TAGS)
+    if change.table == 'notes':
+        names.add(NOTES)
+        if change.page_number is not None:
+            names.add(page_notes_revision(change.page_number))
+    return names
+
+def bump(connection, names) -> dict[str, int]:
+    """Increment each counter by one, creating it if needed.  Returns the new values."""
+    if not names:
+        return {}
+    table = Revision.__table__
+    stmt = insert(table).values([{'name': name, 'value': 1} for name in sorted(names)])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.name],
+        set_={'value': table.c.value + 1}
+    ).returning(table.c.name, table.c.value)
+    return dict(connection.execute(stmt).all())
+
+def _read(names, bind=None) -> dict[str, int]:
+    if not names:
+        return {}
+    rows = db.session.execute(
+        select(Revision.name, Revision.value).where(Revision.name.in_(names)),
+        bind_arguments={'bind': bind} if bind is not None else None
+    ).all()
+    return dict(rows)
+
+def current(*names) -> dict[str, int]:
+    """Read the committed value of each counter.  Counters never bumped read as 0."""
+    values = dict.fromkeys(names, 0)
+    local = names
+    if current_workspace() is not None:
+        shared = [name for name in names if name == PAGES or name.startswith(SHARED_PREFIX)]
+        local = [name for name in names if name not in shared]
+        values.update(_read(shared, db.engines[None]))
+    values.update(_read(local))
+    return values
+
+def current_revision(name: str) -> int:
+    return current(name)[name]
@@ -0,0 +1,15 @@
+"""
+The session class for `db`, which sends queries to the current request's workspace database
+when there is one (see workspaces.py).  Kept apart from workspaces.py so models.py can use it.
+"""
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            engine = g.get('workspace_engine')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
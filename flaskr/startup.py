@@ -0,0 +1,124 @@
+"""
+Timing of the app factory and the explicit setup commands which used to run on every boot.
+
+Creating the schema and loading the page text are no longer done by `create_app`.  Run them once
+with `flask init-db` (or from the gunicorn master, see gunicorn.conf.py) and every worker or CLI
+invocation after that only pays for building the Flask app itself.
+"""
+import time
+from contextlib import contextmanager
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .models import db
+
+STARTUP_TIMINGS = 'startup_timings'
+
+
+@contextmanager
+def timed_phase(app, name: str):
+    """Record how long the wrapped block takes, in milliseconds, against the app."""
+    timings = app.extensions.setdefault(STARTUP_TIMINGS, {})
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = (time.perf_counter() - start) * 1000
+
+def startup_report(app) -> dict:
+    """Return the recorded phase timings and their total, in milliseconds."""
+    timings = dict(app.extensions.get(STARTUP_TIMINGS, {}))
+    return {
+        'phases': {name: round(ms, 2) for name, ms in timings.items()},
+        'total': round(sum(timings.values()), 2)
+    }
+
+def log_startup_report(app):
+    report = startup_report(app)
+    phases = ", ".join(f"{name} {ms}ms" for name, ms in report['phases'].items())
+    app.logger.info(f"App started in {report['total']}ms ({phases})")
+
+
+def prepare_database(app, pages=True):
+    """Create any missing tables and load the page text.  Safe to run repeatedly."""
+    from .blueprints.pages import populate_pages
+    with app.app_context():
+        with timed_phase(app, 'create_schema'):
+            db.create_all()
+        if pages:
+            with timed_phase(app, 'populate_pages'):
+                populate_pages()
+
+
+#######################
+#  CLI
+#######################
+
+@click.command('init-db')
+@with_appcontext
+@click.option('--no-pages', is_flag=True, help="Only create the schema, don't load the page text.")
+def init_db_command(no_pages):
+    """Create the database schema and load the page text."""
+    app = current_app._get_current_object()
+    prepare_database(app, pages=not no_pages)
+    report = startup_report(app)
+    for name in ('create_schema', 'populate_pages'):
+        if name in report['phases']:
+            click.echo(f"{name}: {report['phases'][name]}ms")
+
+@click.command('populate-pages')
+@with_appcontext
+def populate_pages_command():
+    """(Re)load the page text from data/processed."""
+    from .blueprints.pages import populate_pages
+    start = time.perf_counter()
+    populate_pages()
+    click.echo(f"populate_pages: {(time.perf_counter() - start) * 1000:.2f}ms")
+
+@click.command('index-mentions')
+@with_appcontext
+def index_mentions_command():
+    """Find every entity name on every page again, e.g. after loading entities in bulk."""
+    from .mentions import index_all_mentions
+    start = time.perf_counter()
+    count = index_all_mentions()
+    db.session.commit()
+    click.echo(f"index_mentions: {count} mentions in {(time.perf_counter() - start) * 1000:.2f}ms")
+
+@click.command('import-workbook')
+@with_appcontext
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help="Report what would be imported without writing anything.")
+@click.option('--batch-size', default=2000, show_default=True, help="Rows inserted per transaction.")
+def import_workbook_command(path, dry_run, batch_size):
+    """Import people, locations, events, notes and links from a workbook, e.g. notes.xlsx."""
+    from .workbook import import_workbook
+    start = time.perf_counter()
+    report = import_workbook(path, dry_run=dry_run, batch_size=batch_size)
+    verb = "would create" if dry_run else "created"
+    for sheet, counts in report.items():
+        click.echo(
+            f"{sheet}: {counts['rows']} rows, {verb} {counts['created']}, "
+            f"{counts['existing']} already there, {counts['skipped']} skipped"
+        )
+        for issue in counts['issues']:
+            click.echo(f"  row {issue['row']}: {issue['reason']}")
+    click.echo(f"import_workbook: {(time.perf_counter() - start) * 1000:.2f}ms")
+
+@click.command('startup-report')
+@with_appcontext
+def startup_report_command():
+    """Show how long each phase of building the app took."""
+    report = startup_report(current_app)
+    for name, ms in report['phases'].items():
+        click.echo(f"{name}: {ms}ms")
+    click.echo(f"total: {report['total']}ms")
+
+def register_commands(app):
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(populate_pages_command)
+    app.cli.add_command(index_mentions_command)
+    app.cli.add_command(import_workbook_command)
+    app.cli.add_command(startup_report_command)
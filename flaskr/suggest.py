@@ -0,0 +1,267 @@
+"""
+In-memory autocomplete over entity names.
+
+Names are kept in a sorted list keyed on their normalised form, so a prefix lookup is a binary
+search followed by a short scan, with no database work beyond the revision check.  The lists
+are updated in place as changes are committed (see LazyIndex.apply).
+"""
+import heapq
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from sqlalchemy import select
+
+from .models import db, Tag, Node, Relationship, Person, Location, Event
+from .indexes import LazyIndex
+from .changes import DELETED
+from .revisions import TAGS, GRAPH
+
+
+class SortedNames:
+    """A sorted list of (key, id, name) entries which can be searched by key prefix"""
+    def __init__(self, entries=()):
+        self.entries = sorted(entries)
+        self._by_id = {entry[1]: entry for entry in self.entries}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, key: str, id: int, name: str):
+        self.remove(id)
+        entry = (key, id, name)
+        insort(self.entries, entry)
+        self._by_id[id] = entry
+
+    def remove(self, id: int):
+        entry = self._by_id.pop(id, None)
+        if entry is None:
+            return
+        i = bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            del self.entries[i]
+
+    def with_prefix(self, prefix: str, limit: int) -> list[tuple[str, int, str]]:
+        i = bisect_left(self.entries, (prefix,))
+        results = []
+        while i < len(self.entries) and len(results) < limit:
+            entry = self.entries[i]
+            if not entry[0].startswith(prefix):
+                break
+            results.append(entry)
+            i += 1
+        return results
+
+
+class TagSuggestIndex(LazyIndex):
+    name = 'tag_suggest'
+    revision = TAGS
+
+    def build(self, previous=None):
+        rows = db.session.execute(
+            select(Tag.name_key, Tag.id, Tag.name).where(Tag.deleted != 1)
+        ).all()
+        return SortedNames(tuple(row) for row in rows)
+
+    def apply(self, state, changes):
+        for change in changes:
+            if change.table != 'tags':
+                continue
+            state.remove(change.id)
+            if change.action != DELETED and not change.row.get('deleted'):
+                state.add(change.row['name_key'], change.id, change.row['name'])
+        return state
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[dict]:
+        matches = self.state().with_prefix(Tag.normalise(prefix), limit)
+        return [{'id': id, 'name': name} for _, id, name in matches]
+
+tag_suggestions = TagSuggestIndex()
+
+
+#######################
+#  ENTITY NAMES
+#######################
+
+ENTITY_TABLES = {
+    'people': 'person',
+    'locations': 'location',
+    'events': 'event',
+    'tags': 'tag'
+}
+
+EXACT, PREFIX, TOKEN = 'exact', 'prefix', 'token'
+_MATCH_RANK = {EXACT: 0, PREFIX: 1, TOKEN: 2}
+
+
+def normalise(name: str) -> str:
+    return " ".join(name.casefold().split())
+
+def tokens(key: str) -> list[str]:
+    return [t for t in re.split(r"[^\w']+", key) if t]
+
+
+class EntityNames:
+    """
+    Every live (not deleted, not merged away) person, location, event and tag, searchable by
+    whole-name prefix and by word prefix.  Entries are keyed on node id.
+    """
+    def __init__(self, entities=()):
+        # Sort everything once up front rather than inserting names one at a time
+        self.entities = {}  # node_id -> (node_type, entity_id, name)
+        names, name_tokens = [], []
+        for node_id, node_type, entity_id, name in entities:
+            key = normalise(name)
+            self.entities[node_id] = (node_type, entity_id, name)
+            names.append((key, node_id, name))
+            name_tokens.extend((token, node_id) for token in set(tokens(key)))
+        self.names = SortedNames(names)
+        self.tokens = sorted(name_tokens)  # (token, node_id) pairs
+        self.degree = defaultdict(int)
+        self.dead_nodes = set()
+        self.live_relationships = {}  # id -> (start, end)
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    def add(self, node_id: int, node_type: str, entity_id: int, name: str):
+        self.remove(node_id)
+        key = normalise(name)
+        self.entities[node_id] = (node_type, entity_id, name)
+        self.names.add(key, node_id, name)
+        for token in set(tokens(key)):
+            insort(self.tokens, (token, node_id))
+
+    def remove(self, node_id: int):
+        if self.entities.pop(node_id, None) is None:
+            return
+        key = self.names._by_id[node_id][0]
+        self.names.remove(node_id)
+        for token in set(tokens(key)):
+            i = bisect_left(self.tokens, (token, node_id))
+            if i < len(self.tokens) and self.tokens[i] == (token, node_id):
+                del self.tokens[i]
+
+    def link(self, rel_id: int, start: int, end: int, live: bool):
+        """Keep degrees in step with a relationship being created or deleted"""
+        if live and rel_id not in self.live_relationships:
+            self.live_relationships[rel_id] = (start, end)
+            self.degree[start] += 1
+            self.degree[end] += 1
+        elif not live and rel_id in self.live_relationships:
+            start, end = self.live_relationships.pop(rel_id)
+            self.degree[start] -= 1
+            self.degree[end] -= 1
+
+    def _token_matches(self, query_tokens: list[str]) -> set[int]:
+        # Start from the longest (usually rarest) query token, then check the others
+        longest = max(query_tokens, key=len)
+        i = bisect_left(self.tokens, (longest,))
+        candidates = set()
+        while i < len(self.tokens) and self.tokens[i][0].startswith(longest):
+            candidates.add(self.tokens[i][1])
+            i += 1
+        others = [t for t in query_tokens if t != longest]
+        if not others:
+            return candidates
+        matches = set()
+        for node_id in candidates:
+            name_tokens = tokens(self.names._by_id[node_id][0])
+            if all(any(nt.startswith(t) for nt in name_tokens) for t in others):
+                matches.add(node_id)
+        return matches
+
+    def _rank(self, node_ids, match_of, types, limit):
+        if types:
+            node_ids = (n for n in node_ids if self.entities[n][0] in types)
+        return heapq.nsmallest(
+            limit, node_ids,
+            key=lambda n: (_MATCH_RANK[match_of(n)], -self.degree[n], self.entities[n][2], n)
+        )
+
+    def search(self, query: str, types=None, limit: int = 10) -> list[dict]:
+        key = normalise(query)
+        if not key:
+            return []
+        prefixed = {node_id: name_key for name_key, node_id, _ in self.names.with_prefix(key, len(self.names))}
+        match = {}
+        ranked = self._rank(prefixed, lambda n: EXACT if prefixed[n] == key else PREFIX, types, limit)
+        for node_id in ranked:
+            match[node_id] = EXACT if prefixed[node_id] == key else PREFIX
+
+        # Word matches always rank below whole-name matches, so only look if there's room left
+        query_tokens = tokens(key)
+        if len(ranked) < limit and query_tokens:
+            word_matches = self._token_matches(query_tokens) - prefixed.keys()
+            for node_id in self._rank(word_matches, lambda n: TOKEN, types, limit - len(ranked)):
+                match[node_id] = TOKEN
+                ranked.append(node_id)
+
+        return [
+            {
+                'node_id': node_id,
+                'id': self.entities[node_id][1],
+                'type': self.entities[node_id][0],
+                'name': self.entities[node_id][2],
+                'degree': self.degree[node_id],
+                'match': match[node_id]
+            }
+            for node_id in ranked
+        ]
+
+
+def _live_entities():
+    """(node_id, node_type, entity_id, name) for every live entity"""
+    for model in (Person, Location, Event, Tag):
+        node_id = Tag.id if model is Tag else model.node_id
+        rows = db.session.execute(
+            select(node_id, model.id, model.name)
+            .join(Node, Node.id == node_id)
+            .where(model.deleted != 1, Node.deleted != 1, Node.merged.is_(None))
+        ).all()
+        node_type = ENTITY_TABLES[model.__tablename__]
+        for row in rows:
+            yield row[0], node_type, row[1], row[2]
+
+
+class EntitySuggestIndex(LazyIndex):
+    name = 'entity_suggest'
+    revision = GRAPH
+
+    def build(self, previous=None):
+        state = EntityNames(_live_entities())
+        rels = db.session.execute(
+            select(Relationship.id, Relationship.start, Relationship.end).where(Relationship.deleted != 1)
+        ).all()
+        for rel_id, start, end in rels:
+            state.link(rel_id, start, end, True)
+        return state
+
+    def apply(self, state, changes):
+        for change in changes:
+            row = change.row
+            live = change.action != DELETED and not row.get('deleted')
+            if change.table == 'relationships':
+                state.link(change.id, row['start'], row['end'], live)
+            elif change.table == 'nodes':
+                if live and row.get('merged') is None:
+                    if change.id in state.dead_nodes:
+                        # Brought back to life: we don't have its entity to hand
+                        return None
+                else:
+                    state.dead_nodes.add(change.id)
+                    state.remove(change.id)
+            elif change.table in ENTITY_TABLES:
+                node_id = change.id if change.table == 'tags' else row.get('node_id')
+                if node_id is None:
+                    continue
+                if live and node_id not in state.dead_nodes:
+                    state.add(node_id, ENTITY_TABLES[change.table], change.id, row['name'])
+                else:
+                    state.remove(node_id)
+        return state
+
+    def suggest(self, query: str, types=None, limit: int = 10) -> list[dict]:
+        return self.state().search(query, types, limit)
+
+entity_suggestions = EntitySuggestIndex()
@@ -6,7 +6,9 @@ from flaskr.blueprints.entities import (
     create_entity, soft_delete_entity, hard_delete_entity,
     link_entities, get_linked_nodes, get_linked_entities, merge_into_new
 )
-from flaskr.models import db, Person, Location, Event, Tag, Node, Relationship
+from flaskr.models import db, Person, Location, Event, Tag, Node, Relationship, Page
+from flaskr.errors import RecordAlreadyExists
+from flaskr.suggest import tag_suggestions, entity_suggestions
 
 
 def test_create_person(session):
@@ -82,4 +84,171 @@ def test_merge_into_new(session):
     assert merged_person.content == "Merged content"
     assert merged_person.gender == "Other"
     assert person1.node.merged == merged_person.node_id
-    assert person2.node.merged == merged_person.node_id
\ No newline at end of file
+    assert person2.node.merged == merged_person.node_id
+
+def test_create_tag_duplicate_ignores_case(session):
+    create_entity('tag', name="Test Tag")
+    node_count = Node.query.count()
+    with pytest.raises(RecordAlreadyExists):
+        create_entity('tag', name="  test TAG")
+    # The node made for the rejected tag is cleaned up
+    assert Node.query.count() == node_count
+
+def test_api_suggest_tags(client, session):
+    for name in ["Murder", "Motive", "music hall", "Alibi"]:
+        create_entity('tag', name=name)
+    response = client.get('/tag/suggest?prefix=mu')
+    assert response.status_code == 200
+    assert [t['name'] for t in response.get_json()] == ["Murder", "music hall"]
+
+def test_suggest_tags_follows_deletes(client, session):
+    tag = create_entity('tag', name="Murder")
+    assert client.get('/tag/suggest?prefix=m').get_json() == [{'id': tag.id, 'name': "Murder"}]
+    tag.deleted = 1
+    session.commit()
+    assert client.get('/tag/suggest?prefix=m').get_json() == []
+    create_entity('tag', name="Motive")
+    assert [t['name'] for t in client.get('/tag/suggest?prefix=M').get_json()] == ["Motive"]
+
+def test_suggest_tags_updated_in_place(session):
+    create_entity('tag', name="Murder")
+    first = tag_suggestions.state()
+    create_entity('tag', name="Motive")
+    assert tag_suggestions.state() is first
+    assert len(first) == 2
+
+def test_api_suggest_entities_ranking(client, session):
+    henry = create_entity('person', name="Henry", content="")
+    henry_b = create_entity('person', name="Henry Bolton", content="")
+    old_henry = create_entity('person', name="Old Henry Hoyle", content="")
+    location = create_entity('location', name="Henry Street", content="", country=None, district=None, town=None)
+    # Give Henry Street more links so it ranks above Henry Bolton
+    link_entities(location, henry, "home of", "lives at")
+    link_entities(location, old_henry, "home of", "lives at")
+
+    response = client.get('/entities/suggest?q=henry')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [d['name'] for d in data] == ["Henry", "Henry Street", "Henry Bolton", "Old Henry Hoyle"]
+    assert [d['match'] for d in data] == ['exact', 'prefix', 'prefix', 'token']
+    assert data[1]['type'] == 'location'
+    assert data[1]['node_id'] == location.node_id
+
+def test_api_suggest_entities_types_and_tokens(client, session):
+    create_entity('person', name="Henry Bolton", content="")
+    create_entity('location', name="Bolton Abbey", content="", country=None, district=None, town=None)
+    data = client.get('/entities/suggest?q=bol hen').get_json()
+    assert [d['name'] for d in data] == ["Henry Bolton"]
+    data = client.get('/entities/suggest?q=bolton&types=location').get_json()
+    assert [d['name'] for d in data] == ["Bolton Abbey"]
+    assert client.get('/entities/suggest?q=bolton&types=dog').status_code == 400
+
+def test_suggest_entities_follows_deletes_and_merges(session):
+    henry = create_entity('person', name="Henry", content="")
+    harry = create_entity('person', name="Harry", content="")
+    index = entity_suggestions.state()
+    assert len(index) == 2
+
+    soft_delete_entity(henry)
+    merge_into_new([harry], 'person', name="Harold", content="", gender=None)
+    assert entity_suggestions.state() is index
+    assert [d['name'] for d in entity_suggestions.suggest("h")] == ["Harold"]
+
+def test_api_find_duplicates(client, session):
+    create_entity('person', name="Henry Bolton", content="A lawyer")
+    create_entity('person', name="Henry Boulton", content="A lawyer")
+    create_entity('person', name="Mary Smith", content="A cook")
+    data = client.get('/entities/duplicates?type=person').get_json()
+    assert len(data) == 1
+    assert [m['name'] for m in data[0]['members']] == ["Henry Bolton", "Henry Boulton"]
+    assert client.get('/entities/duplicates?type=dog').status_code == 400
+    assert client.get('/entities/duplicates?type=person&threshold=2').status_code == 400
+
+def test_find_duplicates_cached_until_entity_write(client, session):
+    henry = create_entity('person', name="Henry Bolton", content="")
+    create_entity('person', name="Henry Boulton", content="")
+    first = client.get('/entities/duplicates?type=person').get_json()
+    assert client.get('/entities/duplicates?type=person').get_json() == first
+
+    soft_delete_entity(henry)
+    assert client.get('/entities/duplicates?type=person').get_json() == []
+
+def test_find_duplicates_forgets_merged_and_deleted_nodes(client, session):
+    def members():
+        clusters = client.get('/entities/duplicates?type=person').get_json()
+        return [m['node_id'] for c in clusters for m in c['members']]
+
+    bolton = create_entity('person', name="Henry Bolton", content="")
+    boulton = create_entity('person', name="Henry Boulton", content="")
+    # A second pair, still a candidate after the first is merged
+    bolt = create_entity('person', name="Arthur Bolt", content="")
+    create_entity('person', name="Arthur Bolte", content="")
+    assert {bolton.node_id, boulton.node_id, bolt.node_id} <= set(members())
+
+    response = client.post('/graph/node/merge', json={'id': [bolton.node_id, boulton.node_id]})
+    assert response.status_code == 200
+    assert bolton.node_id not in members() and boulton.node_id not in members()
+    assert bolt.node_id in members()
+
+    response = client.post('/graph/node/delete', json={'ids': [bolt.node_id]})
+    assert response.status_code == 200
+    assert bolt.node_id not in members()
+
+def test_api_find_duplicates_async(client, session):
+    create_entity('location', name="Bolton Abbey", content="", country=None, district=None, town=None)
+    create_entity('location', name="Bolton Abbey.", content="", country=None, district=None, town=None)
+    response = client.get('/entities/duplicates?type=location&async=1')
+    assert response.status_code == 202
+    job = client.get(f"/jobs/{response.get_json()['id']}").get_json()
+    assert job['status'] == 'done'
+    assert len(job['result']) == 1
+
+def test_entity_mentions_follow_create_and_rename(client, session):
+    session.add_all([Page(id=1, page_number=1, content="Henry met Mary."), Page(id=2, page_number=2, content="Mary left.")])
+    session.commit()
+    mary = create_entity('person', name="Mary", content="")
+    data = client.get(f'/entities/{mary.node_id}/mentions').get_json()
+    assert [(d['page'], d['start'], d['text']) for d in data] == [(1, 10, "Mary"), (2, 0, "Mary")]
+
+    mary.name = "Henry"
+    session.commit()
+    data = client.get(f'/entities/{mary.node_id}/mentions').get_json()
+    assert [(d['page'], d['start'], d['text']) for d in data] == [(1, 0, "Henry")]
+    assert client.get('/entities/999/mentions').status_code == 404
+
+def _timeline_events():
+    dates = [datetime(1930, 5, 2), datetime(1930, 5, 1), datetime(1930, 6, 9), datetime(1931, 1, 1), None]
+    return [create_entity('event', name=f"Event {i}", content="", date=d) for i, d in enumerate(dates)]
+
+def test_api_timeline_pages_in_date_order(client, session):
+    events = _timeline_events()
+    merged = create_entity('event', name="Gone", content="", date=datetime(1930, 5, 3))
+    merge_into_new([merged], 'event', name="Merged", content="", date=None)
+
+    data = client.get('/event/timeline?limit=2').get_json()
+    assert [e['name'] for e in data['events']] == ["Event 1", "Event 0"]
+    data = client.get(f"/event/timeline?limit=2&cursor={data['next']}").get_json()
+    assert [e['name'] for e in data['events']] == ["Event 2", "Event 3"]
+    assert data['next'] is None
+
+    data = client.get('/event/timeline?from=1930-05-02&to=1930-06-09').get_json()
+    assert [e['name'] for e in data['events']] == ["Event 0", "Event 2"]
+    assert client.get('/event/timeline?from=May').status_code == 400
+    assert client.get('/event/timeline?bucket=week').status_code == 400
+
+def test_api_timeline_buckets(client, session):
+    _timeline_events()
+    data = client.get('/event/timeline?bucket=month').get_json()
+    assert data['buckets'] == [
+        {'bucket': '1930-05', 'count': 2}, {'bucket': '1930-06', 'count': 1}, {'bucket': '1931-01', 'count': 1}
+    ]
+    data = client.get('/event/timeline?bucket=year&to=1930-12-31').get_json()
+    assert data['buckets'] == [{'bucket': '1930', 'count': 3}]
+
+def test_api_timeline_linked_to_nodes(client, session):
+    events = _timeline_events()
+    person = create_entity('person', name="Henry", content="")
+    link_entities(person, events[2], "attended", "was attended by")
+    link_entities(events[0], person, "involved", "involved in")
+    data = client.get(f'/event/timeline?node={person.node_id}').get_json()
+    assert [e['name'] for e in data['events']] == ["Event 0", "Event 2"]
@@ -0,0 +1,100 @@
+import json
+
+from flaskr.broadcast import EventBroker, get_broker
+from flaskr.blueprints.events import stream_changes, _matches
+from flaskr.blueprints.notes import create_note
+from flaskr.models import Page
+
+
+def _frames(generator, count):
+    return [next(generator) for _ in range(count)]
+
+def _data(frame):
+    return json.loads(frame.split("data: ", 1)[1])
+
+
+def test_broker_since():
+    broker = EventBroker(maxlen=3)
+    for i in range(5):
+        broker.publish({'i': i})
+    missed, events = broker.since(3)
+    assert not missed
+    assert [m['i'] for _, m in events] == [3, 4]
+    missed, events = broker.since(0)
+    assert missed
+    assert [m['i'] for _, m in events] == [2, 3, 4]
+
+def test_broker_wait_times_out():
+    broker = EventBroker()
+    assert broker.wait(broker.seq, timeout=0.01) == (False, [])
+
+def test_matches():
+    message = {'table': 'notes', 'nodes': [5], 'page': 3}
+    assert _matches(message, set(), set())
+    assert _matches(message, {3}, set())
+    assert _matches(message, set(), {5, 6})
+    assert not _matches(message, {4}, {6})
+
+def test_stream_filters_by_page(app, session):
+    broker = get_broker(app)
+    start = broker.seq
+    session.add_all([Page(page_number=1, content="One"), Page(page_number=2, content="Two")])
+    session.commit()
+    create_note(1, "Note text", "On page one")
+    create_note(2, "Note text", "On page two")
+
+    generator = stream_changes(broker, start, {2}, set(), keepalive=0.01)
+    frames = _frames(generator, 2)
+    assert frames[0].startswith("retry:")
+    message = _data(frames[1])
+    assert message['table'] == 'notes'
+    assert message['action'] == 'created'
+    assert message['page'] == 2
+
+def test_stream_resyncs_when_too_far_behind():
+    broker = EventBroker(maxlen=2)
+    for i in range(5):
+        broker.publish({'table': 'nodes', 'nodes': [i]})
+    frames = _frames(stream_changes(broker, 0, set(), set(), keepalive=0.01), 3)
+    assert "event: resync" in frames[1]
+    assert _data(frames[2])['nodes'] == [3]
+
+def test_api_stream_events(client):
+    response = client.get('/events?since=0')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert next(response.response).startswith(b"retry:")
+    response.close()
+
+def test_api_stream_events_bad_filter(client):
+    response = client.get('/events?page=abc')
+    assert response.status_code == 400
+
+def test_broker_polls_for_changes_made_elsewhere():
+    broker = EventBroker()
+    values = {'graph': 1, 'notes': 1}
+    read = lambda: dict(values)
+    # The first poll only learns where the counters are
+    assert not broker.poll(None, read, interval=0)
+    # A commit in this process is already streamed, so isn't a reason to resync
+    values['graph'] = 2
+    broker.note_revisions(None, {'graph': (1, 2)})
+    assert not broker.poll(None, read, interval=0)
+    # One in another process is
+    values['notes'] = 5
+    assert broker.poll(None, read, interval=0)
+    # Polls are shared by every stream, once per interval
+    values['notes'] = 6
+    assert broker.poll(None, read, interval=60)
+    values['notes'] = 7
+    assert not broker.poll(None, read, interval=60)
+
+def test_stream_resyncs_on_changes_made_elsewhere():
+    broker = EventBroker()
+    values = {'graph': 1}
+    generator = stream_changes(broker, broker.seq, {2}, set(), keepalive=0.01, poll=lambda: dict(values), poll_interval=0)
+    assert next(generator).startswith("retry:")
+    assert next(generator) == ": keepalive\n\n"
+    values['graph'] = 2
+    # Sent whatever the stream's filters
+    assert "event: resync" in next(generator)
@@ -115,15 +115,15 @@ def test_soft_delete_relationship(client, session):
     session.add(end_node)
     session.commit()
     relationship = Relationship(start=start_node.id, end=end_node.id, rel="related", ler="testler")
-    reverse_relationship = Relationship(start=end_node.id, end=start_node.id, rel="related", ler="testler")
     session.add(relationship)
-    session.add(reverse_relationship)
     session.commit()
     response = client.put(f'/graph/relationship/delete?id={relationship.id}')
     assert response.status_code == 200
     data = response.get_json()
+    # One row per link: the reverse direction is presented under the negated id
     assert data[str(relationship.id)]['deleted'] == 1
-    assert data[str(reverse_relationship.id)]['deleted'] == 1
+    assert data[str(-relationship.id)]['deleted'] == 1
+    assert data[str(-relationship.id)]['start'] == end_node.id
 
 def test_merge_nodes(client, session):
     node1 = Node(node_type="testtype")
@@ -154,11 +154,279 @@ def test_delete_relationship(client, session):
     session.add(end_node)
     session.commit()
     relationship = Relationship(start=start_node.id, end=end_node.id, rel="related", ler="testler")
-    reverse_relationship = Relationship(start=end_node.id, end=start_node.id, rel="related", ler="testler")
     session.add(relationship)
-    session.add(reverse_relationship)
     session.commit()
-    response = client.delete(f'/graph/relationship/harddelete?id={relationship.id}')
+    relationship_id = relationship.id
+    # Either direction deletes the link
+    response = client.delete(f'/graph/relationship/harddelete?id={-relationship_id}')
     assert response.status_code == 200
-    assert Relationship.query.get(relationship.id) is None
-    assert Relationship.query.get(reverse_relationship.id) is None
\ No newline at end of file
+    assert Relationship.query.get(relationship_id) is None
+
+def test_merge_nodes_async(client, session):
+    node1 = Node(node_type="testtype")
+    node2 = Node(node_type="testtype")
+    session.add(node1)
+    session.add(node2)
+    session.commit()
+    response = client.put('/graph/node/merge', json={'id': [node1.id, node2.id], 'async': True})
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['name'] == 'merge_nodes'
+
+    response = client.get(f"/jobs/{job['id']}")
+    data = response.get_json()
+    assert data['status'] == 'done'
+    assert len(data['result']) == 3
+    assert data['result'][1]['merged'] == data['result'][0]['id']
+    assert data['result'][2]['merged'] == data['result'][0]['id']
+
+def test_merge_job_fails_on_deleted_nodes(session):
+    from flaskr.jobs import enqueue, FAILED
+    node1, node2 = Node(node_type="testtype"), Node(node_type="testtype")
+    session.add_all([node1, node2])
+    session.commit()
+    node_ids = [node1.id, node2.id]
+    # Hard deleted between the request and the job running
+    session.delete(node2)
+    session.commit()
+
+    failed = enqueue('merge_nodes', node_ids=node_ids, node_type="testtype")
+    assert failed.status == FAILED
+    assert str(node_ids[1]) in failed.error and "deleted" in failed.error
+    assert db.session.get(Node, node_ids[0]).merged is None
+
+
+def _hub(session, degree):
+    """A person node linked to `degree` others, with a note attached"""
+    from flaskr.models import Person, Page
+    from flaskr.blueprints.notes import create_note
+    hub = Node(node_type="person")
+    others = [Node(node_type="person") for _ in range(degree)]
+    session.add_all([hub] + others)
+    session.flush()
+    session.add(Person(node_id=hub.id, name="Hub", content=""))
+    if db.session.get(Page, 1) is None:
+        session.add(Page(id=1, page_number=1, content="Page"))
+    for other in others:
+        create_relationship(hub.id, other.id, "knows", "is known by")
+    note = create_note(1, "Note")
+    create_relationship(note['node_id'], hub.id, "mentions", "is mentioned in")
+    session.commit()
+    return hub, others, note
+
+def test_soft_delete_node_cascades(client, session):
+    from flaskr.models import Person, Note
+    hub, others, note = _hub(session, 3)
+    response = client.put(f'/graph/node/delete?id={hub.id}')
+    assert response.status_code == 200
+    assert Person.query.filter_by(node_id=hub.id).one().deleted == 1
+    rels = Relationship.query.filter((Relationship.start == hub.id) | (Relationship.end == hub.id)).all()
+    assert len(rels) == 4 and all(r.deleted == 1 for r in rels)
+    assert db.session.get(Note, note['id']).deleted != 1
+    assert all(n.deleted != 1 for n in others)
+
+def test_soft_delete_node_takes_attached_notes(client, session):
+    from flaskr.models import Note
+    hub, others, note = _hub(session, 1)
+    response = client.put(f'/graph/node/delete?id={hub.id}&notes=true')
+    assert response.status_code == 200
+    assert db.session.get(Note, note['id']).deleted == 1
+    assert db.session.get(Node, note['node_id']).deleted == 1
+    # Deleting a note's own node always deletes the note
+    _, _, other_note = _hub(session, 1)
+    assert client.put(f'/graph/node/delete?id={other_note["node_id"]}').status_code == 200
+    assert db.session.get(Note, other_note['id']).deleted == 1
+
+def test_soft_delete_node_round_trips_do_not_grow(app, session):
+    from sqlalchemy import event
+    from flaskr.blueprints.graph import soft_delete_nodes
+    statements = []
+    def count(*args):
+        statements.append(args)
+
+    small, _, _ = _hub(session, 1)
+    big, _, _ = _hub(session, 50)
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        soft_delete_nodes([small.id], notes=True)
+        session.commit()
+        small_count = len(statements)
+        statements.clear()
+        soft_delete_nodes([big.id], notes=True)
+        session.commit()
+        assert len(statements) == small_count
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+
+def test_bulk_soft_delete_nodes(client, session):
+    from flaskr.models import Note
+    hub, others, note = _hub(session, 2)
+    response = client.post('/graph/node/delete', json={'ids': [hub.id, others[0].id], 'notes': True})
+    assert response.status_code == 200
+    # The attached note's node and its link to the hub go too
+    assert response.get_json() == {
+        'nodes': 3, 'relationships': 3, 'tags': 0, 'people': 1, 'locations': 0, 'events': 0, 'notes': 1
+    }
+    assert db.session.get(Note, note['id']).deleted == 1
+    assert client.post('/graph/node/delete', json={'ids': [hub.id, 9999]}).status_code == 404
+    assert client.post('/graph/node/delete', json={'ids': []}).status_code == 400
+    for body in ({'ids': "abc"}, {'ids': ["x"]}, {'ids': [True]}, {'ids': [others[1].id], 'notes': "false"}):
+        assert client.post('/graph/node/delete', json=body).status_code == 400
+    assert client.put(f'/graph/node/delete?id={others[1].id}&notes=yes').status_code == 400
+    assert client.put(f'/graph/node/delete?id={others[1].id}&notes=false').status_code == 200
+
+
+def test_api_get_linked(client, session):
+    from flaskr.models import Person, Location
+    person, place, other = Node(node_type="person"), Node(node_type="location"), Node(node_type="person")
+    note = Node(node_type="note")
+    session.add_all([person, place, other, note])
+    session.flush()
+    session.add_all([
+        Person(node_id=person.id, name="Henry", content=""),
+        Person(node_id=other.id, name="Mary", content=""),
+        Location(node_id=place.id, name="Leeds", content=""),
+    ])
+    create_relationship(person.id, place.id, "visited", "was visited by")
+    create_relationship(person.id, other.id, "knows", "is known by")
+    gone, _ = create_relationship(person.id, note.id, "noted", "notes")
+    gone.deleted = 1
+    session.commit()
+
+    data = client.get(f'/graph/node/{person.id}/linked').get_json()
+    assert [(d['node']['id'], d['relationship']['rel']) for d in data] == [(place.id, "visited"), (other.id, "knows")]
+    assert data[0]['entity']['name'] == "Leeds"
+
+    data = client.get(f'/graph/node/{person.id}/linked?type=person').get_json()
+    assert [d['entity']['name'] for d in data] == ["Mary"]
+    data = client.get(f'/graph/node/{person.id}/linked?rel=visited').get_json()
+    assert [d['entity']['name'] for d in data] == ["Leeds"]
+    data = client.get(f'/graph/node/{person.id}/linked?include_deleted=true').get_json()
+    assert data[-1]['node']['id'] == note.id and data[-1]['entity'] is None
+    assert client.get('/graph/node/9999/linked').status_code == 404
+
+    data = client.get(f'/graph/node/linked?id={place.id}&id={other.id}').get_json()
+    assert [d['node']['id'] for d in data[str(place.id)]] == [person.id]
+    assert [d['node']['id'] for d in data[str(other.id)]] == [person.id]
+
+def test_get_linked_one_query_per_type(app, session):
+    from sqlalchemy import event
+    from flaskr.blueprints.graph import get_linked
+    hub = Node(node_type="person")
+    others = [Node(node_type="location") for _ in range(20)]
+    session.add_all([hub] + others)
+    session.flush()
+    for other in others:
+        create_relationship(hub.id, other.id, "visited", "was visited by")
+    hub_id, other_ids = hub.id, [o.id for o in others]
+
+    statements = []
+    count = lambda *args: statements.append(args)
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        linked = get_linked([hub_id] + other_ids, node_type="location")
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+    assert len(statements) == 1
+    assert len(linked[hub_id]) == 20
+
+def test_relationship_is_one_row_with_both_directions(client, session):
+    a, b = Node(node_type="person"), Node(node_type="person")
+    session.add_all([a, b])
+    session.commit()
+    forward, reverse = create_relationship(a.id, b.id, "visited", "was visited by")
+    assert Relationship.query.count() == 1
+    assert (reverse.id, reverse.start, reverse.end) == (-forward.id, b.id, a.id)
+    assert (reverse.rel, reverse.ler) == ("visited", "was visited by")
+
+    data = client.get(f'/graph/relationship?id={forward.id}&id={-forward.id}').get_json()
+    assert [(d['start'], d['end']) for d in data] == [(a.id, b.id), (b.id, a.id)]
+    assert client.get('/graph/relationship?id=abc').status_code == 404
+
+    # The link exists whichever way round it is asked for again
+    response = client.post('/graph/relationship/create', json={
+        'start': b.id, 'end': a.id, 'forward_relationship': 'visited', 'reverse_relationship': 'was visited by'
+    })
+    assert response.status_code == 400
+
+    data = client.get(f'/graph/node/{b.id}/linked').get_json()
+    assert [(d['node']['id'], d['relationship']['id'], d['relationship']['start']) for d in data] == [
+        (a.id, -forward.id, b.id)
+    ]
+
+def _story(session):
+    from flaskr.models import Person, Location, Event
+    henry, mary, paris, rome, trip = (Node(node_type=t) for t in ("person", "person", "location", "location", "event"))
+    session.add_all([henry, mary, paris, rome, trip])
+    session.flush()
+    session.add_all([
+        Person(node_id=henry.id, name="Henry", content=""),
+        Person(node_id=mary.id, name="Mary", content=""),
+        Location(node_id=paris.id, name="Paris", content=""),
+        Location(node_id=rome.id, name="Rome", content=""),
+        Event(node_id=trip.id, name="The trip", content=""),
+    ])
+    create_relationship(henry.id, paris.id, "visited", "was visited by")
+    # Stored the other way round, so only its reverse reads as "visited"
+    create_relationship(rome.id, mary.id, "was visited by", "visited")
+    create_relationship(paris.id, trip.id, "hosted", "was held in")
+    create_relationship(trip.id, rome.id, "ended in", "saw the end of")
+    session.commit()
+    return henry, mary, paris, rome, trip
+
+def _query(client, pattern, **kwargs):
+    return client.post('/graph/query', json={'pattern': pattern, **kwargs})
+
+def test_graph_query(client, session):
+    henry, mary, paris, rome, trip = _story(session)
+
+    data = _query(client, f'(p:person)-[visited]->(l:location)-[hosted]->(e:event {{id: {trip.id}}})').get_json()
+    assert data['columns'] == ['p', 'l', 'e']
+    assert [(m['p']['entity']['name'], m['l']['entity']['name']) for m in data['matches']] == [("Henry", "Paris")]
+
+    # Links read as their ler from end to start, and named links come back in the direction written
+    data = _query(client, '(p:person)-[r:visited]->(l:location)').get_json()
+    matches = {m['p']['entity']['name']: m for m in data['matches']}
+    assert set(matches) == {"Henry", "Mary"}
+    assert matches['Mary']['r']['start'] == mary.id and matches['Mary']['r']['id'] < 0
+    data = _query(client, '(l:location)<-[visited]-(p:person {name: "Mary"})').get_json()
+    assert [m['l']['entity']['name'] for m in data['matches']] == ["Rome"]
+    assert _query(client, '(p:person)<-[visited]-(l:location)').get_json()['matches'] == []
+
+    # Untyped nodes still come with their entity
+    data = _query(client, f'(e {{id: {trip.id}}})--(x)').get_json()
+    assert sorted(m['x']['entity']['name'] for m in data['matches']) == ["Paris", "Rome"]
+    # ...serialised the same way as a typed node's
+    untyped = {m['x']['entity']['name']: m['x']['entity'] for m in data['matches']}
+    typed = _query(client, f'(e:event {{id: {trip.id}}})--(x:location {{name: "Paris"}})').get_json()
+    assert typed['matches'][0]['x']['entity'] == untyped["Paris"]
+
+def test_graph_query_filters_and_limits(client, session, app):
+    henry, mary, paris, rome, trip = _story(session)
+    session.get(Node, mary.id).deleted = 1
+    session.commit()
+
+    assert len(_query(client, '(p:person)-[visited]->(l)').get_json()['matches']) == 1
+    data = _query(client, '(p:person)-[visited]->(l)', include_deleted=True).get_json()
+    assert len(data['matches']) == 2
+
+    data = _query(client, '(n)', limit=2).get_json()
+    assert len(data['matches']) == 2 and data['truncated']
+    app.config['GRAPH_QUERY_MAX_ROWS'] = 3
+    try:
+        data = _query(client, '(n)', limit=100).get_json()
+    finally:
+        del app.config['GRAPH_QUERY_MAX_ROWS']
+    assert data['limit'] == 3 and len(data['matches']) == 3
+
+    assert _query(client, '(p:person)-[').status_code == 400
+    assert _query(client, '(p {name: "Henry"})').status_code == 400
+    assert _query(client, '(n)', limit='all').status_code == 400
+    assert _query(client, '(n)', include_deleted="false").status_code == 400
+    assert _query(client, '(p:person)-[no such label]->(l)').status_code == 400
+
+def test_graph_query_uses_indexes(client, session):
+    henry, *_ = _story(session)
+    plan = _query(client, f'(p {{id: {henry.id}}})-[visited]->(l)-->(e)', explain=True).get_json()['plan']
+    # Every table is searched, through its primary key or an index, rather than scanned
+    assert plan and not [step for step in plan if step.startswith('SCAN')]
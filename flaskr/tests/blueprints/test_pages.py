@@ -2,6 +2,7 @@ import pytest
 from flask import Flask, jsonify
 from flaskr.blueprints.pages import bp as pages_bp, populate_pages, get_page, edit_page_content, search_pages
 from flaskr.models import db, Page
+from flaskr.concordance import index_all_tokens
 
 
 def test_populate_pages(session):
@@ -81,4 +82,152 @@ def test_api_search_pages_no_term(client):
     response = client.get('/page/search')
     assert response.status_code == 200
     data = response.get_json()
-    assert data == []
\ No newline at end of file
+    assert data == []
+
+def test_page_mentions_follow_edits(client, session):
+    from flaskr.blueprints.entities import create_entity
+    page = Page(id=1, page_number=1, content="Nothing here")
+    session.add(page)
+    session.commit()
+    henry = create_entity('person', name="Henry", content="")
+    assert client.get('/page/1/mentions').get_json() == []
+
+    edit_page_content(page, "Then henry spoke.")
+    data = client.get('/page/1/mentions').get_json()
+    assert data == [{'node_id': henry.node_id, 'node_type': 'person', 'name': "Henry", 'start': 5, 'end': 10}]
+    assert client.get('/page/2/mentions').status_code == 404
+
+def test_api_concordance(client, session, app):
+    content = "The Rector's wife. Then the rector spoke;  the\nRECTOR left."
+    session.add(Page(id=1, page_number=1, content=content))
+    session.add(Page(id=2, page_number=2, content="No one here."))
+    session.commit()
+    index_all_tokens()
+
+    data = client.get('/page/concordance?term=rector&window=4').get_json()
+    assert [(d['page'], d['match']) for d in data] == [(1, "rector"), (1, "RECTOR")]
+    assert data[0]['left'] == "the " and data[0]['right'] == " spo"
+    assert all(content[d['start']:d['end']] == d['match'] for d in data)
+
+    data = client.get('/page/concordance?term=the rector').get_json()
+    assert [d['match'] for d in data] == ["the rector", "the\nRECTOR"]
+    assert client.get("/page/concordance?term=rector's").get_json()[0]['match'] == "Rector's"
+    assert client.get('/page/concordance?term=').get_json() == []
+
+    assert len(client.get('/page/concordance?term=rector&limit=1').get_json()) == 1
+    for limit in (0, -1):
+        assert client.get(f'/page/concordance?term=rector&limit={limit}').status_code == 400
+    app.config['CONCORDANCE_MAX_ROWS'] = 1
+    try:
+        assert len(client.get('/page/concordance?term=rector&limit=100').get_json()) == 1
+    finally:
+        del app.config['CONCORDANCE_MAX_ROWS']
+
+def test_concordance_follows_edits(client, session):
+    page = Page(id=1, page_number=1, content="Nothing here")
+    session.add(page)
+    session.commit()
+    assert client.get('/page/concordance?term=mystery').get_json() == []
+    edit_page_content(page, "A mystery, a mystery.")
+    data = client.get('/page/concordance?term=mystery&window=2').get_json()
+    assert [(d['start'], d['end'], d['left']) for d in data] == [(2, 9, "A "), (13, 20, "a ")]
+
+def _pages_with_notes(session, count=6):
+    from flaskr.blueprints.notes import create_note
+    for number in range(1, count + 1):
+        session.add(Page(id=number, page_number=number, content=f"Page {number}"))
+    session.commit()
+    create_note(2, "On two", "First")
+    create_note(2, "Also on two", "Second")
+    create_note(4, "On four", "Third")
+
+def test_api_get_page_batch(client, session):
+    _pages_with_notes(session)
+    data = client.get('/page/batch?page=2&page=4').get_json()['pages']
+    assert [p['page_number'] for p in data] == [2, 4]
+    assert [n['content'] for n in data[0]['notes']] == ["First", "Second"]
+    assert [n['content'] for n in data[1]['notes']] == ["Third"]
+    assert not any(p['prefetched'] for p in data)
+
+    data = client.get('/page/batch?page=2-4').get_json()['pages']
+    assert [(p['page_number'], p['content'], len(p['notes'])) for p in data] == [(2, "Page 2", 2), (3, "Page 3", 0), (4, "Page 4", 1)]
+
+def test_api_get_page_batch_prefetch(client, session):
+    _pages_with_notes(session)
+    data = client.get('/page/batch?page=1&page=5&prefetch=1').get_json()['pages']
+    assert [(p['page_number'], p['prefetched']) for p in data] == [(1, False), (2, True), (4, True), (5, False), (6, True)]
+
+def test_api_get_page_batch_is_one_query(client, session):
+    from sqlalchemy import event
+    _pages_with_notes(session)
+    statements = []
+    def before_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", before_execute)
+    try:
+        client.get('/page/batch?page=1-6')
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_execute)
+    assert len([s for s in statements if 'FROM pages' in s]) == 1
+
+def test_api_get_page_batch_invalid(client, session):
+    assert client.get('/page/batch').status_code == 400
+    assert client.get('/page/batch?page=x').status_code == 400
+    assert client.get('/page/batch?page=1-500').status_code == 400
+    assert client.get('/page/batch?page=1-40&page=41-80').status_code == 400
+
+def test_api_patch_page_content(client, session):
+    from flaskr.blueprints.notes import create_note
+    session.add(Page(id=1, page_number=1, content="The qiuck brown fox jumped."))
+    session.commit()
+    on_fox = create_note(1, "fox", "On fox", 16, 19)
+    on_jumped = create_note(1, "jumped", "On jumped", 20, 26)
+    on_brown = create_note(1, "brown", "On brown", 10, 15)
+
+    response = client.patch('/page/patch?page=1', json={'edits': [
+        {'start': 4, 'end': 9, 'text': "quick"},
+        {'start': 10, 'end': 16, 'text': ""},
+        {'start': 27, 'end': 27, 'text': " Twice."},
+    ]})
+    data = response.get_json()
+    assert data['content'] == "The quick fox jumped. Twice."
+    notes = {n['id']: n for n in data['notes']}
+    assert data['content'][notes[on_fox['id']]['text_start']:notes[on_fox['id']]['text_end']] == "fox"
+    assert data['content'][notes[on_jumped['id']]['text_start']:notes[on_jumped['id']]['text_end']] == "jumped"
+    assert data['detached'] == [on_brown['id']]
+    assert notes[on_brown['id']]['detached'] == 1
+    assert notes[on_fox['id']]['detached'] == 0
+
+    # The index follows the new text
+    assert client.get('/page/concordance?term=quick').get_json()[0]['start'] == 4
+
+def test_api_patch_page_content_if_match(client, session):
+    page = Page(id=1, page_number=1, content="Some text")
+    session.add(page)
+    session.commit()
+    etag = client.get('/page/?page=1').headers['ETag']
+    response = client.patch('/page/patch?page=1', json={'edits': [{'start': 0, 'end': 4, 'text': "Any"}]}, headers={'If-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    # The first edit changed the page, so offsets relative to the old copy are refused
+    response = client.patch('/page/patch?page=1', json={'edits': [{'start': 0, 'end': 4, 'text': "No"}]}, headers={'If-Match': etag})
+    assert response.status_code == 412
+    assert get_page(1).content == "Any text"
+
+def test_api_patch_page_content_invalid(client, session):
+    session.add(Page(id=1, page_number=1, content="Some text"))
+    session.commit()
+    assert client.patch('/page/patch?page=1', json={'edits': [{'start': 0, 'end': 40}]}).status_code == 400
+    assert client.patch('/page/patch?page=1', json={'edits': []}).status_code == 400
+    assert client.patch('/page/patch?page=2', json={'edits': [{'start': 0, 'end': 1}]}).status_code == 404
+    assert get_page(1).content == "Some text"
+
+def test_edit_page_content_rebases_notes(session):
+    from flaskr.blueprints.notes import create_note, get_notes
+    page = Page(id=1, page_number=1, content="A note on this word here.")
+    session.add(page)
+    session.commit()
+    note = create_note(1, "word", "", 15, 19)
+    edit_page_content(page, "A longer note on this word, here.")
+    note = get_notes([note['id']])[0]
+    assert page.content[note.text_start:note.text_end] == "word"
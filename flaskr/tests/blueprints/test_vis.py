@@ -2,7 +2,7 @@ import pytest
 from flaskr.models import Page, User, Tag, Node, Relationship, Note, Person, Location, Event
 from flaskr import db
 from flaskr.models import Serialiser
-from flaskr.blueprints.entities import create_entity
+from flaskr.blueprints.entities import create_entity, link_entities
 from flaskr.blueprints.vis import return_graph
 
 from datetime import datetime
@@ -36,4 +36,80 @@ def test_return_graph(client, session):
 
     # Check if the graph data is returned correctly
     assert len(graph_data['nodes']) == 3
-    assert len(graph_data['relationships']) == 2
\ No newline at end of file
+    assert len(graph_data['relationships']) == 2
+
+def test_return_graph_has_positions(client, session):
+    person = create_entity("person", name="John Doe", content="Person content")
+    other = create_entity("person", name="Jane Doe", content="Person content")
+    link_entities(person, other, "knows", "knows")
+
+    response = client.get('/vis/graph')
+    assert response.status_code == 200
+    nodes = response.get_json()['nodes']
+    assert len(nodes) == 2
+    for node in nodes:
+        assert isinstance(node['x'], float)
+        assert isinstance(node['y'], float)
+
+def _two_groups():
+    # Two triangles of people joined by one link, and a location on its own
+    people = [create_entity("person", name=name, content="") for name in ("A", "B", "C", "D", "E", "F")]
+    for i, j in ((0, 1), (1, 2), (0, 2), (3, 4), (4, 5), (3, 5), (2, 3)):
+        link_entities(people[i], people[j], "knows", "knows")
+    create_entity("location", name="Leeds", content="", country=None, district=None, town=None)
+    return people
+
+def test_graph_by_type(client, session):
+    _two_groups()
+    data = client.get('/vis/graph?lod=type').get_json()
+    clusters = {c['node_id']: c for c in data['nodes']}
+    assert set(clusters) == {'type:person', 'type:location'}
+    assert clusters['type:person']['size'] == 6
+    assert clusters['type:person']['internal_edges'] == 7
+    assert clusters['type:location']['node_types'] == {'location': 1}
+    assert isinstance(clusters['type:person']['x'], float)
+    assert data['relationships'] == []
+    assert data['summary'] == {'nodes': 7, 'edges': 7, 'clusters': 2}
+
+def test_graph_by_community(client, session, app):
+    people = _two_groups()
+    data = client.get('/vis/graph?lod=community').get_json()
+    sizes = sorted(c['size'] for c in data['nodes'])
+    assert sum(sizes) == 7 and len(sizes) >= 2
+    assert all(r['weight'] >= 1 for r in data['relationships'])
+    # Clusters are labelled after their most linked member
+    assert {c['entity']['name'] for c in data['nodes'] if c['size'] > 1} <= {"C", "D", "A", "B", "E", "F"}
+
+    app.config['VIS_MAX_CLUSTERS'] = 1
+    try:
+        # The cap applies from the next graph revision
+        link_entities(people[0], people[5], "knows", "knows")
+        data = client.get('/vis/graph?lod=community').get_json()
+    finally:
+        del app.config['VIS_MAX_CLUSTERS']
+    assert [(c['node_id'], c['size']) for c in data['nodes']] == [('community:other', 7)]
+
+    assert client.get('/vis/graph?lod=everything').status_code == 400
+    assert len(client.get('/vis/graph?lod=full').get_json()['nodes']) == 7
+
+def test_expand_cluster(client, session):
+    people = _two_groups()
+    data = client.get('/vis/cluster/type:person').get_json()
+    assert data['cluster']['size'] == 6 and not data['truncated']
+    assert {n['entity']['name'] for n in data['nodes']} == {"A", "B", "C", "D", "E", "F"}
+    assert len(data['relationships']) == 7
+    assert data['links'] == []
+
+    data = client.get('/vis/cluster/type:person?limit=2').get_json()
+    # The most linked members come first
+    assert {n['entity']['name'] for n in data['nodes']} == {"C", "D"}
+    assert data['truncated'] and len(data['relationships']) == 1
+
+    communities = client.get('/vis/graph?lod=community').get_json()
+    cluster = next(c for c in communities['nodes'] if c['size'] > 1)
+    data = client.get(f"/vis/cluster/{cluster['node_id']}").get_json()
+    outside = sum(r['weight'] for r in communities['relationships'] if cluster['node_id'] in (r['start'], r['end']))
+    assert sum(link['weight'] for link in data['links']) == outside
+
+    assert client.get('/vis/cluster/type:dragon').status_code == 404
+    assert client.get('/vis/cluster/nonsense').status_code == 404
@@ -1,55 +1,121 @@
-import os
-import tempfile
 import pytest
-import logging as log
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from flask_sqlalchemy.session import Session
+
 from flaskr import create_app
 from flaskr.models import db as _db
+from flaskr.indexes import reset_indexes
+from .datasets import seed_benchmark_graph
+
+# The schema is built ONCE per test process in an in-memory database.  Every process gets its
+# own private copy, so the suite is safe to run in parallel with pytest-xdist (`pytest -n auto`).
+# Each test then runs inside an outer transaction which is rolled back when the test finishes,
+# and any commits made by the code under test only release a SAVEPOINT inside that transaction.
+TEST_CONFIG = {
+    'TESTING': True,
+    'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    # pysqlite issues its own BEGIN/COMMIT, which breaks SAVEPOINT handling.  Turn that off and
+    # let SQLAlchemy emit BEGIN itself (see _enable_savepoints)
+    'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'isolation_level': None}},
+    # Run background jobs inline so they share the test's transaction
+    'JOBS_EAGER': True,
+}
+
+
+class _BoundSession(Session):
+    """
+    Flask-SQLAlchemy always routes to the app's engine, ignoring a session's `bind`.
+    For tests we want every session to share the connection holding the outer transaction.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.bind is not None:
+            return self.bind
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
 
-# This mimics the app instanciation in the __init__.py file
-@pytest.fixture(scope='function')
-def app():
-    # Create TEMPORARY database file for testing
-    db_fd, db_path = tempfile.mkstemp()
 
-    app = create_app({
-        'TESTING': True,
-        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
-        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
-    })
+def _enable_savepoints(engine):
+    @event.listens_for(engine, "begin")
+    def do_begin(conn):
+        conn.exec_driver_sql("BEGIN")
 
+
+def _make_app(seed=None):
+    """Create an app on a fresh in-memory database, optionally seeded with committed data."""
+    app = create_app(dict(TEST_CONFIG))
     with app.app_context():
+        _enable_savepoints(_db.engine)
         _db.create_all()
+        if seed is not None:
+            seed(_db.session)
+            _db.session.commit()
+        _db.session.remove()
+    return app
 
-    yield app
 
+@contextmanager
+def _isolated_session(app):
+    """
+    Swap `db.session` for one bound to a connection in an outer transaction.  Commits made inside
+    the block become SAVEPOINT releases and everything is rolled back on exit.
+    """
     with app.app_context():
-        _db.drop_all()  # Cleanup after all tests
+        connection = _db.engine.connect()
+        transaction = connection.begin()
+        options = dict(
+            bind=connection,
+            binds={},
+            class_=_BoundSession,
+            join_transaction_mode="create_savepoint",
+        )
+        original_session = _db.session
+        session = _db._make_scoped_session(options=options)
+        _db.session = session
+        try:
+            yield session
+        finally:
+            session.remove()
+            _db.session = original_session
+            transaction.rollback()
+            connection.close()
+            # In-process indexes may have seen rows which no longer exist
+            reset_indexes()
+
+
+# This mimics the app instanciation in the __init__.py file.  Built once per session.
+@pytest.fixture(scope='session')
+def app():
+    return _make_app()
 
-    os.close(db_fd)
-    os.unlink(db_path)
+# Provide a database session for each test.  Nothing written during the test survives it.
+@pytest.fixture(scope='function')
+def session(app):
+    with _isolated_session(app) as session:
+        yield session
 
 # Run the tests on a dedicated test client so not interfere with the server
 @pytest.fixture(scope='function')
-def client(app):
+def client(app, session):
     return app.test_client()
 
 @pytest.fixture(scope='function')
-def runner(app):
+def runner(app, session):
     return app.test_cli_runner()
 
-# Provide a database session for each test
-@pytest.fixture(scope='function')
-def session(app):
-    with app.app_context():
-        connection = _db.engine.connect()
-        transaction = connection.begin()
-        options = dict(bind=connection, binds={})
-        session = _db._make_scoped_session(options=options)
-        _db.session = session
 
+# A larger graph, seeded once per session and shared by every test that asks for it.
+# Tests should treat it as read-only, but any writes are still rolled back.
+@pytest.fixture(scope='session')
+def benchmark_app():
+    return _make_app(seed=seed_benchmark_graph)
+
+@pytest.fixture(scope='function')
+def benchmark_session(benchmark_app):
+    with _isolated_session(benchmark_app) as session:
         yield session
-        # For some reason, the transaction is not rolled back automatically
 
-        transaction.rollback()
-        connection.close()
-        session.remove()
\ No newline at end of file
+@pytest.fixture(scope='function')
+def benchmark_client(benchmark_app, benchmark_session):
+    return benchmark_app.test_client()
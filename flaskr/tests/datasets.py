@@ -0,0 +1,64 @@
+"""
+Seed data for the shared, read-only benchmark database used by the `benchmark_*` fixtures.
+Everything is bulk inserted with explicit ids so the dataset is identical on every run.
+"""
+import random
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from flaskr.models import Node, Relationship, RelationshipType, Person, Location, Event, Page
+
+BENCHMARK_PEOPLE = 1000
+BENCHMARK_LOCATIONS = 300
+BENCHMARK_EVENTS = 200
+BENCHMARK_LINKS = 3000
+BENCHMARK_PAGES = 100
+
+
+def seed_benchmark_graph(session, seed: int = 1935):
+    rng = random.Random(seed)
+    created = datetime(2024, 1, 1)
+
+    entity_counts = (
+        ('person', Person, BENCHMARK_PEOPLE),
+        ('location', Location, BENCHMARK_LOCATIONS),
+        ('event', Event, BENCHMARK_EVENTS),
+    )
+    nodes, node_ids = [], []
+    for node_type, model, count in entity_counts:
+        rows = []
+        for i in range(count):
+            node_id = len(nodes) + 1
+            nodes.append({'id': node_id, 'created': created, 'node_type': node_type, 'deleted': 0})
+            rows.append({
+                'id': i + 1,
+                'created': created,
+                'deleted': 0,
+                'name': f"{node_type.title()} {i + 1}",
+                'content': f"Benchmark {node_type} number {i + 1}",
+                'node_id': node_id,
+            })
+            node_ids.append(node_id)
+        session.execute(insert(Node), nodes[-count:])
+        session.execute(insert(model), rows)
+
+    # One row per link, as graph.create_relationship does
+    pairs = set()
+    while len(pairs) < BENCHMARK_LINKS:
+        start, end = rng.sample(node_ids, 2)
+        if (start, end) in pairs or (end, start) in pairs:
+            continue
+        pairs.add((start, end))
+    session.execute(insert(RelationshipType), [{'id': 1, 'rel': 'knows', 'ler': 'is known by'}])
+    relationships = []
+    for start, end in sorted(pairs):
+        relationships.append({
+            'created': created, 'start': start, 'end': end, 'type_id': 1, 'deleted': 0
+        })
+    session.execute(insert(Relationship), relationships)
+
+    session.execute(insert(Page), [
+        {'id': n, 'page_number': n, 'content': f"Benchmark page {n}. " * 40}
+        for n in range(1, BENCHMARK_PAGES + 1)
+    ])
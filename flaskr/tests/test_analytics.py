@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from flaskr.analytics import pagerank, connected_components, label_propagation, betweenness, graph_analytics
+from flaskr.graphdata import GraphArrays
+from .datasets import BENCHMARK_PEOPLE, BENCHMARK_LOCATIONS, BENCHMARK_EVENTS
+
+
+def _graph(n, edges):
+    src, dst = np.array(edges, dtype=np.int64).reshape(-1, 2).T
+    return GraphArrays(np.arange(1, n + 1), np.array(['person'] * n, dtype=object), src, dst)
+
+# Two triangles joined through node 3 -- 4, plus an isolated node 7
+BARBELL = _graph(7, [(0, 1), (1, 2), (0, 2), (2, 3), (3, 4), (4, 5), (3, 5)])
+
+
+def test_pagerank_sums_to_one():
+    ranks = pagerank(BARBELL)
+    assert ranks.sum() == pytest.approx(1.0)
+    assert ranks[2] > ranks[0]
+    assert ranks[6] == ranks.min()
+
+def test_connected_components():
+    labels = connected_components(BARBELL)
+    assert len(set(labels[:6])) == 1
+    assert labels[0] == 0
+    assert labels[6] == 1
+
+def test_label_propagation_splits_triangles():
+    labels = label_propagation(_graph(6, [(0, 1), (1, 2), (0, 2), (3, 4), (4, 5), (3, 5), (2, 3)]))
+    assert labels[0] == labels[1] == labels[2]
+    assert labels[3] == labels[4] == labels[5]
+    assert labels[0] != labels[3]
+
+def test_betweenness_exact_on_a_path():
+    # 0 - 1 - 2 - 3: nodes 1 and 2 each sit on 2 shortest paths
+    scores = betweenness(_graph(4, [(0, 1), (1, 2), (2, 3)]))
+    assert scores.tolist() == pytest.approx([0, 2, 2, 0])
+
+def test_betweenness_counts_split_paths():
+    # A square: each corner lies on half of the paths between its two neighbours
+    scores = betweenness(_graph(4, [(0, 1), (1, 2), (2, 3), (3, 0)]))
+    assert scores.tolist() == pytest.approx([0.5, 0.5, 0.5, 0.5])
+
+def test_analytics_cached_per_revision(benchmark_session):
+    first = graph_analytics.state()
+    assert graph_analytics.state() is first
+    assert first.graph.n_nodes == BENCHMARK_PEOPLE + BENCHMARK_LOCATIONS + BENCHMARK_EVENTS
+
+def test_api_analytics_top(benchmark_client):
+    response = benchmark_client.get('/graph/analytics?top=5&sort=degree&metric=degree&metric=component')
+    assert response.status_code == 200
+    data = response.get_json()
+    degrees = [n['degree'] for n in data['nodes']]
+    assert len(degrees) == 5
+    assert degrees == sorted(degrees, reverse=True)
+    assert set(data['nodes'][0]) == {'node_id', 'node_type', 'degree', 'component'}
+    assert data['summary']['nodes'] == BENCHMARK_PEOPLE + BENCHMARK_LOCATIONS + BENCHMARK_EVENTS
+
+def test_api_analytics_top_must_be_positive(benchmark_client):
+    for top in (0, -1):
+        assert benchmark_client.get(f'/graph/analytics?top={top}').status_code == 400
+    assert graph_analytics.state().top('degree', -1) == []
+
+def test_api_analytics_by_id(benchmark_client):
+    response = benchmark_client.get('/graph/analytics?id=1&id=2&metric=pagerank')
+    nodes = response.get_json()['nodes']
+    assert [n['node_id'] for n in nodes] == [1, 2]
+
+def test_api_analytics_unknown_metric(client):
+    response = client.get('/graph/analytics?metric=wisdom')
+    assert response.status_code == 400
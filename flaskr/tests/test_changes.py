@@ -0,0 +1,97 @@
+import pytest
+from flaskr.changes import on_change, _listeners, CREATED, UPDATED, DELETED, MERGED
+from flaskr.models import Node, Note, Page, Relationship
+from flaskr.revisions import current_revision
+
+
+@pytest.fixture
+def changes():
+    seen = []
+    listener = on_change(lambda changes, revisions: seen.extend(changes))
+    yield seen
+    _listeners.remove(listener)
+
+
+def test_create_is_recorded(session, changes):
+    node = Node(node_type="person")
+    session.add(node)
+    session.commit()
+    assert [(c.table, c.action, c.id) for c in changes] == [('nodes', CREATED, node.id)]
+    assert changes[0].node_ids == [node.id]
+
+def test_soft_delete_and_merge_are_recorded(session, changes):
+    node1, node2 = Node(node_type="person"), Node(node_type="person")
+    session.add_all([node1, node2])
+    session.commit()
+    changes.clear()
+
+    node1.deleted = 1
+    node2.merged = node1.id
+    session.commit()
+    actions = {c.id: c.action for c in changes}
+    assert actions == {node1.id: DELETED, node2.id: MERGED}
+
+def test_relationship_touches_both_nodes(session, changes):
+    node1, node2 = Node(node_type="person"), Node(node_type="person")
+    session.add_all([node1, node2])
+    session.commit()
+    changes.clear()
+
+    session.add(Relationship(start=node1.id, end=node2.id, rel="knows", ler="knows"))
+    session.commit()
+    assert changes[0].node_ids == [node1.id, node2.id]
+
+def test_note_update_carries_page(session, changes):
+    session.add(Page(page_number=1, content="Page content"))
+    note = Note(page_number=1, note_text="text", content="content")
+    session.add(note)
+    session.commit()
+    changes.clear()
+
+    note.content = "new content"
+    session.commit()
+    assert [(c.table, c.action, c.page_number) for c in changes] == [('notes', UPDATED, 1)]
+
+def test_rollback_discards_changes(session, changes):
+    session.add(Node(node_type="person"))
+    session.flush()
+    session.rollback()
+    session.commit()
+    assert changes == []
+
+def test_unwatched_tables_are_ignored(session, changes):
+    session.add(Page(page_number=1, content="Page content"))
+    session.commit()
+    assert changes == []
+
+def test_revisions_are_reported(session):
+    seen = []
+    listener = on_change(lambda changes, revisions: seen.append(revisions))
+    try:
+        session.add(Node(node_type="person"))
+        session.flush()
+        session.add(Node(node_type="person"))
+        session.commit()
+    finally:
+        _listeners.remove(listener)
+    before, after = seen[0]['graph']
+    assert after == before + 2
+    assert current_revision('graph') == after
+
+def test_cascade_soft_delete_is_recorded(session, changes):
+    from flaskr.blueprints.graph import soft_delete_nodes
+    node1, node2 = Node(node_type="person"), Node(node_type="person")
+    session.add_all([node1, node2])
+    session.flush()
+    session.add(Relationship(start=node1.id, end=node2.id, rel="knows", ler="is known by"))
+    session.commit()
+    changes.clear()
+    before = current_revision('graph')
+
+    soft_delete_nodes([node1.id])
+    session.commit()
+    assert sorted((c.table, c.action) for c in changes) == [
+        ('nodes', DELETED), ('relationships', DELETED)
+    ]
+    assert all(node1.id in c.node_ids for c in changes)
+    assert current_revision('graph') == before + 1
@@ -0,0 +1,49 @@
+import gzip
+
+from flaskr.compression import choose_encoding, parse_accept_encoding, snapshot_bodies
+from flaskr.blueprints.entities import create_entity, link_entities
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding("gzip;q=0.5, br, identity;q=0") == {'gzip': 0.5, 'br': 1.0, 'identity': 0.0}
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate") == 'gzip'
+    assert choose_encoding("*") is not None
+    assert choose_encoding("gzip;q=0") is None
+    assert choose_encoding("deflate") is None
+    assert choose_encoding("") is None
+
+def _graph(count=20):
+    people = [create_entity('person', name=f"Person {i}", content="Some content") for i in range(count)]
+    for a, b in zip(people, people[1:]):
+        link_entities(a, b, "knows", "is known by")
+
+def test_large_responses_are_gzipped(client, session):
+    _graph()
+    plain = client.get('/vis/graph')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    response = client.get('/vis/graph', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(response.data) < len(plain.data)
+    assert gzip.decompress(response.data) == plain.data
+
+def test_small_responses_are_not_compressed(client, session):
+    response = client.get('/tag/suggest?prefix=x', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+def test_snapshots_are_compressed_once_per_revision(client, session):
+    _graph()
+    cache = snapshot_bodies.state()
+    first = client.get('/vis/graph', headers={'Accept-Encoding': 'gzip'})
+    hits = cache.hits
+    second = client.get('/vis/graph', headers={'Accept-Encoding': 'gzip'})
+    assert cache.hits == hits + 1
+    assert second.data == first.data
+
+    create_entity('person', name="Someone new", content="")
+    third = client.get('/vis/graph', headers={'Accept-Encoding': 'gzip'})
+    assert cache.hits == hits + 1
+    assert b"Someone new" in gzip.decompress(third.data)
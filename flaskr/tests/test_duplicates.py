@@ -0,0 +1,51 @@
+from flaskr.duplicates import find_duplicates, name_trigrams, shared_features, _encode
+
+
+def test_name_trigrams_normalise():
+    assert name_trigrams("  Henry   Bolton ") == name_trigrams("henry bolton")
+    assert "  h" in name_trigrams("Henry")
+
+def test_shared_features_counts_pairs():
+    owners, features = _encode([{'a', 'b'}, {'a', 'b', 'c'}, {'c'}, {'d'}])
+    codes, shared, sizes = shared_features(owners, features, 4, max_block=10)
+    assert dict(zip(codes.tolist(), shared.tolist())) == {0 * 4 + 1: 2, 1 * 4 + 2: 1}
+    assert sizes.tolist() == [2, 3, 1, 1]
+
+def test_shared_features_skips_large_blocks():
+    owners, features = _encode([{'common', 'x'}, {'common', 'x'}, {'common'}])
+    codes, shared, sizes = shared_features(owners, features, 3, max_block=2)
+    assert codes.tolist() == [1]
+    assert shared.tolist() == [1]
+    assert sizes.tolist() == [1, 1, 0]
+
+def test_find_duplicates_clusters():
+    entities = [
+        (1, 1, "Henry Bolton", "A lawyer from Leeds"),
+        (2, 2, "Henry Boulton", "Lawyer, Leeds"),
+        (3, 3, "Henry Bolton Jr", "A lawyer from Leeds"),
+        (4, 4, "Mary Smith", "A cook"),
+        (5, 5, "Edward Hyde", "Unknown"),
+    ]
+    clusters = find_duplicates(entities, threshold=0.5)
+    assert len(clusters) == 1
+    assert [m['node_id'] for m in clusters[0]['members']] == [1, 2, 3]
+    scores = [p['score'] for p in clusters[0]['pairs']]
+    assert scores == sorted(scores, reverse=True)
+    assert clusters[0]['score'] == scores[0]
+
+def test_find_duplicates_content_breaks_ties():
+    entities = [
+        (1, 1, "John Smith", "the baker on Mill Lane"),
+        (2, 2, "Jon Smith", "the baker on Mill Lane"),
+        (3, 3, "Jon Smyth", "a sailor"),
+    ]
+    clusters = find_duplicates(entities, threshold=0.3)
+    pairs = {(p['a'], p['b']): p['score'] for p in clusters[0]['pairs']}
+    assert pairs[(1, 2)] > pairs.get((2, 3), 0)
+
+def test_find_duplicates_scales():
+    entities = [(i, i, f"Person {i}", f"Benchmark person number {i}") for i in range(20000)]
+    # Every name shares "person" and "number", too common a block to pair everyone up through
+    clusters = find_duplicates(entities)
+    assert len(clusters) < len(entities) // 10
+    assert all(pair['score'] >= 0.5 for cluster in clusters for pair in cluster['pairs'])
@@ -0,0 +1,95 @@
+from sqlalchemy import event
+
+from flaskr.models import db, Page
+from flaskr.blueprints.pages import edit_page_content
+from flaskr.blueprints.notes import create_note, update_note, get_notes, soft_delete_note
+from flaskr.blueprints.entities import create_entity
+
+
+def _page(session, number=1, content="Page content"):
+    page = Page(id=number, page_number=number, content=content)
+    session.add(page)
+    session.commit()
+    return page
+
+def _count_statements():
+    statements = []
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", before_execute)
+    return statements, lambda: event.remove(db.engine, "before_cursor_execute", before_execute)
+
+def test_page_not_modified(client, session):
+    page = _page(session)
+    response = client.get('/page/?page=1')
+    etag = response.headers['ETag']
+    assert 'no-cache' in response.headers['Cache-Control']
+
+    statements, stop = _count_statements()
+    try:
+        response = client.get('/page/?page=1', headers={'If-None-Match': etag})
+    finally:
+        stop()
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    # Only the revision counters are read, not the page
+    assert not any('pages' in statement for statement in statements)
+
+    edit_page_content(page, "New content")
+    response = client.get('/page/?page=1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.text == "New content"
+    assert response.headers['ETag'] != etag
+
+def test_page_etag_is_per_page(client, session):
+    _page(session, 1)
+    other = _page(session, 2)
+    etag = client.get('/page/?page=1').headers['ETag']
+    edit_page_content(other, "Changed")
+    assert client.get('/page/?page=1', headers={'If-None-Match': etag}).status_code == 304
+
+def test_missing_page_has_no_etag(client, session):
+    response = client.get('/page/?page=99')
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
+
+def test_page_notes_not_modified(client, session):
+    _page(session, 1)
+    _page(session, 2)
+    note = create_note(1, "Note text", "Note content", 0, 4)
+    etag = client.get('/note/on-page?id=1').headers['ETag']
+    assert client.get('/note/on-page?id=1', headers={'If-None-Match': etag}).status_code == 304
+
+    # Notes on another page don't matter
+    create_note(2, "Other", "Other content")
+    assert client.get('/note/on-page?id=1', headers={'If-None-Match': etag}).status_code == 304
+
+    update_note(get_notes([note['id']])[0], "Changed")
+    response = client.get('/note/on-page?id=1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    soft_delete_note(get_notes([note['id']])[0])
+    assert client.get('/note/on-page?id=1', headers={'If-None-Match': etag}).status_code == 200
+
+def test_graph_etag_with_compression(client, session):
+    for i in range(20):
+        create_entity('person', name=f"Person {i}", content="Some content")
+    response = client.get('/vis/graph', headers={'Accept-Encoding': 'gzip'})
+    etag = response.headers['ETag']
+    assert etag.endswith('-gzip"')
+
+    response = client.get('/vis/graph', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['ETag'] == etag
+    # The uncompressed tag names the same revision
+    plain = client.get('/vis/graph').headers['ETag']
+    response = client.get('/vis/graph', headers={'If-None-Match': plain})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == plain
+
+    create_entity('person', name="Someone new", content="")
+    response = client.get('/vis/graph', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 200
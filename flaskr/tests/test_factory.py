@@ -1,5 +1,6 @@
 import tempfile
 from flaskr import create_app
+from flaskr.models import db
 
 
 def test_config():
@@ -16,3 +17,30 @@ def test_config():
 def test_hello(client):
     response = client.get('/hello')
     assert response.data == b'Hello World!'
+
+
+def test_startup_does_not_touch_database(app):
+    report = app.extensions['startup_timings']
+    assert 'create_schema' not in report
+    assert 'populate_pages' not in report
+    assert {'config', 'extensions', 'blueprints'} <= set(report)
+
+
+def test_startup_report_command(runner):
+    result = runner.invoke(args=['startup-report'])
+    assert result.exit_code == 0
+    assert 'blueprints' in result.output
+    assert 'total' in result.output
+
+
+def test_init_db_command_schema_only():
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+    })
+    result = app.test_cli_runner().invoke(args=['init-db', '--no-pages'])
+    assert result.exit_code == 0
+    assert 'create_schema' in result.output
+    assert 'populate_pages' not in result.output
+    with app.app_context():
+        assert 'nodes' in db.inspect(db.engine).get_table_names()
@@ -0,0 +1,29 @@
+from flaskr.models import Node, Person, Relationship
+from .datasets import BENCHMARK_PEOPLE, BENCHMARK_LOCATIONS, BENCHMARK_EVENTS, BENCHMARK_LINKS
+
+
+# These two tests run in either order; neither should see the other's committed node.
+def test_commit_is_rolled_back_first(client, session):
+    session.add(Node(node_type="isolation"))
+    session.commit()
+    client.post('/graph/node/create', json={'node_type': 'person'})
+    assert Node.query.count() == 2
+
+def test_commit_is_rolled_back_second(client, session):
+    session.add(Node(node_type="isolation"))
+    session.commit()
+    client.post('/graph/node/create', json={'node_type': 'person'})
+    assert Node.query.count() == 2
+
+def test_benchmark_dataset_is_shared(benchmark_session):
+    assert Person.query.count() == BENCHMARK_PEOPLE
+    assert Node.query.count() == BENCHMARK_PEOPLE + BENCHMARK_LOCATIONS + BENCHMARK_EVENTS
+    assert Relationship.query.count() == BENCHMARK_LINKS
+
+def test_benchmark_writes_are_rolled_back(benchmark_session):
+    Person.query.delete()
+    benchmark_session.commit()
+    assert Person.query.count() == 0
+
+def test_benchmark_dataset_survives_writes(benchmark_session):
+    assert Person.query.count() == BENCHMARK_PEOPLE
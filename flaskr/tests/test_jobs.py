@@ -0,0 +1,84 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from flaskr.jobs import job, enqueue, run_job, resume_jobs, JobRunner, QUEUED, RUNNING, DONE, FAILED
+from flaskr.models import Job
+
+
+@job('test_add')
+def add_job(ctx, a, b):
+    ctx.report(0.5, {'half': True})
+    return a + b
+
+@job('test_fail')
+def fail_job(ctx):
+    raise ValueError("boom")
+
+@job('test_resume')
+def resume_job(ctx, items):
+    done = ctx.checkpoint.get('done', [])
+    for item in items:
+        if item not in done:
+            done.append(item)
+            ctx.report(len(done) / len(items), {'done': done})
+    return done
+
+
+def test_enqueue_eager(session):
+    new_job = enqueue('test_add', a=1, b=2)
+    assert new_job.status == DONE
+    assert new_job.progress == 1.0
+    assert json.loads(new_job.result) == 3
+    assert json.loads(new_job.checkpoint) == {'half': True}
+
+def test_enqueue_unknown_job(session):
+    with pytest.raises(LookupError):
+        enqueue('no_such_job')
+
+def test_failed_job_records_error(session):
+    failed = enqueue('test_fail')
+    assert failed.status == FAILED
+    assert failed.error == "ValueError: boom"
+
+def test_job_is_only_claimed_once(session):
+    new_job = enqueue('test_add', a=1, b=2)
+    assert run_job(new_job.id) is None
+
+def test_stale_job_resumes_from_checkpoint(session):
+    stale = Job(
+        name='test_resume',
+        status=RUNNING,
+        params=json.dumps({'items': [1, 2, 3]}),
+        checkpoint=json.dumps({'done': [1]}),
+        updated=datetime.now() - timedelta(hours=1)
+    )
+    session.add(stale)
+    session.commit()
+    resumed = run_job(stale.id)
+    assert resumed.status == DONE
+    assert json.loads(resumed.result) == [1, 2, 3]
+
+def test_running_job_is_not_resumed(app, session):
+    running = Job(name='test_add', status=RUNNING, params=json.dumps({'a': 1, 'b': 1}))
+    queued = Job(name='test_add', status=QUEUED, params=json.dumps({'a': 1, 'b': 1}))
+    session.add_all([running, queued])
+    session.commit()
+
+    submitted = []
+    runner = JobRunner.__new__(JobRunner)
+    runner.app = app
+    runner.submit = submitted.append
+    assert resume_jobs(runner) == [queued.id]
+
+def test_api_get_job(client, session):
+    new_job = enqueue('test_add', a=2, b=2)
+    response = client.get(f'/jobs/{new_job.id}')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['status'] == DONE
+    assert data['result'] == 4
+
+def test_api_get_job_not_found(client):
+    response = client.get('/jobs/999')
+    assert response.status_code == 404
@@ -0,0 +1,50 @@
+import numpy as np
+
+from flaskr.blueprints.entities import create_entity, link_entities
+from flaskr.graphdata import graph_arrays
+from flaskr.layout import force_layout, graph_layout
+
+
+def test_graph_arrays_collapse_mirrored_rows(session):
+    person = create_entity('person', name="A", content="")
+    location = create_entity('location', name="B", content="", country=None, district=None, town=None)
+    link_entities(person, location, "visited", "was visited by")
+    graph = graph_arrays.state()
+    assert graph.n_nodes == 2
+    assert graph.n_edges == 1
+    assert list(graph.degree()) == [1, 1]
+
+def test_force_layout_edges_are_shorter_than_non_edges():
+    # Two triangles joined by a single edge
+    src = np.array([0, 1, 0, 3, 4, 3, 2])
+    dst = np.array([1, 2, 2, 4, 5, 5, 3])
+    pos = force_layout(6, src, dst, iterations=200, seed=1)
+    assert np.isfinite(pos).all()
+    within = np.linalg.norm(pos[0] - pos[1])
+    across = np.linalg.norm(pos[0] - pos[5])
+    assert within < across
+
+def test_force_layout_sampled_repulsion():
+    rng = np.random.default_rng(0)
+    src = rng.integers(0, 300, 600)
+    dst = rng.integers(0, 300, 600)
+    pos = force_layout(300, src, dst, iterations=10, sample=64)
+    assert pos.shape == (300, 2)
+    assert np.isfinite(pos).all()
+
+def test_layout_is_warm_started(session):
+    people = [create_entity('person', name=f"P{i}", content="") for i in range(5)]
+    for a, b in zip(people, people[1:]):
+        link_entities(a, b, "knows", "knows")
+    before = graph_layout.state().as_dict()
+
+    newcomer = create_entity('person', name="New", content="")
+    link_entities(people[0], newcomer, "knows", "knows")
+    after = graph_layout.state().as_dict()
+
+    assert newcomer.node_id in after
+    moved = [np.hypot(*np.subtract(after[p.node_id], before[p.node_id])) for p in people]
+    # A cool, short refinement only nudges the existing nodes
+    assert max(moved) < 3
+    # And the new node starts beside the node it is linked to
+    assert np.hypot(*np.subtract(after[newcomer.node_id], after[people[0].node_id])) < 3
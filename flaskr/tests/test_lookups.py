@@ -0,0 +1,90 @@
+from flaskr.models import db, Node, Page, Person
+from flaskr.lookups import node_dict, entity_dict, page_dict, lookup_cache
+from flaskr.revisions import bump, GRAPH
+from flaskr.blueprints.entities import create_entity
+from flaskr.blueprints.graph import soft_delete_node
+from flaskr.blueprints.pages import edit_page_content
+
+
+def _stats():
+    return lookup_cache.state().stats()
+
+def test_repeated_lookups_are_cached(session):
+    person = create_entity('person', name="Henry", content="")
+    assert entity_dict(person.node_id)['name'] == "Henry"
+    assert node_dict(person.node_id)['node_type'] == "person"
+    hits = _stats()['hits']
+    assert entity_dict(person.node_id)['name'] == "Henry"
+    assert node_dict(person.node_id)['node_type'] == "person"
+    assert _stats()['hits'] == hits + 2
+    assert node_dict(10 ** 6) is None
+
+def test_commit_invalidates_changed_rows(session):
+    henry = create_entity('person', name="Henry", content="")
+    mary = create_entity('person', name="Mary", content="")
+    entity_dict(henry.node_id), entity_dict(mary.node_id)
+
+    henry.name = "Henry Smith"
+    session.commit()
+    assert entity_dict(henry.node_id)['name'] == "Henry Smith"
+    hits = _stats()['hits']
+    # Mary is still cached
+    entity_dict(mary.node_id)
+    assert _stats()['hits'] == hits + 1
+    assert _stats()['invalidations'] >= 1
+
+def test_set_based_deletes_invalidate(session):
+    person = create_entity('person', name="Henry", content="")
+    assert node_dict(person.node_id)['deleted'] == 0
+    soft_delete_node(db.session.get(Node, person.node_id))
+    assert node_dict(person.node_id)['deleted'] == 1
+    assert entity_dict(person.node_id)['deleted'] == 1
+
+def test_uncommitted_writes_are_not_cached(session):
+    person = create_entity('person', name="Henry", content="")
+    entity_dict(person.node_id)
+
+    person.name = "Not yet"
+    # The session sees its own write, which isn't cached ...
+    assert entity_dict(person.node_id)['name'] == "Not yet"
+    session.rollback()
+    # ... so nothing of it is left after the rollback
+    assert entity_dict(person.node_id)['name'] == "Henry"
+
+def test_page_edits_invalidate(session):
+    page = Page(id=1, page_number=1, content="Old text")
+    session.add(page)
+    session.commit()
+    assert page_dict(1)['content'] == "Old text"
+    edit_page_content(page, "New text")
+    assert page_dict(1)['content'] == "New text"
+
+def test_commits_from_elsewhere_clear_the_cache(session):
+    person = create_entity('person', name="Henry", content="")
+    entity_dict(person.node_id)
+    # Another process renames Henry, which we only see as the graph counter moving
+    session.execute(Person.__table__.update().where(Person.node_id == person.node_id).values(name="Harry"))
+    bump(session.connection(), {GRAPH})
+    session.commit()
+    assert entity_dict(person.node_id)['name'] == "Harry"
+
+def test_cache_is_bounded(app, session):
+    people = [create_entity('person', name=f"Person {i}", content="") for i in range(5)]
+    app.config['LOOKUP_CACHE_SIZE'] = 3
+    lookup_cache.reset()
+    try:
+        for person in people:
+            entity_dict(person.node_id)
+        stats = _stats()
+        assert stats['size'] == 3
+        assert stats['evictions'] == 2
+    finally:
+        app.config.pop('LOOKUP_CACHE_SIZE')
+        lookup_cache.reset()
+
+def test_api_cache_stats(client, session):
+    person = create_entity('person', name="Henry", content="")
+    client.get(f'/graph/node?id={person.node_id}')
+    client.get(f'/graph/node?id={person.node_id}')
+    stats = client.get('/graph/cache').get_json()
+    assert stats['hits'] >= 1 and stats['misses'] >= 1
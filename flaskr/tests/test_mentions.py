@@ -0,0 +1,37 @@
+from flaskr.mentions import Automaton, find_name, fold, index_all_mentions, mention_automaton
+from flaskr.blueprints.entities import create_entity
+from flaskr.models import Mention, Page
+
+
+def test_fold_keeps_offsets():
+    text = "İstanbul and HENRY"
+    assert len(fold(text)) == len(text)
+    assert fold(text).endswith("henry")
+
+def test_automaton_finds_overlapping_names():
+    automaton = Automaton({'henry': {1}, 'henry bolton': {2}, 'bolton': {3}, 'ton': {4}})
+    text = "Then Henry Bolton met henry."
+    matches = sorted(automaton.scan(text))
+    assert matches == [(1, 5, 10), (1, 22, 27), (2, 5, 17), (3, 11, 17)]
+    assert text[5:17] == "Henry Bolton"
+
+def test_automaton_shared_names():
+    automaton = Automaton({'mary': {1, 2}})
+    assert sorted(automaton.scan("Mary")) == [(1, 0, 4), (2, 0, 4)]
+
+def test_find_name_matches_automaton():
+    text = "Hen, Henry, henrys and HENRY."
+    assert find_name("Henry", text) == [(5, 10), (23, 28)]
+    assert sorted((s, e) for _, s, e in Automaton({'henry': {1}}).scan(text)) == find_name("Henry", text)
+
+def test_index_all_mentions(session):
+    session.add_all([Page(id=1, page_number=1, content="Henry went to Leeds."), Page(id=2, page_number=2, content="Leeds again.")])
+    session.flush()
+    henry = create_entity('person', name="Henry", content="")
+    leeds = create_entity('location', name="Leeds", content="", country=None, district=None, town=None)
+    session.query(Mention).delete()
+    assert index_all_mentions() == 3
+    assert {(m.node_id, m.page_id, m.start) for m in Mention.query.all()} == {
+        (henry.node_id, 1, 0), (leeds.node_id, 1, 14), (leeds.node_id, 2, 0)
+    }
+    assert len(mention_automaton.state()) == 2
@@ -0,0 +1,50 @@
+import pytest
+
+from flaskr.models import db
+from flaskr.patterns import parse_pattern, time_limit, InvalidPattern, QueryTimeout
+
+
+def test_parse_path():
+    pattern = parse_pattern('(p:person)-[visited]->(l:location)-[]->(e:event {id: 5})')
+    assert [(n.var, n.type, n.props) for n in pattern.nodes] == [
+        ('p', 'person', {}), ('l', 'location', {}), ('e', 'event', {'id': 5})
+    ]
+    assert [(e.label, e.left, e.right, e.direction) for e in pattern.edges] == [
+        ('visited', 0, 1, 'out'), (None, 1, 2, 'out')
+    ]
+    assert pattern.variables == ['p', 'l', 'e']
+
+def test_parse_links_and_values():
+    pattern = parse_pattern('''(a {name: "Henry \\"H\\" Smith", alive: true})<-[r:"sister of"]-(b), (b)--(), (a)-->(c)''')
+    assert pattern.nodes[0].props == {'name': 'Henry "H" Smith', 'alive': True}
+    assert [(e.var, e.label, e.direction) for e in pattern.edges] == [
+        ('r', 'sister of', 'in'), (None, None, 'both'), (None, None, 'out')
+    ]
+    # Variables name one node wherever they appear
+    assert len(pattern.nodes) == 4
+    assert pattern.variables == ['a', 'r', 'b', 'c']
+
+@pytest.mark.parametrize('text', [
+    '',
+    '(p:person',
+    '(p:dragon)',
+    '(p)<-[x]->(q)',
+    '(p)-[r:]->(r)',
+    '(p:person)-[]->(q), (x)-[]->(y)',
+    '(p {id: "5"})',
+    '(p {name: Henry})',
+    '(p:person)-[r:knows]->(q)-[r:knows]->(s)',
+    '(p:person)-[]->(p:location)',
+    '(a)' + '-->()' * 9,
+])
+def test_invalid_patterns(text):
+    with pytest.raises(InvalidPattern):
+        parse_pattern(text)
+
+def test_time_limit_interrupts_statements(session):
+    endless = db.text("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c")
+    with pytest.raises(QueryTimeout):
+        with time_limit(0.05):
+            db.session.execute(endless)
+    # The connection is usable again afterwards
+    assert db.session.execute(db.text("SELECT 1")).scalar() == 1
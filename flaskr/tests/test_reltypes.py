@@ -0,0 +1,55 @@
+from flaskr.models import Node, Relationship, RelationshipType
+from flaskr.reltypes import relationship_types
+from flaskr.blueprints.graph import create_relationship
+
+
+def _nodes(session, n):
+    nodes = [Node(node_type="person") for _ in range(n)]
+    session.add_all(nodes)
+    session.commit()
+    return nodes
+
+def test_types_are_shared(session):
+    a, b, c = _nodes(session, 3)
+    create_relationship(a.id, b.id, "knows", "is known by")
+    create_relationship(a.id, c.id, "knows", "is known by")
+    assert RelationshipType.query.count() == 1
+    rels = Relationship.query.all()
+    assert len(rels) == 2
+    assert len({r.type_id for r in rels}) == 1
+    assert all(r.rel == "knows" and r.ler == "is known by" for r in rels)
+
+def test_changing_rel_changes_type(session):
+    a, b = _nodes(session, 2)
+    forward, _ = create_relationship(a.id, b.id, "knows", "is known by")
+    forward.rel = "met"
+    session.commit()
+    assert (forward.rel, forward.ler) == ("met", "is known by")
+    assert Relationship.query.filter(Relationship.rel == "met").one().id == forward.id
+    assert Relationship.query.filter_by(ler="is known by").count() == 1
+
+def test_cache_only_holds_committed_types(session):
+    a, b = _nodes(session, 2)
+    session.add(Relationship(start=a.id, end=b.id, rel="visited", ler="was visited by"))
+    assert ("visited", "was visited by") not in relationship_types.state()
+    session.rollback()
+    assert RelationshipType.query.count() == 0
+
+    session.add(Relationship(start=a.id, end=b.id, rel="visited", ler="was visited by"))
+    session.commit()
+    assert ("visited", "was visited by") in relationship_types.state()
+
+def test_api_relationship_types(client, session):
+    a, b, c = _nodes(session, 3)
+    create_relationship(a.id, b.id, "knows", "is known by")
+    create_relationship(a.id, c.id, "knows", "is known by")
+    gone, _ = create_relationship(b.id, c.id, "visited", "was visited by")
+    gone.deleted = 1
+    session.commit()
+
+    data = client.get('/graph/relationship/types').get_json()
+    assert [(d['rel'], d['ler'], d['count']) for d in data] == [
+        ("knows", "is known by", 2), ("visited", "was visited by", 0)
+    ]
+    data = client.get('/graph/relationship/types?include_deleted=1').get_json()
+    assert [d['count'] for d in data] == [2, 1]
@@ -0,0 +1,94 @@
+import random
+
+import numpy as np
+import pytest
+
+from flaskr.textedits import Edit, InvalidEdit, parse_edits, apply_edits, diff_edits, rebase_spans
+
+
+def test_parse_edits_sorts_and_validates():
+    edits = parse_edits([{'start': 5, 'end': 6, 'text': "x"}, {'start': 0, 'end': 1}], 10)
+    assert edits == [Edit(0, 1, ""), Edit(5, 6, "x")]
+    for bad in (None, [], [{'start': 0}], [{'start': 4, 'end': 2}], [{'start': 0, 'end': 11}]):
+        with pytest.raises(InvalidEdit):
+            parse_edits(bad, 10)
+    with pytest.raises(InvalidEdit):
+        parse_edits([{'start': 0, 'end': 5}, {'start': 4, 'end': 6}], 10)
+    with pytest.raises(InvalidEdit):
+        parse_edits([{'start': 3, 'end': 3, 'text': "a"}, {'start': 3, 'end': 3, 'text': "b"}], 10)
+
+def test_adjacent_edits_are_merged():
+    assert parse_edits([{'start': 0, 'end': 2, 'text': "a"}, {'start': 2, 'end': 4, 'text': "b"}], 10) == [Edit(0, 4, "ab")]
+
+def test_apply_edits():
+    text = "The quick brown fox"
+    edits = parse_edits([
+        {'start': 4, 'end': 9, 'text': "slow"},
+        {'start': 10, 'end': 10, 'text': "dark "},
+        {'start': 15, 'end': 19, 'text': ""},
+    ], len(text))
+    assert apply_edits(text, edits) == "The slow dark brown"
+
+def _rebase(spans, edits):
+    rebased, detached = rebase_spans(np.array(spans), edits)
+    return [tuple(span) for span in rebased.tolist()], detached.tolist()
+
+def test_rebase_moves_spans_after_an_edit():
+    # "The quick brown fox" -> "The slow brown fox"
+    edits = [Edit(4, 9, "slow")]
+    assert _rebase([(0, 3), (10, 15), (16, 19)], edits) == ([(0, 3), (9, 14), (15, 18)], [False, False, False])
+
+def test_rebase_keeps_insertions_outside_spans():
+    edits = [Edit(4, 4, "big "), Edit(9, 9, "!")]
+    assert _rebase([(4, 9)], edits) == ([(8, 13)], [False])
+
+def test_rebase_trims_partly_replaced_spans():
+    # A note on "quick brown" when "quick" is corrected
+    edits = [Edit(2, 9, "e sluggish")]
+    assert _rebase([(4, 15)], edits) == ([(12, 18)], [False])
+    # ... and when "brown fox" is deleted from a note on "quick brown"
+    edits = [Edit(10, 19, "")]
+    assert _rebase([(4, 15)], edits) == ([(4, 10)], [False])
+
+def test_rebase_detaches_replaced_spans():
+    text = "The quick brown fox"
+    edits = [Edit(4, 15, "red"), Edit(16, 19, "")]
+    (replaced, deleted), detached = _rebase([(4, 9), (16, 19)], edits)
+    assert detached == [True, True]
+    new = apply_edits(text, edits)
+    # A replaced span covers what replaced it, a deleted one is empty where it was
+    assert new[replaced[0]:replaced[1]] == "red"
+    assert deleted[0] == deleted[1] == len(new)
+
+def test_rebase_keeps_exactly_replaced_spans():
+    # Correcting the OCR of the words a note highlights
+    text = "The qiuck brown fox"
+    edits = [Edit(4, 9, "quick"), Edit(10, 15, "browner"), Edit(16, 19, "")]
+    (quick, brown, fox), detached = _rebase([(4, 9), (10, 15), (16, 19)], edits)
+    new = apply_edits(text, edits)
+    assert new[quick[0]:quick[1]] == "quick"
+    assert new[brown[0]:brown[1]] == "browner"
+    # ... but a deleted one still detaches
+    assert fox[0] == fox[1] == len(new)
+    assert detached == [False, False, True]
+
+def test_rebase_matches_diff():
+    rng = random.Random(7)
+    words = ["alpha", "beta", "gamma", "delta", "epsilon"]
+    old_words = [rng.choice(words) for _ in range(200)]
+    new_words = [w.upper() if rng.random() < 0.1 else w for w in old_words if rng.random() > 0.1]
+    old, new = ' '.join(old_words), ' '.join(new_words)
+    edits = diff_edits(old, new)
+    assert apply_edits(old, edits) == new
+
+    # Every word which survives untouched is still highlighted by its rebased span
+    spans, position = [], 0
+    for word in old_words:
+        spans.append((position, position + len(word)))
+        position += len(word) + 1
+    rebased, detached = rebase_spans(np.array(spans), edits)
+    for (start, end), (new_start, new_end), lost in zip(spans, rebased.tolist(), detached.tolist()):
+        untouched = all(e.end <= start or e.start >= end for e in edits)
+        if untouched:
+            assert new[new_start:new_end] == old[start:end]
+            assert not lost
@@ -0,0 +1,113 @@
+import pytest
+from sqlalchemy import func, select
+
+from flaskr.models import db, Event, Location, Mention, Node, Note, Page, Person, Relationship
+from flaskr.workbook import WorkbookImport, map_rows, open_workbook
+from flaskr.blueprints.entities import create_entity
+
+
+def _pages(session, count=2):
+    for n in range(1, count + 1):
+        session.add(Page(id=n, page_number=n, content=f"Henry went to Paris on page {n}."))
+    session.commit()
+
+def _count(model):
+    return db.session.scalar(select(func.count()).select_from(model))
+
+SHEETS = {
+    'people': [("Name", "Notes", "Gender"), ("Henry", "The narrator", "M"), ("Mary", None, "F")],
+    'locations': [("Name", "Country", "Town"), ("Paris", "France", "Paris")],
+    'events': [("Name", "Date"), ("The trip", "1920-05-01")],
+    'notes': [("Page", "Note", "Start", "End"), (1, "Henry arrives", 0, 5), (99, "Nowhere", None, None)],
+    'links': [
+        ("From", "Relationship", "Reverse", "To"),
+        ("Henry", "Visited", "Visited by", "Paris"),
+        ("Mary", "Sister", None, "Henry"),
+        ("Henry", "Knows", None, "Nobody"),
+    ],
+}
+
+def test_map_rows_uses_the_heading_row():
+    rows = [("Page Number", "Quote", "Ignored"), (3, "Text", "x"), (None, None, None)]
+    assert list(map_rows('notes', rows)) == [(2, {'page': 3, 'note_text': "Text"})]
+
+def test_imports_every_sheet(session):
+    _pages(session)
+    report = WorkbookImport().run(SHEETS)
+
+    assert report['people']['created'] == 2
+    henry = db.session.execute(select(Person).where(Person.name == "Henry")).scalar_one()
+    assert henry.content == "The narrator" and henry.gender == "M"
+    assert db.session.get(Node, henry.node_id).node_type == 'person'
+    assert db.session.execute(select(Location.country)).scalar() == "France"
+    assert db.session.execute(select(Event.date)).scalar().year == 1920
+
+    assert report['notes']['created'] == 1
+    assert report['notes']['issues'] == [{'row': 3, 'reason': "there is no page 99"}]
+    note = db.session.execute(select(Note)).scalar_one()
+    assert (note.page_number, note.text_start, note.text_end) == (1, 0, 5)
+
+    assert report['links']['created'] == 2
+    assert report['links']['skipped'] == 1
+    assert "Nobody" in report['links']['issues'][0]['reason']
+    # A missing reverse relationship reads the same both ways
+    sister = db.session.execute(select(Relationship).where(Relationship.start != henry.node_id)).scalar_one()
+    assert (sister.type.rel, sister.type.ler) == ("Sister", "Sister")
+    # Names of new entities are found on the pages
+    assert _count(Mention) > 0
+
+def test_names_resolve_to_existing_entities(session):
+    _pages(session)
+    henry = create_entity('person', name="Henry", content="")
+    create_entity('location', name="Henry", content="A town", country=None, district=None, town=None)
+    sheets = {
+        'people': [("Name",), ("  henry ",)],
+        'links': [("From", "Relationship", "To"), ("person: Henry", "Lives in", "location:henry"), ("Henry", "Knows", "Mary")],
+    }
+    report = WorkbookImport().run(sheets)
+    assert report['people'] == {'rows': 1, 'created': 0, 'existing': 1, 'skipped': 0, 'issues': []}
+    assert report['links']['created'] == 1
+    assert "more than one" in report['links']['issues'][0]['reason']
+    assert db.session.execute(select(Relationship.start)).scalar() == henry.node_id
+
+def test_importing_twice_creates_nothing(session):
+    _pages(session)
+    WorkbookImport().run(SHEETS)
+    counts = [_count(model) for model in (Node, Person, Note, Relationship)]
+    report = WorkbookImport().run(SHEETS)
+    assert [_count(model) for model in (Node, Person, Note, Relationship)] == counts
+    assert report['notes']['existing'] == 1
+    assert report['links']['existing'] == 2
+
+def test_dry_run_writes_nothing(session):
+    _pages(session)
+    report = WorkbookImport(dry_run=True).run(SHEETS)
+    # Links between entities the workbook would create are still resolved
+    assert report['people']['created'] == 2
+    assert report['links']['created'] == 2
+    assert _count(Node) == 0 and _count(Relationship) == 0
+
+def test_cli(runner, tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    workbook.active.title = "People"
+    for row in SHEETS['people']:
+        workbook.active.append(row)
+    path = tmp_path / 'notes.xlsx'
+    workbook.save(path)
+
+    with open_workbook(path) as sheets:
+        assert list(sheets) == ['people']
+    result = runner.invoke(args=['import-workbook', str(path), '--dry-run'])
+    assert "people: 2 rows, would create 2" in result.output
+    result = runner.invoke(args=['import-workbook', str(path)])
+    assert "people: 2 rows, created 2" in result.output
+
+def test_large_workbook_imports_quickly(session):
+    _pages(session)
+    people = [("Name",)] + [(f"Person {i}",) for i in range(20_000)]
+    notes = [("Page", "Note")] + [(1 + i % 2, f"Note {i}") for i in range(20_000)]
+    links = [("From", "Relationship", "To")] + [(f"Person {i}", "Knows", f"Person {i + 1}") for i in range(10_000)]
+
+    report = WorkbookImport().run({'people': people, 'notes': notes, 'links': links})
+    assert [report[sheet]['created'] for sheet in ('people', 'notes', 'links')] == [20_000, 20_000, 10_000]
@@ -0,0 +1,119 @@
+import pytest
+
+from flaskr import create_app
+from flaskr.models import db, Page, User, Person
+from flaskr.workspaces import get_workspaces
+
+
+# Workspaces are separate database files, so these tests use their own app on temporary files
+# rather than the shared in-memory database
+@pytest.fixture
+def workspace_app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'main.db'}",
+        'WORKSPACES_ENABLED': True,
+        'WORKSPACE_DIR': str(tmp_path / 'workspaces'),
+        'JOBS_EAGER': True,
+    })
+    with app.app_context():
+        db.create_all()
+        db.session.add(Page(id=1, page_number=1, content="Shared page text"))
+        db.session.add_all([User(username='alice', password='x'), User(username='bob', password='x')])
+        db.session.commit()
+    yield app
+    with app.app_context():
+        get_workspaces().dispose_all()
+        db.engine.dispose()
+
+def _create_person(client, workspace, name):
+    return client.post('/people/create', json={'name': name, 'content': "", 'gender': ""}, headers={'X-Workspace': workspace})
+
+def test_workspaces_are_separate(workspace_app):
+    client = workspace_app.test_client()
+    assert _create_person(client, 'alice', "Henry").status_code == 200
+    assert _create_person(client, 'bob', "Mary").status_code == 200
+
+    def names(workspace=None):
+        headers = {'X-Workspace': workspace} if workspace else {}
+        nodes = client.get('/vis/graph', headers=headers).get_json()['nodes']
+        return [node['entity']['name'] for node in nodes]
+    assert names('alice') == ["Henry"]
+    assert names('bob') == ["Mary"]
+    assert names() == []
+
+    with workspace_app.app_context():
+        assert Person.query.count() == 0
+        assert get_workspaces().path(1).exists()
+
+def test_pages_are_shared_and_read_only(workspace_app):
+    client = workspace_app.test_client()
+    response = client.get('/page/?page=1', headers={'X-Workspace': 'alice'})
+    assert response.text == "Shared page text"
+    assert 'X-Workspace' in response.headers['Vary']
+
+    response = client.put('/page/update?page=1', json={'content': "Changed"}, headers={'X-Workspace': 'alice'})
+    assert response.status_code == 403
+    response = client.patch('/page/patch?page=1', json={'edits': [{'start': 0, 'end': 1}]}, headers={'X-Workspace': 'alice'})
+    assert response.status_code == 403
+
+def test_page_etags_follow_the_shared_page(workspace_app):
+    client = workspace_app.test_client()
+    alice = client.get('/page/?page=1', headers={'X-Workspace': 'alice'}).headers['ETag']
+    assert client.get('/page/?page=1', headers={'X-Workspace': 'bob'}).headers['ETag'] != alice
+
+    client.put('/page/update?page=1', json={'content': "Edited in the main database"})
+    response = client.get('/page/?page=1', headers={'X-Workspace': 'alice', 'If-None-Match': alice})
+    assert response.status_code == 200
+    assert response.text == "Edited in the main database"
+
+def test_notes_on_shared_pages(workspace_app):
+    client = workspace_app.test_client()
+    response = client.post('/note/create', json={'page_number': 1, 'note_text': "Shared", 'content': "Alice's note"}, headers={'X-Workspace': 'alice'})
+    assert response.status_code == 200
+    assert len(client.get('/note/on-page?id=1', headers={'X-Workspace': 'alice'}).get_json()) == 1
+    assert client.get('/note/on-page?id=1', headers={'X-Workspace': 'bob'}).get_json() == []
+
+def test_page_edits_rebase_every_workspace(workspace_app):
+    client = workspace_app.test_client()
+    alice = {'X-Workspace': 'alice'}
+    note = client.post('/note/create', json={
+        'page_number': 1, 'note_text': "page", 'content': "", 'text_start': 7, 'text_end': 11
+    }, headers=alice).get_json()
+    _create_person(client, 'alice', "page")
+    etag = client.get('/note/on-page?id=1', headers=alice).headers['ETag']
+
+    response = client.patch('/page/patch?page=1', json={'edits': [{'start': 0, 'end': 0, 'text': "The "}]})
+    assert response.status_code == 200
+    content = client.get('/page/?page=1', headers=alice).text
+    assert content == "The Shared page text"
+
+    notes = client.get('/note/on-page?id=1', headers=alice)
+    assert notes.headers['ETag'] != etag
+    (moved,) = notes.get_json()
+    assert moved['id'] == note['id'] and content[moved['text_start']:moved['text_end']] == "page"
+    mentions = client.get('/page/1/mentions', headers=alice).get_json()
+    assert [content[m['start']:m['end']] for m in mentions] == ["page"]
+
+def test_unknown_workspace(workspace_app):
+    client = workspace_app.test_client()
+    assert client.get('/page/?page=1', headers={'X-Workspace': 'carol'}).status_code == 404
+
+def test_idle_engines_are_evicted(workspace_app):
+    client = workspace_app.test_client()
+    _create_person(client, 'alice', "Henry")
+    _create_person(client, 'bob', "Mary")
+    engines = get_workspaces(workspace_app)
+    assert engines.open_workspaces() == ['alice', 'bob']
+
+    engines.idle_seconds = 0
+    assert engines.evict_idle() == 2
+    assert engines.open_workspaces() == []
+    # Reopened on next use, with the data still there
+    engines.idle_seconds = 300
+    nodes = client.get('/vis/graph', headers={'X-Workspace': 'alice'}).get_json()['nodes']
+    assert [node['entity']['name'] for node in nodes] == ["Henry"]
+
+    engines.max_open = 1
+    client.get('/vis/graph', headers={'X-Workspace': 'bob'})
+    assert engines.open_workspaces() == ['bob']
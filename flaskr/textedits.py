@@ -0,0 +1,141 @@
+"""
+Character-range edits to a page's text, and moving offsets into the old text onto the new text.
+
+An edit replaces old[start:end] with `text`.  Every edit in a batch is given against the text as
+it was before any of them, so the client doesn't have to adjust later edits for earlier ones, and
+no two edits may overlap.  start == end inserts text, text == "" deletes it.
+
+Notes anchor themselves with text_start/text_end offsets, which are rebased after each edit:
+
+    - an offset before an edit is unchanged, one after it moves by the change in length
+    - text inserted exactly at a note's start or end is kept outside the note
+    - an offset inside replaced text is moved to the edge of the replacement which keeps the
+      least of it in the note
+    - a note whose span is exactly the replaced text, e.g. an OCR correction of the words it
+      highlights, covers the replacement and stays attached, unless the text was deleted
+    - a note whose span lay within a larger replacement is left covering the replacement, which
+      is empty for a deletion, and reported as detached since it no longer points at what it
+      was written about
+"""
+import difflib
+from dataclasses import dataclass
+
+import numpy as np
+
+
+class InvalidEdit(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Edit:
+    start: int
+    end: int
+    text: str
+
+
+def parse_edits(data, length: int) -> list[Edit]:
+    """
+    Edits from a request body, [{start, end, text}], in text order.
+    Raises:
+        InvalidEdit: if an edit is malformed, out of range or overlaps another
+    """
+    if not isinstance(data, list) or not data:
+        raise InvalidEdit("Must provide a list of edits, e.g. [{start, end, text}]")
+    edits = []
+    for item in data:
+        try:
+            edit = Edit(int(item['start']), int(item['end']), str(item.get('text') or ''))
+        except (TypeError, KeyError, ValueError):
+            raise InvalidEdit(f"Each edit needs a start, an end and optionally text: {item}")
+        if not 0 <= edit.start <= edit.end <= length:
+            raise InvalidEdit(f"Edit {edit.start}-{edit.end} is outside the page (0-{length})")
+        edits.append(edit)
+
+    edits.sort(key=lambda e: (e.start, e.end))
+    for before, after in zip(edits, edits[1:]):
+        # Two insertions at the same point would have no defined order
+        if after.start < before.end or after.start == before.start:
+            raise InvalidEdit(f"Edits {before.start}-{before.end} and {after.start}-{after.end} overlap")
+    return _merge_adjacent(edits)
+
+def _merge_adjacent(edits: list[Edit]) -> list[Edit]:
+    # Edits which touch are one replacement, so a note spanning both is seen to be replaced whole
+    merged = []
+    for edit in edits:
+        if merged and merged[-1].end == edit.start:
+            merged[-1] = Edit(merged[-1].start, edit.end, merged[-1].text + edit.text)
+        else:
+            merged.append(edit)
+    return merged
+
+def apply_edits(text: str, edits: list[Edit]) -> str:
+    """The text with every edit made.  `edits` must be in text order, as from parse_edits."""
+    pieces, position = [], 0
+    for edit in edits:
+        pieces.append(text[position:edit.start])
+        pieces.append(edit.text)
+        position = edit.end
+    pieces.append(text[position:])
+    return ''.join(pieces)
+
+def diff_edits(old: str, new: str) -> list[Edit]:
+    """The edits which turn old into new, for callers which only have the new text"""
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    return _merge_adjacent([
+        Edit(i1, i2, new[j1:j2])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal'
+    ])
+
+
+def rebase_spans(spans: np.ndarray, edits: list[Edit]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Move (start, end) spans in the old text onto the text after `edits`.
+
+    All the offsets are looked up against the edits at once: each is placed among the sorted
+    edit starts with one searchsorted, and the length change of every edit before it comes from
+    a cumulative sum, rather than walking the edits for each span.
+
+    Args:
+        spans: An (n, 2) integer array of [start, end) spans.
+        edits: The edits in text order, as from parse_edits.
+    Returns:
+        The (n, 2) rebased spans, and a boolean array marking the spans which lost what they
+        pointed at: those deleted, or inside a larger replacement.
+    """
+    spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+    if not edits or not len(spans):
+        return spans.copy(), np.zeros(len(spans), dtype=bool)
+
+    starts = np.array([e.start for e in edits], dtype=np.int64)
+    ends = np.array([e.end for e in edits], dtype=np.int64)
+    lengths = np.array([len(e.text) for e in edits], dtype=np.int64)
+    # shift[k] is the change in length made by the first k edits
+    shift = np.concatenate(([0], np.cumsum(lengths - (ends - starts))))
+
+    def rebase(offsets, side):
+        # The k edits which start at or before (right) / strictly before (left) each offset have
+        # all been passed, except that the last of them may still contain it
+        k = np.searchsorted(starts, offsets, side=side)
+        last = np.maximum(k - 1, 0)
+        inside = (k > 0) & (offsets < ends[last])
+        return offsets + shift[k], inside, last
+
+    # A start in replaced text moves to the end of the replacement, an end to its beginning
+    new_starts, start_inside, start_edit = rebase(spans[:, 0], 'right')
+    new_starts = np.where(start_inside, starts[start_edit] + shift[start_edit] + lengths[start_edit], new_starts)
+    new_ends, end_inside, end_edit = rebase(spans[:, 1], 'left')
+    new_ends = np.where(end_inside, starts[end_edit] + shift[end_edit], new_ends)
+
+    # Any character of the span which survived would keep it from collapsing
+    detached = (spans[:, 0] < spans[:, 1]) & (new_starts >= new_ends)
+    rebased = np.stack((np.minimum(new_starts, new_ends), np.maximum(new_starts, new_ends)), axis=1)
+
+    # A span lying within one edit covers its replacement.  If it was exactly the replaced text
+    # the replacement is a correction of what the note points at, so only a deletion detaches it.
+    within = start_inside & (spans[:, 1] <= ends[start_edit]) & (spans[:, 0] < spans[:, 1])
+    replaced_at = starts[start_edit] + shift[start_edit]
+    rebased[within] = np.stack((replaced_at, replaced_at + lengths[start_edit]), axis=1)[within]
+    exact = within & (spans[:, 0] == starts[start_edit]) & (spans[:, 1] == ends[start_edit])
+    detached = np.where(exact, lengths[start_edit] == 0, detached)
+    return rebased, detached
@@ -0,0 +1,368 @@
+"""
+Import of the research workbook, notes.xlsx, which the OCR notebook (data/data_notebook.ipynb)
+writes and the group keeps its people, places, events, notes and links in.
+
+    flask import-workbook notes.xlsx --dry-run
+
+Sheets are found by name, ignoring case, and imported in this order so that links can name
+anything created by the same import.  The first row of a sheet names its columns:
+
+    people     name, content, gender
+    locations  name, content, country, district, town
+    events     name, content, date
+    notes      page, note_text, content, text_start, text_end
+    links      from, relationship, reverse, to
+
+Other sheets (e.g. the notebook's text_files) and other columns are ignored.  Names are matched
+ignoring case and spacing, against every live entity and those created earlier in the import.
+A person, location or event whose name its type already has is left alone, as is a note with
+the same page, text and highlight as a live one, so importing the same workbook twice creates
+nothing new.  In links, a name which more than one entity has can
+be qualified with a type, e.g. "person: Henry".  Rows which can't be imported are skipped and
+listed in the report with the reason.
+
+Rows are streamed with openpyxl in read-only mode, which the `ocr` extra installs, and inserted
+with one multi-row INSERT per table for each batch of rows, committing after every batch.  A dry
+run resolves everything in the same way, reports what it would do and writes nothing.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from sqlalchemy import insert, select
+
+from .models import db, Node, Note, Page, Person, Location, Event, Relationship
+from .changes import record_rows, CREATED
+from .mentions import normalise_name, index_all_mentions
+from .reltypes import relationship_types
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+ENTITY_MODELS = {'person': Person, 'location': Location, 'event': Event}
+
+# Sheet -> the names it may have
+SHEETS = {
+    'people': ('people', 'persons', 'characters'),
+    'locations': ('locations', 'places'),
+    'events': ('events',),
+    'notes': ('notes',),
+    'links': ('links', 'relationships'),
+}
+# Sheet -> field -> the column headings it may have
+COLUMNS = {
+    'people': {'name': ('name',), 'content': ('content', 'notes', 'description'), 'gender': ('gender',)},
+    'locations': {
+        'name': ('name',), 'content': ('content', 'notes', 'description'),
+        'country': ('country',), 'district': ('district',), 'town': ('town',)
+    },
+    'events': {'name': ('name',), 'content': ('content', 'notes', 'description'), 'date': ('date',)},
+    'notes': {
+        'page': ('page', 'page_number'), 'note_text': ('note_text', 'note', 'quote', 'text'),
+        'content': ('content', 'comment'), 'text_start': ('text_start', 'start'), 'text_end': ('text_end', 'end')
+    },
+    'links': {
+        'from': ('from', 'source'), 'rel': ('relationship', 'rel'),
+        'ler': ('reverse', 'reverse_relationship', 'ler'), 'to': ('to', 'target')
+    },
+}
+SHEET_TYPES = {'people': 'person', 'locations': 'location', 'events': 'event'}
+MAX_ISSUES = 50
+
+
+def _heading(value) -> str:
+    return '_'.join(str(value or '').strip().lower().split())
+
+def map_rows(sheet: str, rows):
+    """(row number, {field: value}) for each row after the heading row, with the sheet's fields"""
+    rows = iter(rows)
+    headings = [_heading(value) for value in next(rows, ())]
+    columns = {}
+    for field, names in COLUMNS[sheet].items():
+        for i, heading in enumerate(headings):
+            if heading in names:
+                columns[field] = i
+                break
+    for number, row in enumerate(rows, start=2):
+        values = {field: row[i] if i < len(row) else None for field, i in columns.items()}
+        if any(value not in (None, '') for value in values.values()):
+            yield number, values
+
+@contextmanager
+def open_workbook(path):
+    """The workbook's sheets we know, as {sheet: rows}, each row a tuple of cell values"""
+    if openpyxl is None:
+        raise RuntimeError("Reading workbooks needs openpyxl: pip install flaskr[ocr]")
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheets = {}
+        for worksheet in workbook.worksheets:
+            for sheet, names in SHEETS.items():
+                if _heading(worksheet.title) in names and sheet not in sheets:
+                    sheets[sheet] = worksheet.iter_rows(values_only=True)
+        yield sheets
+    finally:
+        workbook.close()
+
+
+def _text(value) -> str | None:
+    if value is None:
+        return None
+    text = str(value).strip()
+    return text or None
+
+def _int(value) -> int | None:
+    if value in (None, ''):
+        return None
+    return int(float(value))
+
+def _date(value) -> datetime | None:
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, datetime.min.time())
+    return datetime.fromisoformat(str(value).strip())
+
+
+class SheetReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.existing = 0
+        self.skipped = 0
+        self.issues = []
+
+    def skip(self, row: int, reason: str):
+        self.skipped += 1
+        if len(self.issues) < MAX_ISSUES:
+            self.issues.append((row, reason))
+
+    def as_dict(self) -> dict:
+        return {
+            'rows': self.rows, 'created': self.created, 'existing': self.existing,
+            'skipped': self.skipped, 'issues': [{'row': row, 'reason': reason} for row, reason in self.issues]
+        }
+
+
+class WorkbookImport:
+    """
+    One import.  Holds every live entity name, the linked pairs of nodes and the live notes in
+    memory so rows are resolved without a query each.
+    """
+    def __init__(self, dry_run: bool = False, batch_size: int = 2000):
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.report = {}
+        # normalised name -> node type -> node ids
+        self.names = defaultdict(lambda: defaultdict(list))
+        self.pairs = set()
+        # (page_number, note_text, text_start, text_end) of each note
+        self.notes = set()
+        self.pages = set()
+        self._placeholder = 0
+        self._load()
+
+    def _load(self):
+        session = db.session
+        for node_type, model in ENTITY_MODELS.items():
+            rows = session.execute(
+                select(model.node_id, model.name).join(Node, Node.id == model.node_id)
+                .where(model.deleted.is_not(1), Node.deleted.is_not(1), Node.merged.is_(None))
+            )
+            for node_id, name in rows:
+                self.names[normalise_name(name)][node_type].append(node_id)
+        # One link per pair of nodes, whichever way round, as graph._create_relationship insists
+        for start, end in session.execute(select(Relationship.start, Relationship.end)):
+            self.pairs.add(frozenset((start, end)))
+        self.pages = set(session.execute(select(Page.page_number)).scalars())
+        self.notes = {
+            tuple(row) for row in session.execute(
+                select(Note.page_number, Note.note_text, Note.text_start, Note.text_end).where(Note.deleted.is_not(1))
+            )
+        }
+
+    def _sheet(self, sheet: str) -> SheetReport:
+        return self.report.setdefault(sheet, SheetReport())
+
+    def _insert(self, model, rows: list[dict]) -> list[dict]:
+        """Insert rows in one statement, returning them with their ids, in order"""
+        if self.dry_run:
+            for row in rows:
+                self._placeholder -= 1
+                row['id'] = self._placeholder
+            return rows
+        stmt = insert(model).returning(*model.__table__.columns, sort_by_parameter_order=True)
+        return [dict(row._mapping) for row in db.session.execute(stmt, rows)]
+
+    def _insert_nodes(self, node_type: str, count: int) -> list[dict]:
+        return self._insert(Node, [{'node_type': node_type} for _ in range(count)])
+
+    def _commit(self, rows_by_table: dict[str, list[dict]]):
+        if self.dry_run:
+            return
+        # The inserts bypass the unit of work, so describe them for the change feed
+        record_rows(db.session, CREATED, rows_by_table)
+        db.session.commit()
+
+    def resolve(self, name) -> tuple[int | None, str | None]:
+        """The node id of a named entity, or None and the reason it can't be found"""
+        text = _text(name)
+        if text is None:
+            return None, "no name given"
+        node_type, _, rest = text.partition(':')
+        if rest and node_type.strip().lower() in ENTITY_MODELS:
+            candidates = self.names.get(normalise_name(rest), {}).get(node_type.strip().lower(), [])
+        else:
+            candidates = [node_id for ids in self.names.get(normalise_name(text), {}).values() for node_id in ids]
+        if not candidates:
+            return None, f"no entity called '{text}'"
+        if len(candidates) > 1:
+            return None, f"more than one entity is called '{text}', qualify it with its type, e.g. 'person: {text}'"
+        return candidates[0], None
+
+    def _batches(self, rows, report: SheetReport, prepare):
+        """Prepared rows in batches.  `prepare` returns a row's values, or None with a reason to skip it."""
+        batch = []
+        for number, values in rows:
+            report.rows += 1
+            prepared, reason = prepare(values)
+            if prepared is None:
+                if reason is None:
+                    report.existing += 1
+                else:
+                    report.skip(number, reason)
+                continue
+            batch.append(prepared)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def import_entities(self, sheet: str, rows):
+        node_type = SHEET_TYPES[sheet]
+        model = ENTITY_MODELS[node_type]
+        report = self._sheet(sheet)
+        pending = set()
+
+        def prepare(values):
+            name = _text(values.get('name'))
+            if name is None:
+                return None, "no name given"
+            key = normalise_name(name)
+            if self.names.get(key, {}).get(node_type) or key in pending:
+                return None, None
+            row = {'name': name, 'content': _text(values.get('content')) or ''}
+            for field in ('gender', 'country', 'district', 'town'):
+                if field in values:
+                    row[field] = _text(values[field])
+            if 'date' in values:
+                try:
+                    row['date'] = _date(values['date'])
+                except ValueError:
+                    return None, f"'{values['date']}' isn't a date, expected YYYY-MM-DD"
+            pending.add(key)
+            return row, None
+
+        for batch in self._batches(rows, report, prepare):
+            nodes = self._insert_nodes(node_type, len(batch))
+            for row, node in zip(batch, nodes):
+                row['node_id'] = node['id']
+            entities = self._insert(model, batch)
+            self._commit({'nodes': nodes, model.__tablename__: entities})
+            for entity in entities:
+                self.names[normalise_name(entity['name'])][node_type].append(entity['node_id'])
+            report.created += len(entities)
+            pending.clear()
+
+    def import_notes(self, rows):
+        report = self._sheet('notes')
+
+        def prepare(values):
+            try:
+                page = _int(values.get('page'))
+                start, end = _int(values.get('text_start')), _int(values.get('text_end'))
+            except ValueError:
+                return None, "page, text_start and text_end must be numbers"
+            if page not in self.pages:
+                return None, f"there is no page {values.get('page')}"
+            note_text = _text(values.get('note_text'))
+            if note_text is None:
+                return None, "no note text given"
+            if start is None or end is None or start >= end:
+                start = end = None
+            key = (page, note_text, start, end)
+            if key in self.notes:
+                return None, None
+            self.notes.add(key)
+            return {
+                'page_number': page, 'note_text': note_text, 'content': _text(values.get('content')) or '',
+                'text_start': start, 'text_end': end
+            }, None
+
+        for batch in self._batches(rows, report, prepare):
+            nodes = self._insert_nodes('note', len(batch))
+            for row, node in zip(batch, nodes):
+                row['node_id'] = node['id']
+            notes = self._insert(Note, batch)
+            self._commit({'nodes': nodes, 'notes': notes})
+            report.created += len(notes)
+
+    def import_links(self, rows):
+        report = self._sheet('links')
+        types = {}
+
+        def prepare(values):
+            rel = _text(values.get('rel'))
+            if rel is None:
+                return None, "no relationship given"
+            ler = _text(values.get('ler')) or rel
+            start, reason = self.resolve(values.get('from'))
+            if start is None:
+                return None, reason
+            end, reason = self.resolve(values.get('to'))
+            if end is None:
+                return None, reason
+            if start == end:
+                return None, "an entity can't be linked to itself"
+            pair = frozenset((start, end))
+            if pair in self.pairs:
+                return None, None
+            self.pairs.add(pair)
+            return {'start': start, 'end': end, 'type': (rel, ler)}, None
+
+        for batch in self._batches(rows, report, prepare):
+            for row in batch:
+                key = row.pop('type')
+                if key not in types:
+                    types[key] = None if self.dry_run else relationship_types.resolve(*key).id
+                row['type_id'] = types[key]
+            links = self._insert(Relationship, batch)
+            self._commit({'relationships': links})
+            report.created += len(links)
+
+    def run(self, sheets: dict) -> dict:
+        """Import every sheet there is, in order.  Returns the report."""
+        for sheet in ('people', 'locations', 'events'):
+            if sheet in sheets:
+                self.import_entities(sheet, map_rows(sheet, sheets[sheet]))
+        if 'notes' in sheets:
+            self.import_notes(map_rows('notes', sheets['notes']))
+        if 'links' in sheets:
+            self.import_links(map_rows('links', sheets['links']))
+
+        created = sum(self.report[sheet].created for sheet in SHEET_TYPES if sheet in self.report)
+        if created and not self.dry_run:
+            # New names may be anywhere in the book.  One pass over the pages finds them all
+            index_all_mentions()
+            db.session.commit()
+        return {sheet: report.as_dict() for sheet, report in self.report.items()}
+
+
+def import_workbook(path, dry_run: bool = False, batch_size: int = 2000) -> dict:
+    with open_workbook(path) as sheets:
+        return WorkbookImport(dry_run, batch_size).run(sheets)
@@ -0,0 +1,193 @@
+"""
+Workspaces: a separate SQLite database for each user or team, so one group's writes never wait
+on another group's lock.
+
+With WORKSPACES_ENABLED, a request which names a workspace in the X-Workspace header, e.g.
+`X-Workspace: alice`, reads and writes that workspace's database.  A workspace is a row in
+the `user` table of the main database, and its file is WORKSPACE_DIR/<user id>.sqlite.  Requests
+without the header use the main database as before.  The header only chooses a database, it is
+not a login.
+
+The book itself is shared.  Each workspace connection attaches the main database (or
+WORKSPACE_CORPUS) read only, and workspace files don't have the shared tables, so SQLite
+resolves `pages` and `page_tokens` to the attached copy.  Pages can't be edited from a workspace,
+and an edit in the main database rebases the notes and mentions of every workspace (see pages.py).
+
+Engines are opened on first use and kept in a small cache.  One which hasn't been used for
+WORKSPACE_IDLE_SECONDS, or the least recently used beyond WORKSPACE_MAX_OPEN, is disposed of,
+closing its pooled connections.  An engine still in use by a request keeps working: disposing
+only stops the pool reusing its connections.
+
+New workspace files are created with the current schema (`flask create-workspace`).  Migrations
+only run against the main database.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import click
+from flask import current_app, g, has_app_context, request
+from flask.cli import with_appcontext
+from sqlalchemy import create_engine, event, select
+from werkzeug.exceptions import abort
+from werkzeug.security import generate_password_hash
+
+from .models import db, User
+
+WORKSPACE_HEADER = 'X-Workspace'
+# Tables which only exist in the main database and are read through the attached copy
+SHARED_TABLES = ('pages', 'page_tokens', 'user')
+
+
+def current_workspace() -> str | None:
+    """The name of the workspace the current request or job is working in, if any"""
+    return g.get('workspace') if has_app_context() else None
+
+def workspace_tables():
+    return [table for table in db.metadata.sorted_tables if table.name not in SHARED_TABLES]
+
+
+class WorkspaceEngines:
+    """The open engine of each workspace, disposed of once idle"""
+    def __init__(self, app):
+        self.directory = Path(app.config.get('WORKSPACE_DIR') or os.path.join(app.instance_path, 'workspaces'))
+        self.idle_seconds = app.config.get('WORKSPACE_IDLE_SECONDS', 300)
+        self.max_open = app.config.get('WORKSPACE_MAX_OPEN', 64)
+        self.corpus = app.config.get('WORKSPACE_CORPUS')
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _corpus_uri(self) -> str:
+        path = self.corpus or db.engines[None].url.database
+        return Path(path).resolve().as_uri() + '?mode=ro'
+
+    def path(self, user_id: int) -> Path:
+        return self.directory / f'{user_id}.sqlite'
+
+    def create(self, user_id: int) -> Path:
+        """Create a workspace's file with every table but the shared ones"""
+        path = self.path(user_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Without the corpus attached, so existing tables there can't be mistaken for ours
+        engine = create_engine(f'sqlite:///{path}')
+        try:
+            db.metadata.create_all(engine, tables=workspace_tables())
+        finally:
+            engine.dispose()
+        return path
+
+    def _open(self, user_id: int):
+        path = self.path(user_id)
+        if not path.exists():
+            self.create(user_id)
+        # uri=True lets the ATTACH below open the corpus read only
+        engine = create_engine(f'sqlite:///{path}', connect_args={'uri': True})
+        corpus = self._corpus_uri()
+
+        @event.listens_for(engine, 'connect')
+        def attach_corpus(dbapi_connection, connection_record):
+            dbapi_connection.execute("ATTACH DATABASE ? AS corpus", (corpus,))
+
+        return engine
+
+    def get(self, name: str):
+        """The engine for a workspace, opening it if needed.  None if there is no such workspace."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._engines.get(name)
+            if entry is None:
+                user_id = db.session.execute(
+                    select(User.id).where(User.username == name), bind_arguments={'bind': db.engines[None]}
+                ).scalar()
+                if user_id is None:
+                    return None
+                entry = self._engines[name] = [self._open(user_id), now]
+            else:
+                entry[1] = now
+                self._engines.move_to_end(name)
+            evicted = self._evict(now)
+        for engine in evicted:
+            engine.dispose()
+        return entry[0]
+
+    def _evict(self, now: float) -> list:
+        # Least recently used first, so stop at the first engine which is still wanted
+        evicted = []
+        for name, (engine, last_used) in list(self._engines.items()):
+            if now - last_used <= self.idle_seconds and len(self._engines) <= self.max_open:
+                break
+            del self._engines[name]
+            evicted.append(engine)
+        return evicted
+
+    def evict_idle(self) -> int:
+        """Dispose of every idle engine now, e.g. from a periodic task.  Returns how many were closed."""
+        with self._lock:
+            evicted = self._evict(time.monotonic())
+        for engine in evicted:
+            engine.dispose()
+        return len(evicted)
+
+    def names(self) -> list[str]:
+        """Every workspace which has a database file, whether or not it is open"""
+        users = db.session.execute(select(User.id, User.username), bind_arguments={'bind': db.engines[None]})
+        return [name for user_id, name in users if self.path(user_id).exists()]
+
+    def open_workspaces(self) -> list[str]:
+        with self._lock:
+            return list(self._engines)
+
+    def dispose_all(self):
+        with self._lock:
+            engines = [engine for engine, _ in self._engines.values()]
+            self._engines.clear()
+        for engine in engines:
+            engine.dispose()
+
+
+def get_workspaces(app=None) -> WorkspaceEngines:
+    app = app or current_app._get_current_object()
+    return app.extensions['workspaces']
+
+def use_workspace(name: str | None):
+    """Route the current app context's queries to a workspace, or to the main database for None"""
+    engine = None
+    if name is not None:
+        engine = get_workspaces().get(name)
+        if engine is None:
+            abort(404, f"There is no workspace called {name}")
+    g.workspace = name
+    g.workspace_engine = engine
+
+
+def _select_workspace():
+    use_workspace(request.headers.get(WORKSPACE_HEADER) or None)
+
+def _vary_on_workspace(response):
+    # The same URL gives a different response in each workspace
+    response.vary.add(WORKSPACE_HEADER)
+    return response
+
+
+@click.command('create-workspace')
+@with_appcontext
+@click.argument('name')
+@click.password_option()
+def create_workspace_command(name, password):
+    """Create a user with their own workspace database."""
+    user = User(username=name, password=generate_password_hash(password))
+    db.session.add(user)
+    db.session.commit()
+    path = get_workspaces().create(user.id)
+    click.echo(f"Created workspace {name} at {path}")
+
+
+def init_workspaces(app):
+    app.cli.add_command(create_workspace_command)
+    app.extensions['workspaces'] = WorkspaceEngines(app)
+    if not app.config.get('WORKSPACES_ENABLED'):
+        return
+    app.before_request(_select_workspace)
+    app.after_request(_vary_on_workspace)
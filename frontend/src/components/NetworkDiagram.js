@@ -72,6 +72,25 @@ export const NetworkDiagram = () => {
         .append("title")
             .text(function(d) { return d.entity.name ? d.entity.name : ""; }) // Use entity.name if it exists
     
+        // The server sends a precomputed layout.  Scale it to the svg and draw straight away
+        var hasLayout = data.nodes.length > 0 && data.nodes.every(d => d.x !== null && d.y !== null);
+        if (hasLayout) {
+            var xScale = d3.scaleLinear().domain(d3.extent(data.nodes, d => d.x)).range([0, width]);
+            var yScale = d3.scaleLinear().domain(d3.extent(data.nodes, d => d.y)).range([0, height]);
+            var positions = new Map(data.nodes.map(d => [d.node_id, {x: xScale(d.x), y: yScale(d.y)}]));
+
+            link
+            .attr("x1", function(d) { return positions.get(d.start).x; })
+            .attr("y1", function(d) { return positions.get(d.start).y; })
+            .attr("x2", function(d) { return positions.get(d.end).x; })
+            .attr("y2", function(d) { return positions.get(d.end).y; });
+
+            node
+            .attr("cx", function (d) { return positions.get(d.node_id).x; })
+            .attr("cy", function(d) { return positions.get(d.node_id).y; });
+            return;
+        }
+
         // Let's list the force we wanna apply on the network
         var simulation = d3.forceSimulation(data.nodes)                 // Force algorithm is applied to data.nodes
             .force("link", d3.forceLink()                               // This force provides links between nodes
@@ -0,0 +1,20 @@
+# Gunicorn settings for serving the API:  gunicorn -c gunicorn.conf.py
+# The schema and page text are set up once in the master before any workers are forked,
+# so each worker only has to build the Flask app itself.
+wsgi_app = "flaskr:create_app()"
+bind = "0.0.0.0:5000"
+workers = 4
+# Threads rather than greenlets: layouts, analytics and the job pool do blocking work which would
+# stall every greenlet in a gevent worker.  /events streams stay open, so they are served by
+# their own gevent process, see gunicorn.events.conf.py
+worker_class = "gthread"
+threads = 8
+
+
+def on_starting(server):
+    from flaskr import create_app
+    from flaskr.startup import prepare_database, startup_report
+
+    app = create_app()
+    prepare_database(app)
+    server.log.info(f"Database prepared: {startup_report(app)['phases']}")
@@ -0,0 +1,11 @@
+# Gunicorn settings for the /events stream alone:  gunicorn -c gunicorn.events.conf.py
+# Streams stay open for as long as a client is connected, so each is a greenlet in a gevent
+# worker rather than a whole thread.  Route only /events here (e.g. from the proxy in front of
+# both servers) and everything else to gunicorn.conf.py, so no blocking NumPy or job work ever
+# runs under gevent.  Changes made by the API workers reach these streams through the revision
+# counters, see broadcast.py.  The API server prepares the database, so this one doesn't.
+wsgi_app = "flaskr:create_app()"
+bind = "0.0.0.0:5001"
+workers = 1
+worker_class = "gevent"
+worker_connections = 1000
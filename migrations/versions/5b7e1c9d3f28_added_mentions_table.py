@@ -0,0 +1,40 @@
+"""Added mentions table
+
+Revision ID: 5b7e1c9d3f28
+Revises: a4f09c3e5d12
+Create Date: 2026-10-19 15:02:11.418302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e1c9d3f28'
+down_revision = 'a4f09c3e5d12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('mentions',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('node_id', sa.Integer(), nullable=False),
+    sa.Column('page_id', sa.Integer(), nullable=False),
+    sa.Column('start', sa.Integer(), nullable=False),
+    sa.Column('end', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['node_id'], ['nodes.id'], ),
+    sa.ForeignKeyConstraint(['page_id'], ['pages.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('mentions', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_mentions_node_id'), ['node_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_mentions_page_id'), ['page_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('mentions', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_mentions_page_id'))
+        batch_op.drop_index(batch_op.f('ix_mentions_node_id'))
+
+    op.drop_table('mentions')
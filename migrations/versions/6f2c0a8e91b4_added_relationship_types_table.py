@@ -0,0 +1,63 @@
+"""Added relationship types table
+
+Revision ID: 6f2c0a8e91b4
+Revises: e3a8d4b60c17
+Create Date: 2026-10-19 16:35:52.210947
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f2c0a8e91b4'
+down_revision = 'e3a8d4b60c17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('relationship_types',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('rel', sa.String(), nullable=False),
+    sa.Column('ler', sa.String(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('rel', 'ler', name='uq_relationship_types_rel_ler')
+    )
+    op.execute("INSERT INTO relationship_types (rel, ler) SELECT DISTINCT rel, ler FROM relationships")
+
+    with op.batch_alter_table('relationships', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('type_id', sa.Integer(), nullable=True))
+
+    op.execute(
+        "UPDATE relationships SET type_id = ("
+        "SELECT t.id FROM relationship_types t WHERE t.rel = relationships.rel AND t.ler = relationships.ler)"
+    )
+
+    with op.batch_alter_table('relationships', schema=None) as batch_op:
+        batch_op.alter_column('type_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_index(batch_op.f('ix_relationships_type_id'), ['type_id'], unique=False)
+        batch_op.create_foreign_key('fk_relationships_type_id', 'relationship_types', ['type_id'], ['id'])
+        batch_op.drop_column('ler')
+        batch_op.drop_column('rel')
+
+
+def downgrade():
+    with op.batch_alter_table('relationships', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('rel', sa.VARCHAR(), nullable=True))
+        batch_op.add_column(sa.Column('ler', sa.VARCHAR(), nullable=True))
+
+    op.execute(
+        "UPDATE relationships SET "
+        "rel = (SELECT t.rel FROM relationship_types t WHERE t.id = relationships.type_id), "
+        "ler = (SELECT t.ler FROM relationship_types t WHERE t.id = relationships.type_id)"
+    )
+
+    with op.batch_alter_table('relationships', schema=None) as batch_op:
+        batch_op.alter_column('rel', existing_type=sa.VARCHAR(), nullable=False)
+        batch_op.alter_column('ler', existing_type=sa.VARCHAR(), nullable=False)
+        batch_op.drop_constraint('fk_relationships_type_id', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_relationships_type_id'))
+        batch_op.drop_column('type_id')
+
+    op.drop_table('relationship_types')
@@ -0,0 +1,28 @@
+"""Added revisions table for cache invalidation
+
+Revision ID: 8d2e6f1b7a90
+Revises: 3c51d0a9e2f4
+Create Date: 2026-10-19 11:03:27.551902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2e6f1b7a90'
+down_revision = '3c51d0a9e2f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('revisions',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('revisions')
@@ -0,0 +1,56 @@
+"""Added normalised unique tag name
+
+Revision ID: a4f09c3e5d12
+Revises: 8d2e6f1b7a90
+Create Date: 2026-10-19 13:41:05.730164
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from flaskr.models import Tag
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4f09c3e5d12'
+down_revision = '8d2e6f1b7a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tags', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('name_key', sa.String(), nullable=True))
+
+    # Keys are made in Python, as SQLite's lower() only folds ASCII and new tags are keyed with
+    # Tag.normalise.  The old case-insensitive check didn't trim, so names can already collide:
+    # the first live tag keeps its name and the others are renamed "name (2)", "name (3)"...
+    connection = op.get_bind()
+    rows = connection.execute(sa.text(
+        "SELECT id, name FROM tags ORDER BY CASE WHEN deleted = 1 THEN 1 ELSE 0 END, id"
+    )).all()
+    taken = {Tag.normalise(name) for _, name in rows}
+    used, updates = set(), []
+    for id, name in rows:
+        key = Tag.normalise(name)
+        if key in used:
+            n = 2
+            while Tag.normalise(f"{name.strip()} ({n})") in taken:
+                n += 1
+            name = f"{name.strip()} ({n})"
+            key = Tag.normalise(name)
+            taken.add(key)
+        used.add(key)
+        updates.append({'id': id, 'name': name, 'name_key': key})
+    if updates:
+        connection.execute(sa.text("UPDATE tags SET name = :name, name_key = :name_key WHERE id = :id"), updates)
+
+    with op.batch_alter_table('tags', schema=None) as batch_op:
+        batch_op.alter_column('name_key', existing_type=sa.String(), nullable=False)
+        batch_op.create_index(batch_op.f('ix_tags_name_key'), ['name_key'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('tags', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tags_name_key'))
+        batch_op.drop_column('name_key')
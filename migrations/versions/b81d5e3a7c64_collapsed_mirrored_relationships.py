@@ -0,0 +1,47 @@
+"""Collapsed mirrored relationships into one row per link
+
+Revision ID: b81d5e3a7c64
+Revises: 6f2c0a8e91b4
+Create Date: 2026-10-19 17:20:48.611530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81d5e3a7c64'
+down_revision = '6f2c0a8e91b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the lower id of each mirrored pair.  The link is live if either half of it was.
+    op.execute(
+        "UPDATE relationships SET deleted = 0 "
+        "WHERE deleted = 1 AND EXISTS ("
+        "SELECT 1 FROM relationships r WHERE r.start = relationships.\"end\" AND r.\"end\" = relationships.start "
+        "AND r.id > relationships.id AND (r.deleted IS NULL OR r.deleted != 1))"
+    )
+    op.execute(
+        "DELETE FROM relationships WHERE EXISTS ("
+        "SELECT 1 FROM relationships r WHERE r.start = relationships.\"end\" AND r.\"end\" = relationships.start "
+        "AND r.id < relationships.id)"
+    )
+
+    with op.batch_alter_table('relationships', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_relationships_start'), ['start'], unique=False)
+        batch_op.create_index(batch_op.f('ix_relationships_end'), ['end'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('relationships', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_relationships_end'))
+        batch_op.drop_index(batch_op.f('ix_relationships_start'))
+
+    # Write the reverse row of every link back out
+    op.execute(
+        "INSERT INTO relationships (created, start, \"end\", type_id, deleted) "
+        "SELECT created, \"end\", start, type_id, deleted FROM relationships WHERE start != \"end\""
+    )
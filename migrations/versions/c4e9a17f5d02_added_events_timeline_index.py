@@ -0,0 +1,29 @@
+"""Added events timeline index
+
+Revision ID: c4e9a17f5d02
+Revises: b81d5e3a7c64
+Create Date: 2026-10-19 17:58:03.127745
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e9a17f5d02'
+down_revision = 'b81d5e3a7c64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.create_index(
+            'ix_events_timeline', ['date', 'id'], unique=False,
+            sqlite_where=sa.text('date IS NOT NULL AND deleted IS NOT 1')
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.drop_index('ix_events_timeline')
@@ -0,0 +1,26 @@
+"""Added detached flag to notes
+
+Revision ID: d5f2b8c31a46
+Revises: c4e9a17f5d02
+Create Date: 2026-10-19 19:12:40.381204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5f2b8c31a46'
+down_revision = 'c4e9a17f5d02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('detached', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('notes', schema=None) as batch_op:
+        batch_op.drop_column('detached')
@@ -0,0 +1,42 @@
+"""Added page tokens table
+
+Revision ID: e3a8d4b60c17
+Revises: 5b7e1c9d3f28
+Create Date: 2026-10-19 15:47:36.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a8d4b60c17'
+down_revision = '5b7e1c9d3f28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('page_tokens',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('token', sa.String(), nullable=False),
+    sa.Column('page_id', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('start', sa.Integer(), nullable=False),
+    sa.Column('end', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['page_id'], ['pages.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('page_tokens', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_page_tokens_token'), ['token'], unique=False)
+        batch_op.create_index('ix_page_tokens_page_id_position', ['page_id', 'position'], unique=False)
+
+    # Existing pages are indexed by `flask populate-pages`
+
+
+def downgrade():
+    with op.batch_alter_table('page_tokens', schema=None) as batch_op:
+        batch_op.drop_index('ix_page_tokens_page_id_position')
+        batch_op.drop_index(batch_op.f('ix_page_tokens_token'))
+
+    op.drop_table('page_tokens')